@@ -0,0 +1,469 @@
+import os
+import sys
+import json
+import time
+import random
+import collections
+import shutil
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+#######################################
+#
+# Reproducible benchmark of the import, sync, classify and latest folder paths.
+#
+# A synthetic staging folder and destination library are generated from a
+# seed, then each entry point runs twice: "cold" on a fresh destination (and
+# with the OS file cache dropped when allowed), then "warm" on the result of
+# the cold run. Wall time, system call counts, files/s and MB/s are written to
+# JSON so results can be compared across commits with --compare.
+#
+# The "startup" entry times the command line itself: PhonePhotoImporter.py
+# started with "<action> --help" in a new interpreter, which only loads the
+# common modules. It fails the run when the median, less the start of the
+# interpreter alone, goes over startup_budget_ms.
+#
+# The "names" entry times ClassifyPhotos() on classify_names generated file
+# names, without a folder, and fails the run when the median goes over
+# classify_budget_ms.
+#
+# The journals, catalogs and metadata caches of the runs are kept in the
+# temporary folder of the benchmark, not in the user's cache folder.
+#
+
+# Benchmark parameters
+default_params = {
+    "files": 1000,         # Number of staged files
+    "video_ratio": 0.05,   # Fraction of staged files that are videos
+    "dup_ratio": 0.05,     # Fraction of staged files that are renamed copies of others
+    "imported_ratio": 0.5, # Fraction of staged files already in the destination
+    "days": 365,           # Spread of the file dates
+    "size_scale": 0.05,    # Multiplier applied to real photo/video sizes
+    "seed": 1,
+    "catalog": 0,          # 1 to run import, sync and latest with a DestinationCatalog
+    "startup_runs": 10,    # Number of times each command line is started
+    "startup_budget_ms": 100,
+    "classify_names": 1000000, # Number of names classified by the names entry
+    "classify_runs": 3,
+    "classify_budget_ms": 1000,
+}
+
+all_entries = ["import", "sync", "classify", "latest", "startup", "names"]
+
+# Command lines timed by the startup entry
+startup_actions = ["import", "sync"]
+
+# Sizes of real files: photos around 3MB, videos around 60MB.
+# The files are sparse after a unique header so large trees are cheap to generate.
+def SyntheticSize(a_rng, a_is_video, a_scale):
+    median = 60*1024*1024 if a_is_video else 3*1024*1024
+    size = int(a_rng.lognormvariate(0, 0.5) * median * a_scale)
+    return max(size, 4096)
+
+def WriteSyntheticFile(a_path, a_size, a_rng):
+    with open(a_path, "wb") as f:
+        f.write(a_rng.randbytes(min(4096, a_size)))
+        f.truncate(a_size)
+
+#######################################
+#
+# Generate the staging folder and the destination library under a_root.
+# Returns (stage dir, dest dir, total staged bytes).
+#
+def GenerateTrees(a_root, a_params):
+    rng = random.Random(a_params["seed"])
+    stage_dir = os.path.join(a_root, "stage")
+    dest_dir = os.path.join(a_root, "dest")
+    os.makedirs(stage_dir)
+    os.makedirs(dest_dir)
+
+    first_day = time.mktime((2023, 1, 1, 12, 0, 0, 0, 0, -1))
+    total_bytes = 0
+    originals = []
+    for i in range(a_params["files"]):
+        if originals and rng.random() < a_params["dup_ratio"]:
+            # Renamed duplicate of an earlier file, like PXL_..~2.jpg
+            source = rng.choice(originals)
+            base, ext = os.path.splitext(os.path.basename(source))
+            path = os.path.join(stage_dir, f"{base}~{i}{ext}")
+            shutil.copyfile(source, path)
+            total_bytes += os.path.getsize(path)
+            continue
+
+        day = time.localtime(first_day + rng.randrange(a_params["days"]) * 86400)
+        is_video = rng.random() < a_params["video_ratio"]
+        name = f"PXL_{time.strftime('%Y%m%d', day)}_{i:09d}.{'mp4' if is_video else 'jpg'}"
+        path = os.path.join(stage_dir, name)
+        size = SyntheticSize(rng, is_video, a_params["size_scale"])
+        WriteSyntheticFile(path, size, rng)
+        originals.append(path)
+        total_bytes += size
+
+        if rng.random() < a_params["imported_ratio"]:
+            folder = os.path.join(dest_dir, time.strftime("%Y-%m-%d", day))
+            os.makedirs(folder, exist_ok=True)
+            shutil.copyfile(path, os.path.join(folder, name))
+
+    # Mark the older half of the folders as completed imports
+    folders = sorted(os.listdir(dest_dir))
+    for folder in folders[:len(folders) // 2]:
+        os.rename(os.path.join(dest_dir, folder), os.path.join(dest_dir, folder + "_"))
+
+    return (stage_dir, dest_dir, total_bytes)
+
+#######################################
+#
+# System call counters.
+#
+# Read and write calls come from /proc/self/io where available. stat calls
+# made through os.stat (os.path.getsize, isfile, isdir, exists, ...) are
+# counted by wrapping it, and other file system operations through audit
+# events (open, os.listdir, os.scandir, os.mkdir, shutil.copyfile, ...).
+#
+class SyscallCounter:
+    audited_events = ("open", "os.listdir", "os.scandir", "os.mkdir", "os.rename", "os.remove",
+                      "os.link", "shutil.copyfile", "shutil.move")
+    hook_installed = False
+    active = None
+
+    def __init__(self):
+        self.counts = {}
+
+    @staticmethod
+    def __readProcIo():
+        try:
+            with open("/proc/self/io") as f:
+                values = dict(line.split(": ") for line in f.read().splitlines())
+            return int(values["syscr"]), int(values["syscw"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def __audit(a_event, a_args):
+        counter = SyscallCounter.active
+        if counter is not None and a_event in SyscallCounter.audited_events:
+            counter.counts[a_event] = counter.counts.get(a_event, 0) + 1
+
+    def __enter__(self):
+        # Audit hooks cannot be removed, install one for the whole process
+        if not SyscallCounter.hook_installed:
+            sys.addaudithook(SyscallCounter.__audit)
+            SyscallCounter.hook_installed = True
+        self.__io_start = self.__readProcIo()
+        self.__os_stat = os.stat
+        counts = self.counts
+        os_stat = os.stat
+        def counting_stat(*args, **kwargs):
+            counts["stat"] = counts.get("stat", 0) + 1
+            return os_stat(*args, **kwargs)
+        os.stat = counting_stat
+        SyscallCounter.active = self
+        return self
+
+    def __exit__(self, *exc):
+        SyscallCounter.active = None
+        os.stat = self.__os_stat
+        io_end = self.__readProcIo()
+        if self.__io_start and io_end:
+            self.counts["read"] = io_end[0] - self.__io_start[0]
+            self.counts["write"] = io_end[1] - self.__io_start[1]
+        return False
+
+# Drop the OS file cache. Only possible as root on Linux, returns False otherwise.
+def DropFileCache():
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except (OSError, AttributeError):
+        return False
+
+#######################################
+#
+# Run one entry point and measure it.
+#
+# The catalog, when a_catalog_db is set, is opened and refreshed as part of
+# the measured time, as main() does.
+#
+def RunEntry(a_entry, a_stage_dir, a_dest_dir, a_sync_dir, a_jobs, a_catalog_db=None):
+    # Imported here so Benchmark.py can generate trees without the importer's
+    # dependencies, and once the cache folder is set, see RunBenchmark()
+    import PhonePhotoImporter
+    from DestinationCatalog import DestinationCatalog
+    from PhotoClassifier import ClassifyPhotos
+
+    with SyscallCounter() as counter, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        catalog = None
+        if a_catalog_db and a_entry != "classify":
+            catalog = DestinationCatalog(a_sync_dir if a_entry == "sync" else a_dest_dir, a_catalog_db)
+            catalog.refresh()
+        if a_entry == "import":
+            PhonePhotoImporter.ImportPhonePhotos(a_stage_dir, a_dest_dir, a_jobs, catalog)
+        elif a_entry == "sync":
+            PhonePhotoImporter.sync_directories(a_stage_dir, a_sync_dir, catalog)
+        elif a_entry == "classify":
+            collections.deque(ClassifyPhotos(a_stage_dir), maxlen=0)
+        elif a_entry == "latest":
+            PhonePhotoImporter.DateOfLatestFolder(a_dest_dir, must_have_underscore=True, a_catalog=catalog)
+        if catalog:
+            catalog.close()
+        elapsed = time.perf_counter() - start
+    return elapsed, counter.counts
+
+#######################################
+#
+# Time the start of the command line, a new interpreter each time.
+#
+# "python" is the interpreter alone, which is taken off the time of the
+# command lines before comparing it with the budget. A first untimed run
+# writes the bytecode of the modules, as an installed copy has it, then the
+# median of a_params["startup_runs"] runs is reported.
+#
+def RunStartup(a_params):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PhonePhotoImporter.py")
+    command_lines = {"python": [sys.executable, "-c", "pass"]}
+    for action in startup_actions:
+        command_lines[action] = [sys.executable, script, action, "--help"]
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    results = []
+    python_time = 0.0
+    for name, command_line in command_lines.items():
+        subprocess.run(command_line, stdout=subprocess.DEVNULL, check=True, env=env)
+        times = []
+        for _ in range(a_params["startup_runs"]):
+            start = time.perf_counter()
+            subprocess.run(command_line, stdout=subprocess.DEVNULL, check=True, env=env)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        median = times[len(times) // 2]
+        if name == "python":
+            python_time = median
+        own_time = median - python_time
+        over_budget = own_time * 1000 > a_params["startup_budget_ms"]
+        results.append({
+            "entry": f"startup {name}",
+            "run": "median",
+            "wall_s": round(median, 4),
+            "min_s": round(times[0], 4),
+            "max_s": round(times[-1], 4),
+            "own_s": round(own_time, 4),
+            "over_budget": over_budget,
+            "syscalls": {},
+        })
+        print(f"{'startup ' + name:>16}: {median * 1000:8.1f}ms median  {times[0] * 1000:8.1f}ms min  "
+              f"{own_time * 1000:8.1f}ms own" + ("  OVER BUDGET" if over_budget else ""))
+    return results
+
+#######################################
+#
+# Time the classification of names alone, as a phone listing gives them.
+#
+# Mostly camera names, with some WhatsApp media, screenshots and names that
+# follow no scheme. The median of a_params["classify_runs"] runs is reported.
+#
+def GenerateNames(a_params):
+    rng = random.Random(a_params["seed"])
+    names = []
+    for i in range(a_params["classify_names"]):
+        date = f"2023{rng.randrange(1, 13):02d}{rng.randrange(1, 29):02d}"
+        kind = rng.random()
+        if kind < 0.8:
+            names.append(f"PXL_{date}_{i:09d}.{'mp4' if rng.random() < a_params['video_ratio'] else 'jpg'}")
+        elif kind < 0.9:
+            names.append(f"IMG-{date}-WA{i % 10000:04d}.jpg")
+        elif kind < 0.95:
+            names.append(f"Screenshot_{date}-{i % 1000000:06d}.png")
+        else:
+            names.append(f"DSC{i % 100000:05d}.JPG")
+    return names
+
+def RunClassifyNames(a_params):
+    from PhotoClassifier import ClassifyPhotos
+
+    names = GenerateNames(a_params)
+    times = []
+    for _ in range(a_params["classify_runs"]):
+        start = time.perf_counter()
+        collections.deque(ClassifyPhotos(names), maxlen=0)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    median = times[len(times) // 2]
+    over_budget = median * 1000 > a_params["classify_budget_ms"]
+    print(f"{'names':>10}: {median:8.3f}s median  {len(names) / median:.0f} names/s"
+          + ("  OVER BUDGET" if over_budget else ""))
+    return [{
+        "entry": "names",
+        "run": "median",
+        "wall_s": round(median, 4),
+        "min_s": round(times[0], 4),
+        "max_s": round(times[-1], 4),
+        "files": len(names),
+        "files_per_s": round(len(names) / median, 1),
+        "over_budget": over_budget,
+        "syscalls": {},
+    }]
+
+def RunBenchmark(a_params, a_entries, a_jobs):
+    results = []
+    if "startup" in a_entries:
+        results.extend(RunStartup(a_params))
+    if "names" in a_entries:
+        results.extend(RunClassifyNames(a_params))
+    a_entries = [entry for entry in a_entries if entry not in ("startup", "names")]
+    if not a_entries:
+        return MakeReport(a_params, a_jobs, results)
+
+    with tempfile.TemporaryDirectory(prefix="ppi_bench_") as root:
+        print(f"Generating {a_params['files']} files in {root}...")
+        stage_dir, dest_template, total_bytes = GenerateTrees(root, a_params)
+        num_files = len(os.listdir(stage_dir))
+        # Read by defaults.py when the importer is first imported
+        os.environ["PHOTO_IMPORTER_CACHE"] = os.path.join(root, "cache")
+
+        for entry in a_entries:
+            # Every entry starts from the same generated destination
+            dest_dir = os.path.join(root, f"dest_{entry}")
+            sync_dir = os.path.join(root, f"sync_{entry}")
+            shutil.copytree(dest_template, dest_dir)
+            for run in ("cold", "warm"):
+                cache_dropped = DropFileCache() if run == "cold" else False
+                catalog_db = os.path.join(root, f"catalog_{entry}.db") if a_params["catalog"] else None
+                elapsed, syscalls = RunEntry(entry, stage_dir, dest_dir, sync_dir, a_jobs, catalog_db)
+                result = {
+                    "entry": entry,
+                    "run": run,
+                    "cache_dropped": cache_dropped,
+                    "wall_s": round(elapsed, 4),
+                    "files": num_files,
+                    "files_per_s": round(num_files / elapsed, 1) if elapsed > 0 else None,
+                    "mb_per_s": round(total_bytes / elapsed / (1024*1024), 1) if elapsed > 0 and entry in ("import", "sync") else None,
+                    "syscalls": syscalls,
+                }
+                results.append(result)
+                print(f"{entry:>10} {run:>5}: {elapsed:8.3f}s  {result['files_per_s']} files/s  "
+                      f"{sum(syscalls.values())} syscalls")
+            shutil.rmtree(dest_dir)
+            shutil.rmtree(sync_dir, ignore_errors=True)
+
+    return MakeReport(a_params, a_jobs, results)
+
+def MakeReport(a_params, a_jobs, a_results):
+    return {
+        "commit": GitCommit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": a_params,
+        "jobs": a_jobs,
+        "results": a_results,
+    }
+
+def GitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+#######################################
+#
+# Compare two benchmark reports
+#
+def CompareReports(a_old_file, a_new_file):
+    with open(a_old_file) as f:
+        old = json.load(f)
+    with open(a_new_file) as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    old_results = {(r["entry"], r["run"]): r for r in old["results"]}
+    for r in new["results"]:
+        o = old_results.get((r["entry"], r["run"]))
+        if not o:
+            continue
+        change = (r["wall_s"] - o["wall_s"]) / o["wall_s"] * 100 if o["wall_s"] else 0
+        print(f"{r['entry']:>10} {r['run']:>5}: {o['wall_s']:8.3f}s -> {r['wall_s']:8.3f}s ({change:+.1f}%)   "
+              f"syscalls {sum(o['syscalls'].values())} -> {sum(r['syscalls'].values())}")
+
+def DisplayHelp():
+    help_text = """
+Usage: python Benchmark.py [options]
+       python Benchmark.py --compare old.json new.json
+
+Options:
+  --files N          Number of staged files (default 1000)
+  --video-ratio R    Fraction of videos (default 0.05)
+  --dup-ratio R      Fraction of renamed duplicates (default 0.05)
+  --imported-ratio R Fraction of files already in the destination (default 0.5)
+  --days N           Spread of the file dates in days (default 365)
+  --size-scale R     Multiplier applied to real photo/video sizes (default 0.05)
+  --seed N           Random seed (default 1)
+  --catalog 0|1      Use a DestinationCatalog for import, sync and latest (default 0)
+  --entries LIST     Comma separated entry points: import,sync,classify,latest,startup,names
+  --startup-runs N   Number of times each command line is started (default 10)
+  --startup-budget-ms N
+                     Startup time, less the interpreter's, over which the run
+                     fails (default 100)
+  --classify-names N Number of names classified by the names entry (default 1000000)
+  --classify-runs N  Number of times the names are classified (default 3)
+  --classify-budget-ms N
+                     Time to classify the names over which the run fails
+                     (default 1000)
+  -j N, --jobs N     Jobs passed to ImportPhonePhotos (default 1)
+  -o FILE            Write the JSON report to FILE
+  """
+    print(help_text)
+
+def main():
+    params = dict(default_params)
+    entries = list(all_entries)
+    jobs = 1
+    output = None
+
+    args = sys.argv[1:]
+    if args[:1] == ["--compare"] and len(args) == 3:
+        CompareReports(args[1], args[2])
+        return
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        value = args[i + 1] if i + 1 < len(args) else None
+        i += 2
+        key = arg.lstrip("-").replace("-", "_")
+        if arg in ("-h", "/h", "--help"):
+            DisplayHelp()
+            return
+        elif value is None:
+            print(f"Error: {arg} requires a value.")
+            return
+        elif key in params:
+            params[key] = type(default_params[key])(value)
+        elif arg == "--entries":
+            entries = value.split(",")
+        elif arg in ("-j", "--jobs"):
+            jobs = int(value)
+        elif arg == "-o":
+            output = value
+        else:
+            print(f"Unrecognized argument: {arg}")
+            return
+
+    report = RunBenchmark(params, entries, jobs)
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {output}")
+    else:
+        print(json.dumps(report, indent=2))
+    over_budget = [result["entry"] for result in report["results"] if result.get("over_budget")]
+    if over_budget:
+        print(f"Over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
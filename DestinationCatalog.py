@@ -0,0 +1,297 @@
+import os
+import sqlite3
+import time
+import hashlib
+import threading
+
+# Importer parameters
+from defaults import *
+from PhotoClassifier import GetDateFromFolderName
+
+class DestinationCatalog:
+    """
+    On-disk catalog of a destination directory.
+
+    The catalog remembers every file of the destination tree: name, size,
+    mtime and an optional content hash. A folder is only listed again when its
+    modification time differs from the one stored in the catalog, so a
+    refresh of an unchanged library costs a single listing of the destination
+    root (plus one stat per folder nested below the date folders).
+
+    Folders are identified by their path relative to the destination, files
+    in the destination root are stored under the folder name "".
+
+    Note that a directory's mtime changes when files are added, removed or
+    renamed, but not when an existing file is rewritten in place. Use
+    refresh(a_full=True) after modifying files outside of the importer.
+
+    A folder whose mtime is less than mtime_resolution old when it is read
+    may still change within the same mtime (FAT and SMB keep it to 2
+    seconds), it is stored as unknown and listed again by the next refresh.
+    """
+    mtime_resolution = 2.0
+    ###########################
+    # Constructor
+    def __init__(self, a_dest_dir, a_db_path=None):
+        self.dest_dir = os.path.abspath(a_dest_dir)
+        if a_db_path is None:
+            a_db_path = DefaultCatalogPath(self.dest_dir)
+        os.makedirs(os.path.dirname(os.path.abspath(a_db_path)), exist_ok=True)
+
+        # Importer worker threads use the catalog concurrently, all access to
+        # the connection and to the in-memory folder cache goes through the lock.
+        self.__lock = threading.RLock()
+        self.__db = sqlite3.connect(a_db_path, check_same_thread=False)
+        self.__db.executescript("""
+            CREATE TABLE IF NOT EXISTS folders (
+                name  TEXT PRIMARY KEY,
+                mtime REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                folder TEXT NOT NULL,
+                name   TEXT NOT NULL,
+                size   INTEGER NOT NULL,
+                mtime  REAL NOT NULL,
+                hash   TEXT,
+                PRIMARY KEY (folder, name)
+            );
+        """)
+        self.__folders = {}       # folder name -> mtime, for every known folder
+        self.__files = {}         # folder name -> {file name: (size, mtime, hash)}, loaded lazily
+        self.__touched = set()    # folders modified by the importer since the last commit
+        self.__written = {}       # folder name -> mtime after the importer's last write in it
+        self.__num_rescanned = 0
+
+    ###########################
+    # Bring the catalog up to date with the destination directory.
+    # Only folders whose mtime changed are listed again, unless a_full is True.
+    def refresh(self, a_full=False):
+        with self.__lock:
+            stored = dict(self.__db.execute("SELECT name, mtime FROM folders"))
+            children = {}
+            for name in stored:
+                children.setdefault(os.path.dirname(name), []).append(name)
+            current = {}
+            self.__num_rescanned = 0
+
+            # The root listing is always fresh, keep known hashes of unchanged files
+            pending = []
+            if os.path.isdir(self.dest_dir):
+                pending = self.__rescanFolder("")
+
+            # Walk down the tree. A folder with an unchanged mtime has the same
+            # files and subfolders as in the catalog, only its subfolders
+            # need to be checked.
+            while pending:
+                name, mtime = pending.pop()
+                current[name] = mtime
+                if a_full or stored.get(name) != mtime:
+                    # The mtime was read before the listing, a change made
+                    # while listing the folder is seen by the next refresh
+                    pending += self.__rescanFolder(name)
+                    self.__db.execute("INSERT OR REPLACE INTO folders (name, mtime) VALUES (?, ?)",
+                                      (name, self.__storedMtime(mtime)))
+                else:
+                    for child in children.get(name, []):
+                        try:
+                            pending.append((child, os.stat(os.path.join(self.dest_dir, child)).st_mtime))
+                        except OSError:
+                            pass
+
+            # Forget folders that no longer exist
+            for name in stored.keys() - current.keys():
+                self.__db.execute("DELETE FROM files WHERE folder = ?", (name,))
+                self.__db.execute("DELETE FROM folders WHERE name = ?", (name,))
+                self.__files.pop(name, None)
+
+            self.__folders = current
+            self.__db.commit()
+
+    ###########################
+    # Number of folders listed again by the last refresh
+    def numRescannedFolders(self):
+        return self.__num_rescanned
+
+    # mtime to store for a folder, 0.0 (never the mtime of a folder) when it
+    # is too recent to tell the changes that follow within the same mtime
+    def __storedMtime(self, a_mtime):
+        return a_mtime if time.time() - a_mtime >= self.mtime_resolution else 0.0
+
+    # Remember the mtime of a folder right after the importer wrote in it
+    def __recordWrite(self, a_folder):
+        if a_folder == "":
+            return
+        try:
+            self.__written[a_folder] = os.stat(os.path.join(self.dest_dir, a_folder)).st_mtime
+        except OSError:
+            self.__written.pop(a_folder, None)
+
+    # List a folder and store its files.
+    # Returns its subfolders as a list of (relative path, mtime).
+    def __rescanFolder(self, a_folder):
+        files = {}
+        subfolders = []
+        with os.scandir(os.path.join(self.dest_dir, a_folder)) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    st = entry.stat()
+                    files[entry.name] = (st.st_size, st.st_mtime)
+                elif entry.is_dir():
+                    subfolders.append((os.path.join(a_folder, entry.name), entry.stat().st_mtime))
+        self.__storeFolderFiles(a_folder, files)
+        if a_folder:
+            self.__num_rescanned += 1
+        return subfolders
+
+    # Replace the catalog content of a folder with a_files (name -> (size, mtime)).
+    # Hashes are kept for files whose size and mtime did not change.
+    def __storeFolderFiles(self, a_folder, a_files):
+        old = self.__loadFolder(a_folder)
+        rows = []
+        for name, (size, mtime) in a_files.items():
+            file_hash = None
+            if name in old and old[name][0] == size and old[name][1] == mtime:
+                file_hash = old[name][2]
+            rows.append((a_folder, name, size, mtime, file_hash))
+        self.__db.execute("DELETE FROM files WHERE folder = ?", (a_folder,))
+        self.__db.executemany("INSERT INTO files (folder, name, size, mtime, hash) VALUES (?, ?, ?, ?, ?)", rows)
+        self.__files[a_folder] = {r[1]: (r[2], r[3], r[4]) for r in rows}
+
+    def __loadFolder(self, a_folder):
+        files = self.__files.get(a_folder)
+        if files is None:
+            files = {}
+            for name, size, mtime, file_hash in self.__db.execute(
+                    "SELECT name, size, mtime, hash FROM files WHERE folder = ?", (a_folder,)):
+                files[name] = (size, mtime, file_hash)
+            self.__files[a_folder] = files
+        return files
+
+    ###########################
+    # Queries
+    def hasFolder(self, a_folder):
+        with self.__lock:
+            return a_folder in self.__folders
+
+    # Relative paths of all the folders, a_top_level_only to get only the
+    # folders directly in the destination root (the date folders).
+    def folderNames(self, a_top_level_only=False):
+        with self.__lock:
+            if a_top_level_only:
+                return [name for name in self.__folders if not os.path.dirname(name)]
+            return list(self.__folders)
+
+    # Size of a_folder/a_name, or None if the file is not in the catalog
+    def getFileSize(self, a_folder, a_name):
+        with self.__lock:
+            entry = self.__loadFolder(a_folder).get(a_name)
+            return entry[0] if entry else None
+
+    def getFileHash(self, a_folder, a_name):
+        with self.__lock:
+            entry = self.__loadFolder(a_folder).get(a_name)
+            return entry[2] if entry else None
+
+    # Dictionary of file name -> size for a folder
+    def folderFiles(self, a_folder):
+        with self.__lock:
+            return {name: entry[0] for name, entry in self.__loadFolder(a_folder).items()}
+
+    # Every file of the catalog as (folder, name, size, hash)
+    def allFiles(self):
+        with self.__lock:
+            return [(folder, name, size, file_hash)
+                    for folder in list(self.__folders) + [""]
+                    for name, (size, _, file_hash) in self.__loadFolder(folder).items()]
+
+    # Same result as DateOfLatestFolder(), answered from the catalog:
+    # the date as YYYYMMDD, or None when no folder has one
+    def latestFolderDate(self, must_have_underscore=True):
+        latest_folder_date = ""
+        for name in self.folderNames(a_top_level_only=True):
+            if must_have_underscore and not name.endswith("_"):
+                continue
+            folder_date = GetDateFromFolderName(name)
+            if folder_date and folder_date > latest_folder_date:
+                latest_folder_date = folder_date
+        return latest_folder_date or None
+
+    ###########################
+    # Updates made by the importer
+    # The importer calls these once its write in the destination is done.
+    # Record a folder created by the importer, and its parent folders.
+    def addFolder(self, a_folder):
+        with self.__lock:
+            while a_folder:
+                if a_folder not in self.__folders:
+                    self.__folders[a_folder] = 0.0
+                    self.__files[a_folder] = {}
+                self.__touched.add(a_folder)
+                self.__recordWrite(a_folder)
+                a_folder = os.path.dirname(a_folder)
+
+    def recordFile(self, a_folder, a_name, a_size, a_mtime, a_hash=None):
+        with self.__lock:
+            self.__loadFolder(a_folder)[a_name] = (a_size, a_mtime, a_hash)
+            self.__db.execute("INSERT OR REPLACE INTO files (folder, name, size, mtime, hash) VALUES (?, ?, ?, ?, ?)",
+                              (a_folder, a_name, a_size, a_mtime, a_hash))
+            self.__touched.add(a_folder)
+            self.__recordWrite(a_folder)
+
+    def setFileHash(self, a_folder, a_name, a_hash):
+        with self.__lock:
+            files = self.__loadFolder(a_folder)
+            if a_name not in files:
+                return
+            size, mtime, _ = files[a_name]
+            files[a_name] = (size, mtime, a_hash)
+            self.__db.execute("UPDATE files SET hash = ? WHERE folder = ? AND name = ?", (a_hash, a_folder, a_name))
+
+    def removeFile(self, a_folder, a_name):
+        with self.__lock:
+            self.__loadFolder(a_folder).pop(a_name, None)
+            self.__db.execute("DELETE FROM files WHERE folder = ? AND name = ?", (a_folder, a_name))
+            self.__touched.add(a_folder)
+            self.__recordWrite(a_folder)
+
+    # Persist the updates. A folder written to by the importer keeps its
+    # files in the catalog until the next refresh only when its mtime is the
+    # one seen right after the importer's last write: another process did not
+    # change it since. Otherwise its mtime is stored as unknown and the next
+    # refresh lists it again.
+    def commit(self):
+        with self.__lock:
+            for name in self.__touched:
+                if name == "":
+                    continue
+                try:
+                    mtime = os.stat(os.path.join(self.dest_dir, name)).st_mtime
+                except OSError:
+                    continue
+                stored_mtime = self.__storedMtime(mtime) if self.__written.get(name) == mtime else 0.0
+                self.__db.execute("INSERT OR REPLACE INTO folders (name, mtime) VALUES (?, ?)", (name, stored_mtime))
+            self.__touched.clear()
+            self.__written.clear()
+            self.__db.commit()
+
+    def close(self):
+        with self.__lock:
+            self.commit()
+            self.__db.close()
+
+# Location of the catalog of a destination directory.
+# The catalog is kept on the local disk even when the destination is a network
+# share, SQLite locking over SMB/NFS is unreliable.
+def DefaultCatalogPath(a_dest_dir):
+    key = hashlib.sha1(os.path.abspath(a_dest_dir).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(default_cache_dir, f"catalog_{key}.db")
+
+def main():
+    catalog = DestinationCatalog(default_destination_dir)
+    catalog.refresh()
+    print(f"{len(catalog.folderNames())} folders, {catalog.numRescannedFolders()} rescanned.")
+    print(f"Latest folder: {catalog.latestFolderDate()}")
+    catalog.close()
+
+if __name__ == "__main__":
+    main()
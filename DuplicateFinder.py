@@ -0,0 +1,163 @@
+import os
+import sys
+import hashlib
+
+from Metrics import metrics, log
+
+# Size of the head and tail blocks read by PartialHash()
+partial_block_size = 64*1024
+
+# Chunk size used to stream whole files through the hash
+full_hash_chunk_size = 1024*1024
+
+# Hash of the first and last blocks of a file, and of its size.
+# Files with different partial hashes are certainly different. Files with the
+# same partial hash are very likely identical and need a full hash to be sure.
+@metrics.timer("hash_partial")
+def PartialHash(a_file, a_size=None):
+    if a_size is None:
+        a_size = os.path.getsize(a_file)
+    h = hashlib.blake2b(str(a_size).encode("ascii"), digest_size=16)
+    with open(a_file, "rb") as f:
+        h.update(f.read(partial_block_size))
+        if a_size > 2 * partial_block_size:
+            f.seek(a_size - partial_block_size)
+            h.update(f.read(partial_block_size))
+        elif a_size > partial_block_size:
+            h.update(f.read())
+    return h.hexdigest()
+
+# New hash object of the whole content of a file. FullHash() and the
+# verified copy of FileTransfer must produce the same digests.
+def ContentHash():
+    return hashlib.blake2b(digest_size=32)
+
+# Hash of the whole content of a file, read in chunks
+@metrics.timer("hash_full")
+def FullHash(a_file):
+    h = ContentHash()
+    with open(a_file, "rb") as f:
+        while True:
+            chunk = f.read(full_hash_chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+class DuplicateFinder:
+    """
+    Finds candidate files whose content already exists in a set of
+    reference files (typically the destination library) or in another
+    candidate.
+
+    Files are first grouped by size, which costs nothing when the sizes are
+    already known. Only the files sharing a size with another file are read:
+    first their head and tail blocks, then their whole content when the
+    partial hashes match. Full hashes already known for reference files (for
+    example from the DestinationCatalog) are reused, the ones computed are
+    available in computed_hashes so the caller can store them.
+    """
+    ###########################
+    # Constructor
+    def __init__(self, a_jobs=1):
+        self.jobs = max(1, a_jobs)
+        self.computed_hashes = {}
+        self.__refs = []           # (path, size)
+        self.__known_hashes = {}   # path -> full hash
+
+    def addReference(self, a_path, a_size, a_full_hash=None):
+        self.__refs.append((a_path, a_size))
+        if a_full_hash:
+            self.__known_hashes[a_path] = a_full_hash
+
+    ###########################
+    # Find the duplicates among a_candidates, a list of (path, size).
+    # Returns a dictionary candidate path -> path of the original file. When
+    # several candidates are identical, the first one in sorted order is the
+    # original.
+    def findDuplicates(self, a_candidates):
+        # 1. Group by size. Only groups containing a candidate and at least
+        # one other file can contain duplicates.
+        by_size = {}
+        for path, size in self.__refs:
+            by_size.setdefault(size, ([], []))[0].append(path)
+        for path, size in sorted(a_candidates):
+            by_size.setdefault(size, ([], []))[1].append(path)
+
+        groups = [(size, refs, cands) for size, (refs, cands) in by_size.items()
+                  if cands and len(refs) + len(cands) > 1]
+
+        # 2. Partial hashes of every file in those groups
+        to_hash = [(path, size) for size, refs, cands in groups for path in refs + cands]
+        partial = self.__hashAll(lambda p_s: PartialHash(p_s[0], p_s[1]), to_hash)
+
+        # 3. Full hashes of files sharing a partial hash
+        to_hash = []
+        sub_groups = []
+        for size, refs, cands in groups:
+            by_partial = {}
+            for path in refs:
+                by_partial.setdefault(partial.get(path), ([], []))[0].append(path)
+            for path in cands:
+                by_partial.setdefault(partial.get(path), ([], []))[1].append(path)
+            for key, (sub_refs, sub_cands) in by_partial.items():
+                if key is None or not sub_cands or len(sub_refs) + len(sub_cands) < 2:
+                    continue
+                sub_groups.append((sub_refs, sub_cands))
+                to_hash += [(path, size) for path in sub_refs + sub_cands if path not in self.__known_hashes]
+        full = dict(self.__known_hashes)
+        computed = self.__hashAll(lambda p_s: FullHash(p_s[0]), to_hash)
+        full.update(computed)
+        self.computed_hashes.update(computed)
+
+        # 4. Match candidates against references and earlier candidates
+        duplicates = {}
+        for sub_refs, sub_cands in sub_groups:
+            originals = {}
+            for path in sub_refs:
+                if full.get(path):
+                    originals.setdefault(full[path], path)
+            for path in sub_cands:
+                file_hash = full.get(path)
+                if not file_hash:
+                    continue
+                if file_hash in originals:
+                    duplicates[path] = originals[file_hash]
+                else:
+                    originals[file_hash] = path
+        return duplicates
+
+    # Apply a_func to every item, using a_jobs threads.
+    # Returns path -> result, unreadable files are left out.
+    def __hashAll(self, a_func, a_items):
+        def safe_hash(item):
+            try:
+                return a_func(item)
+            except OSError as e:
+                log.write(item[0], "Error reading file:", e)
+                return None
+
+        if self.jobs <= 1 or len(a_items) < 2:
+            results = map(safe_hash, a_items)
+        else:
+            import concurrent.futures
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs)
+            with pool:
+                results = list(pool.map(safe_hash, a_items))
+        return {item[0]: r for item, r in zip(a_items, results) if r}
+
+def main():
+    # Report the duplicates found in a folder
+    a_dir = sys.argv[1] if len(sys.argv) > 1 else "."
+    candidates = []
+    with os.scandir(a_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                candidates.append((entry.path, entry.stat().st_size))
+    duplicates = DuplicateFinder(a_jobs=4).findDuplicates(candidates)
+    for path, original in sorted(duplicates.items()):
+        print(f"{path} is a duplicate of {original}")
+    print(f"{len(duplicates)} duplicates in {len(candidates)} files.")
+
+if __name__ == "__main__":
+    main()
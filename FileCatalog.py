@@ -0,0 +1,310 @@
+import os
+import sys
+from array import array
+
+# Importer parameters
+from defaults import *
+from utils import *
+from PhotoClassifier import FileClass, ParseFileName
+
+#######################################
+#
+# Compact in-memory listing of a large number of files.
+#
+# A list of SourceFile tuples costs several hundred bytes per file: a tuple,
+# three strings and two numbers, each a separate object. A FileCatalog keeps
+# the same data in columns instead: the file names are packed in one UTF-8
+# string pool, the folders are stored once and referenced by index, and the
+# sizes, modification times, dates and classes are typed arrays: 33 bytes
+# per file plus its UTF-8 name, about 60 bytes for a camera file name such
+# as PXL_20230520_123456789.jpg.
+#
+# The rows are never copied once added. Filters return a selection, an
+# array of row numbers, and the iterations build the names or SourceFile
+# entries one at a time, so the qualify, classify and sync stages can all
+# work from the same catalog.
+#
+# With NumPy installed, the filters run on whole columns, viewed in place.
+# Without it, they run row by row with the same results.
+#
+
+# NumPy is imported on first use, listing and iterating do not need it
+numpy_module = None
+
+def Numpy():
+    global numpy_module
+    if numpy_module is None:
+        try:
+            import numpy
+            numpy_module = numpy
+        except ImportError:
+            numpy_module = False
+    return numpy_module or None
+
+class FileCatalog:
+    """
+    Columnar list of files: folder, name, size and mtime of every file, plus
+    the date (YYYYMMDD as an integer, 0 if unknown) and the FileClass of its
+    name, parsed on first use.
+
+    Rows are numbered from 0 in the order they are added. A selection is an
+    array("I") of row numbers, None meaning all the rows.
+    """
+    ###########################
+    # Constructor
+    def __init__(self, a_root=""):
+        self.root = a_root
+        self.__pool = bytearray()          # UTF-8 names, one after the other
+        self.__offsets = array("Q", [0])   # start of every name in the pool, and the end of the last one
+        self.__folders = []                # folder relative paths, "" for the root
+        self.__folder_index = {}           # folder -> index in __folders
+        self.__folder = array("I")
+        self.__size = array("q")
+        self.__mtime = array("d")
+        self.__date = array("I")
+        self.__class = array("B")
+
+    # Catalog of the files of a_source_dir, see ScanSourceFiles()
+    @staticmethod
+    def fromScan(a_source_dir, a_recursive=False, a_name_filter=None):
+        return FileCatalog.fromFiles(a_source_dir, ScanSourceFiles(a_source_dir, a_recursive, a_name_filter))
+
+    # Catalog of the SourceFile entries of a_files, relative to a_root
+    @staticmethod
+    def fromFiles(a_root, a_files):
+        catalog = FileCatalog(a_root)
+        for src in a_files:
+            catalog.add(os.path.dirname(src.rel_path), src.name, src.size, src.mtime)
+        return catalog
+
+    ###########################
+    # Rows
+    def add(self, a_folder, a_name, a_size, a_mtime=0.0):
+        folder = self.__folder_index.get(a_folder)
+        if folder is None:
+            folder = self.__folder_index[a_folder] = len(self.__folders)
+            self.__folders.append(a_folder)
+        self.__pool += a_name.encode("utf-8")
+        self.__offsets.append(len(self.__pool))
+        self.__folder.append(folder)
+        self.__size.append(a_size)
+        self.__mtime.append(a_mtime)
+
+    def __len__(self):
+        return len(self.__size)
+
+    def name(self, a_row):
+        return self.__pool[self.__offsets[a_row]:self.__offsets[a_row + 1]].decode("utf-8")
+
+    def folder(self, a_row):
+        return self.__folders[self.__folder[a_row]]
+
+    def relPath(self, a_row):
+        folder = self.__folders[self.__folder[a_row]]
+        return os.path.join(folder, self.name(a_row)) if folder else self.name(a_row)
+
+    def size(self, a_row):
+        return self.__size[a_row]
+
+    def mtime(self, a_row):
+        return self.__mtime[a_row]
+
+    def fileClass(self, a_row):
+        self.__parseNames()
+        return FileClass(self.__class[a_row])
+
+    # SourceFile entry of a row
+    def file(self, a_row):
+        rel_path = self.relPath(a_row)
+        return SourceFile(self.name(a_row), os.path.join(self.root, rel_path), rel_path,
+                          self.__size[a_row], self.__mtime[a_row])
+
+    # Bytes used by the columns
+    def nbytes(self):
+        columns = (self.__offsets, self.__folder, self.__size, self.__mtime, self.__date, self.__class)
+        return (len(self.__pool) + sum(column.itemsize * len(column) for column in columns)
+                + sum(len(folder) for folder in self.__folders))
+
+    # Fill the date and class columns for the rows added since the last call
+    def __parseNames(self):
+        for row in range(len(self.__class), len(self.__size)):
+            parsed = ParseFileName(self.name(row))
+            if parsed:
+                self.__date.append(int(parsed.date))
+                self.__class.append(parsed.file_class.value)
+            else:
+                self.__date.append(0)
+                self.__class.append(FileClass.UNKNOWN.value)
+
+    ###########################
+    # Iterations, over a selection or all the rows
+    def rows(self, a_selection=None):
+        return range(len(self)) if a_selection is None else a_selection
+
+    def names(self, a_selection=None):
+        pool = self.__pool
+        offsets = self.__offsets
+        for row in self.rows(a_selection):
+            yield pool[offsets[row]:offsets[row + 1]].decode("utf-8")
+
+    # (name, FileClass) of every row, as ClassifyPhotos() yields them
+    def classified(self, a_selection=None):
+        self.__parseNames()
+        for row, name in zip(self.rows(a_selection), self.names(a_selection)):
+            yield (name, FileClass(self.__class[row]))
+
+    def files(self, a_selection=None):
+        for row in self.rows(a_selection):
+            yield self.file(row)
+
+    def __iter__(self):
+        return self.files()
+
+    def totalSize(self, a_selection=None):
+        if a_selection is None:
+            return sum(self.__size)
+        return sum(self.__size[row] for row in a_selection)
+
+    ###########################
+    # Filters
+    # Returns the selection of the rows of a_selection (all the rows if None)
+    # with a size of at least a_min_size bytes, a date between a_since and
+    # a_until (YYYYMMDD, a_until excluded) and a class among a_classes.
+    # Files without a date in their name are kept by the date filters, as by
+    # IsNameBefore().
+    def select(self, a_min_size=None, a_since=None, a_until=None, a_classes=None, a_selection=None):
+        if a_since is not None or a_until is not None or a_classes is not None:
+            self.__parseNames()
+        since = int(a_since) if a_since else None
+        until = int(a_until) if a_until else None
+        class_values = {file_class.value for file_class in a_classes} if a_classes is not None else None
+
+        np = Numpy()
+        if np is None or not len(self):
+            return self.__selectRows(a_min_size, since, until, class_values, a_selection)
+        return self.__selectColumns(np, a_min_size, since, until, class_values, a_selection)
+
+    def __selectRows(self, a_min_size, a_since, a_until, a_class_values, a_selection):
+        selection = array("I")
+        for row in self.rows(a_selection):
+            if a_min_size is not None and self.__size[row] < a_min_size:
+                continue
+            date = self.__date[row] if a_since or a_until else 0
+            if a_since and date and date < a_since:
+                continue
+            if a_until and date and date >= a_until:
+                continue
+            if a_class_values is not None and self.__class[row] not in a_class_values:
+                continue
+            selection.append(row)
+        return selection
+
+    # The columns are viewed in place. The views are released on return, so
+    # rows can still be added to the catalog afterwards.
+    def __selectColumns(self, np, a_min_size, a_since, a_until, a_class_values, a_selection):
+        rows = None
+        if a_selection is not None:
+            if not len(a_selection):
+                return array("I")
+            rows = np.frombuffer(a_selection, dtype=np.uint32)
+
+        def column(a_array, a_dtype):
+            values = np.frombuffer(a_array, dtype=a_dtype)
+            return values if rows is None else values[rows]
+
+        mask = np.ones(len(self) if rows is None else len(rows), dtype=bool)
+        if a_min_size is not None:
+            mask &= column(self.__size, np.int64) >= a_min_size
+        if a_since or a_until:
+            dates = column(self.__date, np.uint32)
+            known = dates != 0
+            if a_since:
+                mask &= ~known | (dates >= a_since)
+            if a_until:
+                mask &= ~known | (dates < a_until)
+        if a_class_values is not None:
+            mask &= np.isin(column(self.__class, np.uint8), list(a_class_values))
+
+        selected = np.flatnonzero(mask) if rows is None else rows[mask]
+        selection = array("I")
+        selection.frombytes(selected.astype(np.uint32).tobytes())
+        return selection
+
+    # Rows of a_selection (all the rows if None) that are not in a_kept, a
+    # selection of them in ascending order, as select() returns it
+    def excluded(self, a_kept, a_selection=None):
+        np = Numpy()
+        if np is not None and len(self):
+            rows = np.arange(len(self), dtype=np.uint32) if a_selection is None else np.frombuffer(a_selection, dtype=np.uint32)
+            kept = np.frombuffer(a_kept, dtype=np.uint32) if len(a_kept) else np.zeros(0, dtype=np.uint32)
+            selection = array("I")
+            selection.frombytes(rows[~np.isin(rows, kept, assume_unique=True)].astype(np.uint32).tobytes())
+            return selection
+        excluded = array("I")
+        kept = iter(a_kept)
+        next_kept = next(kept, None)
+        for row in self.rows(a_selection):
+            if row == next_kept:
+                next_kept = next(kept, None)
+            else:
+                excluded.append(row)
+        return excluded
+
+    ###########################
+    # Order
+    # Selection of all the rows sorted by folder, then name
+    def sortedRows(self):
+        pool = self.__pool
+        offsets = self.__offsets
+        folder_rank = [0] * len(self.__folders)
+        for rank, index in enumerate(sorted(range(len(self.__folders)), key=self.__folders.__getitem__)):
+            folder_rank[index] = rank
+        folder = self.__folder
+        return array("I", sorted(range(len(self)),
+                                 key=lambda row: (folder_rank[folder[row]], pool[offsets[row]:offsets[row + 1]])))
+
+    # Sort key of a row, comparable between catalogs
+    def pathKey(self, a_row):
+        return (self.__folders[self.__folder[a_row]], self.__pool[self.__offsets[a_row]:self.__offsets[a_row + 1]])
+
+#######################################
+#
+# Match the files of two catalogs by relative path.
+#
+# Yields (row in a_first, row in a_second) in the order of the paths, with
+# None for the catalog where the path is missing. Both catalogs are sorted
+# and walked side by side, no dictionary of the paths is built.
+#
+def MatchFiles(a_first, a_second):
+    first_rows = a_first.sortedRows()
+    second_rows = a_second.sortedRows()
+    i = 0
+    j = 0
+    while i < len(first_rows) and j < len(second_rows):
+        first_key = a_first.pathKey(first_rows[i])
+        second_key = a_second.pathKey(second_rows[j])
+        if first_key < second_key:
+            yield (first_rows[i], None)
+            i += 1
+        elif second_key < first_key:
+            yield (None, second_rows[j])
+            j += 1
+        else:
+            yield (first_rows[i], second_rows[j])
+            i += 1
+            j += 1
+    for row in first_rows[i:]:
+        yield (row, None)
+    for row in second_rows[j:]:
+        yield (None, row)
+
+def main():
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else default_stage_dir
+    catalog = FileCatalog.fromScan(source_dir, a_recursive=True)
+    print(f"{len(catalog)} files, {catalog.totalSize():,} bytes, catalog of {catalog.nbytes():,} bytes")
+    for file_class in FileClass:
+        selection = catalog.select(a_classes=[file_class])
+        print(f"{file_class.name:>12}: {len(selection)} files, {catalog.totalSize(selection):,} bytes")
+
+if __name__ == "__main__":
+    main()
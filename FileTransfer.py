@@ -0,0 +1,325 @@
+import os
+import sys
+import errno
+import shutil
+import threading
+
+from DuplicateFinder import ContentHash
+
+#######################################
+#
+# Transfer of a file from the staging folder to the destination.
+#
+# Modes, from the cheapest to the most expensive:
+#   move             Rename the file. Free on the same file system.
+#   hardlink         Link the destination to the staged file. Free on the same
+#                    file system, both names then share the same data.
+#   reflink          Copy-on-write clone (FICLONE on btrfs/xfs). Free on the
+#                    same file system, the copies are independent.
+#   copy_file_range  Copy in the kernel with copy_file_range() or sendfile(),
+#                    without moving the data through user space.
+#   copy             shutil.copy2(), the original behaviour.
+#
+# When a mode is not supported for a pair of folders, the transfer falls back
+# to the next mode in its chain and the failure is remembered so the
+# unsupported mode is not tried again for the following files.
+#
+# A verified copy (TransferFileVerified) reads the source once and feeds
+# each chunk both to the content hash and to the destination, so the digest
+# of what was written comes at the cost of a plain copy.
+#
+
+transfer_modes = ["copy", "move", "hardlink", "reflink", "copy_file_range"]
+
+# Modes tried, in order, for each requested mode
+fallback_chains = {
+    "copy":            ["copy"],
+    "move":            ["move", "copy"],
+    "hardlink":        ["hardlink", "reflink", "copy_file_range", "copy"],
+    "reflink":         ["reflink", "copy_file_range", "copy"],
+    "copy_file_range": ["copy_file_range", "copy"],
+}
+
+# Error numbers meaning "this mode does not work here", as opposed to a real
+# failure (disk full, permission denied on the destination...).
+unsupported_errors = {errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOSYS, errno.ENOTTY,
+                      getattr(errno, "ENOTSUP", errno.EOPNOTSUPP), errno.EOPNOTSUPP, errno.EMLINK}
+
+FICLONE = 0x40049409
+
+class UnsupportedMode(Exception):
+    pass
+
+# (mode, source folder, destination folder) known not to work
+unsupported_modes = set()
+unsupported_lock = threading.Lock()
+
+def ReflinkFile(a_src, a_dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise UnsupportedMode("reflink")
+    with open(a_src, "rb") as fsrc, open(a_dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(a_src, a_dst)
+
+def KernelCopyFile(a_src, a_dst):
+    if sys.platform == "win32" or (not hasattr(os, "copy_file_range") and not hasattr(os, "sendfile")):
+        raise UnsupportedMode("copy_file_range")
+    with open(a_src, "rb") as fsrc, open(a_dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        in_fd = fsrc.fileno()
+        out_fd = fdst.fileno()
+        offset = 0
+        use_copy_file_range = hasattr(os, "copy_file_range")
+        while offset < size:
+            count = min(size - offset, 1 << 30)
+            if use_copy_file_range:
+                try:
+                    n = os.copy_file_range(in_fd, out_fd, count, offset, offset)
+                except OSError as e:
+                    # Older kernels refuse copies between file systems, sendfile does not
+                    if e.errno not in unsupported_errors or not hasattr(os, "sendfile"):
+                        raise
+                    use_copy_file_range = False
+                    continue
+            else:
+                n = os.sendfile(out_fd, in_fd, offset, count)
+            if n == 0:
+                break
+            offset += n
+        if offset != size:
+            raise OSError(errno.EIO, f"Short copy of {a_src}")
+    shutil.copystat(a_src, a_dst)
+
+def LinkFile(a_src, a_dst):
+    if os.path.lexists(a_dst):
+        os.remove(a_dst)
+    os.link(a_src, a_dst)
+
+def MoveFile(a_src, a_dst):
+    # os.replace() only works on the same file system, which is the point of
+    # this mode. Other cases fall back to a copy followed by a removal.
+    os.replace(a_src, a_dst)
+
+transfer_functions = {
+    "copy": shutil.copy2,
+    "move": MoveFile,
+    "hardlink": LinkFile,
+    "reflink": ReflinkFile,
+    "copy_file_range": KernelCopyFile,
+}
+
+#######################################
+#
+# Transfer a_src to a_dst with a_mode, falling back to the next mode of its
+# chain when a mode is not supported.
+#
+# Returns the mode actually used. Raises OSError on a real failure.
+#
+def TransferFile(a_src, a_dst, a_mode="copy"):
+    key_folders = (os.path.dirname(a_src), os.path.dirname(a_dst))
+    for mode in fallback_chains[a_mode]:
+        if mode != "copy" and (mode,) + key_folders in unsupported_modes:
+            continue
+        try:
+            transfer_functions[mode](a_src, a_dst)
+        except UnsupportedMode:
+            pass
+        except OSError as e:
+            if mode == "copy" or e.errno not in unsupported_errors:
+                raise
+        else:
+            # A move that fell back to a copy still has to remove the source
+            if a_mode == "move" and mode != "move":
+                os.remove(a_src)
+            return mode
+        with unsupported_lock:
+            unsupported_modes.add((mode,) + key_folders)
+    raise OSError(errno.ENOTSUP, f"No transfer mode available for {a_src}")
+
+# Temporary folder, inside the staging folder, of the files being copied from the phone
+partial_folder_name = ".partial"
+
+# Temporary name of a file being written to a_path
+def PartialPath(a_path):
+    return a_path + ".partial"
+
+#######################################
+#
+# Same as TransferFile(), but the file is written under a temporary name and
+# renamed to a_dst once complete: a_dst is either the old file or the new
+# one, never a partial copy, even if the process is killed.
+#
+def TransferFileAtomic(a_src, a_dst, a_mode="copy"):
+    temp = PartialPath(a_dst)
+    try:
+        mode = TransferFile(a_src, temp, a_mode)
+        os.replace(temp, a_dst)
+    except BaseException:
+        # A move that fell back to a copy already removed the source, the
+        # temporary file is then the only complete copy and is kept.
+        if os.path.exists(a_src):
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+        raise
+    return mode
+
+#######################################
+#
+# Verified copy
+#
+
+# Chunk read from the source and written to the destination at once. Large
+# chunks keep the number of round-trips low on network destinations.
+verified_chunk_size = 4*1024*1024
+
+# Threads hashing the chunks of the verified copies, created on first use
+hash_pool = None
+hash_pool_lock = threading.Lock()
+
+def HashPool():
+    global hash_pool
+    with hash_pool_lock:
+        if hash_pool is None:
+            import concurrent.futures
+            hash_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(2, min(8, os.cpu_count() or 1)))
+        return hash_pool
+
+# Copy a_src to a_dst in a single pass over the source, hashing every chunk
+# as it is written. Returns the digest of the content (same as FullHash()).
+#
+# The hash releases the GIL, so with two buffers a chunk is hashed by the
+# hash pool while it is written and while the next chunk is read: the copy
+# takes about as long as the slowest of reading, writing and hashing.
+def VerifiedCopyFile(a_src, a_dst):
+    h = ContentHash()
+    buffers = [bytearray(verified_chunk_size), bytearray(verified_chunk_size)]
+    views = [memoryview(buffer) for buffer in buffers]
+    hashing = None
+    current = 0
+    with open(a_src, "rb", buffering=0) as fsrc, open(a_dst, "wb", buffering=0) as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fsrc.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        copied = 0
+        while True:
+            n = fsrc.readinto(buffers[current])
+            # The previous chunk must be hashed before this one, and before
+            # its buffer is read into again
+            if hashing:
+                hashing.result()
+                hashing = None
+            if not n:
+                break
+            chunk = views[current][:n]
+            if size > verified_chunk_size:
+                hashing = HashPool().submit(h.update, chunk)
+            else:
+                h.update(chunk)
+            written = 0
+            while written < n:
+                written += fdst.write(chunk[written:])
+            copied += n
+            current = 1 - current
+        if copied != size:
+            raise OSError(errno.EIO, f"Short copy of {a_src}: {copied} of {size} bytes")
+    shutil.copystat(a_src, a_dst)
+    return h.hexdigest()
+
+#######################################
+#
+# Copy a_src to a_dst like TransferFileAtomic() in "copy" mode, hashing the
+# content on the way.
+#
+# If a_expected_hash is set (the full hash of the source, computed when
+# looking for duplicates), a copy with another digest is an error and a_dst
+# is left untouched. If a_sync_batch is a SyncBatch, a_dst is added to it.
+#
+# Returns the digest of the copy. Raises OSError on failure.
+#
+def TransferFileVerified(a_src, a_dst, a_expected_hash=None, a_sync_batch=None):
+    temp = PartialPath(a_dst)
+    try:
+        digest = VerifiedCopyFile(a_src, temp)
+        if a_expected_hash and digest != a_expected_hash:
+            raise OSError(errno.EIO, f"Content of {a_src} differs from its hash taken before the copy")
+        os.replace(temp, a_dst)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+    if a_sync_batch:
+        a_sync_batch.add(a_dst)
+    return digest
+
+class SyncBatch:
+    """
+    Files written to the destination and not yet flushed to disk.
+
+    Syncing every file as it is written makes each copy wait for the disk.
+    The files are rather synced batch_size at a time, once the system had
+    the time to write most of their data back, followed by their folders so
+    the renames are durable too. flush() syncs what is left.
+
+    Files that could not be synced are listed in errors as (path, error).
+    """
+    ###########################
+    # Constructor
+    def __init__(self, a_batch_size=64):
+        self.batch_size = max(1, a_batch_size)
+        self.__lock = threading.Lock()
+        self.__paths = []
+        self.errors = []
+
+    def add(self, a_path):
+        with self.__lock:
+            self.__paths.append(a_path)
+            if len(self.__paths) < self.batch_size:
+                return
+            paths, self.__paths = self.__paths, []
+        self.__sync(paths)
+
+    def flush(self):
+        with self.__lock:
+            paths, self.__paths = self.__paths, []
+        self.__sync(paths)
+
+    def __sync(self, a_paths):
+        errors = []
+        for path in a_paths:
+            try:
+                if sys.platform == "win32":
+                    # Windows only flushes files opened for writing
+                    with open(path, "rb+") as f:
+                        os.fsync(f.fileno())
+                else:
+                    # Read-only copies (preserved permissions, hardlinks) sync as well
+                    self.__syncPath(path)
+            except OSError as e:
+                # Windows cannot open a read-only copy for writing, it is left to the system
+                if sys.platform == "win32" and e.errno == errno.EACCES:
+                    continue
+                errors.append((path, e))
+        if sys.platform != "win32":
+            for folder in {os.path.dirname(os.path.abspath(path)) for path in a_paths}:
+                try:
+                    self.__syncPath(folder)
+                except OSError as e:
+                    errors.append((folder, e))
+        if errors:
+            with self.__lock:
+                self.errors += errors
+
+    # Sync a file or a folder through a read-only descriptor (POSIX)
+    @staticmethod
+    def __syncPath(a_path):
+        fd = os.open(a_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
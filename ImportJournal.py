@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import threading
+
+# Importer parameters
+from defaults import *
+
+class ImportJournal:
+    """
+    Append-only journal of a long running import or phone copy.
+
+    Every file goes through three records, one JSON list per line:
+        ["P", key, fields...]  planned, with the fields needed to redo the work
+        ["S", key]             started, the destination may hold a partial file
+        ["D", key, action]     done, with the action taken ("copied", "skipped"...)
+    The first line is a header describing the run (source, destination,
+    options), and ["L"] marks the end of the listing of the source: once it is
+    written, the planned entries are the complete list of files to process.
+
+    Records are flushed as they are written so they survive the process being
+    killed, and synced to disk every sync_interval records. A line truncated
+    by a crash in the middle of a write is ignored.
+
+    A run started with resume=True continues the journal of the previous run
+    if it has the same header: files already done are not looked at again and
+    files that were started are redone. Any other run replaces it, once the
+    files it left half written are cleaned up.
+    """
+    sync_interval = 256
+
+    ###########################
+    # Constructor
+    def __init__(self, a_path):
+        self.path = a_path
+        self.header = None
+        self.planned = {}          # key -> planned fields, in planning order
+        self.started = set()
+        self.done = {}             # key -> action
+        self.listing_complete = False
+        self.replaced = False      # open() started over an unfinished journal
+        self.__file = None
+        self.__lock = threading.Lock()
+        self.__unsynced = 0
+
+    ###########################
+    # Read the journal left by a previous run, if any
+    def load(self):
+        self.header = None
+        self.planned = {}
+        self.started = set()
+        self.done = {}
+        self.listing_complete = False
+        try:
+            journal = open(self.path, "r", encoding="utf-8")
+        except OSError:
+            return
+        with journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Truncated by a crash in the middle of a write
+                    continue
+                if isinstance(record, dict):
+                    self.header = record
+                    continue
+                op, key = record[0], record[1] if len(record) > 1 else None
+                if op == "P":
+                    self.planned[key] = record[2:]
+                elif op == "S":
+                    self.started.add(key)
+                elif op == "D":
+                    self.done[key] = record[2]
+                    self.started.discard(key)
+                elif op == "L":
+                    self.listing_complete = True
+
+    ###########################
+    # Start writing the journal.
+    # The journal of the previous run is read first: it is only there when
+    # that run did not finish. a_recover, if set, is called with the journal
+    # so the files that run left half written are cleaned up, whether its
+    # journal is continued or not.
+    # With a_resume, the previous journal is continued when its header matches
+    # a_header, returns True in that case. Otherwise a new journal is started,
+    # and replaced tells whether it replaces an unfinished one.
+    def open(self, a_header, a_resume=False, a_recover=None):
+        self.load()
+        unfinished = self.header is not None
+        if unfinished and a_recover:
+            a_recover(self)
+        resumed = a_resume and self.header == a_header
+        self.replaced = unfinished and not resumed
+        if not resumed:
+            self.header = a_header
+            self.planned = {}
+            self.started = set()
+            self.done = {}
+            self.listing_complete = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if resumed:
+            self.__file = open(self.path, "a", encoding="utf-8")
+            # Terminate a truncated last line so the next record starts on its own line
+            self.__file.write("\n")
+        else:
+            self.__file = open(self.path, "w", encoding="utf-8")
+            self.__write(a_header)
+        self.__file.flush()
+        return resumed
+
+    ###########################
+    # Records
+    def planFile(self, a_key, *a_fields):
+        self.__write(["P", a_key, *a_fields])
+
+    def startFile(self, a_key):
+        self.__write(["S", a_key])
+
+    def finishFile(self, a_key, a_action):
+        self.__write(["D", a_key, a_action])
+
+    def listingComplete(self):
+        self.__write(["L"])
+        self.listing_complete = True
+        self.sync()
+
+    ###########################
+    # Queries on the journal of the previous run
+    # True when a_key was done and does not need to be looked at again.
+    # Errors are retried.
+    def isDone(self, a_key):
+        action = self.done.get(a_key)
+        return action is not None and action != "error"
+
+    # Planned entries not done yet, as (key, fields)
+    def pending(self):
+        return [(key, fields) for key, fields in self.planned.items() if not self.isDone(key)]
+
+    # Keys that were started but not done when the previous run stopped
+    def interrupted(self):
+        return [key for key in self.started if key not in self.done]
+
+    ###########################
+    def sync(self):
+        with self.__lock:
+            if self.__file:
+                self.__file.flush()
+                os.fsync(self.__file.fileno())
+                self.__unsynced = 0
+
+    # Close the journal. A finished run has nothing to resume, its journal is removed.
+    def close(self, a_finished=False):
+        if self.__file is None:
+            return
+        self.sync()
+        self.__file.close()
+        self.__file = None
+        if a_finished:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __write(self, a_record):
+        line = json.dumps(a_record, separators=(",", ":")) + "\n"
+        with self.__lock:
+            self.__file.write(line)
+            self.__file.flush()
+            self.__unsynced += 1
+            if self.__unsynced >= self.sync_interval:
+                os.fsync(self.__file.fileno())
+                self.__unsynced = 0
+
+# Location of the journal of a run.
+# a_kind names the operation ("import", "copy"), the journal is specific to
+# a source and a destination.
+def JournalPath(a_kind, a_source, a_dest):
+    key = hashlib.sha1(f"{os.path.abspath(a_source)}|{os.path.abspath(a_dest)}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(default_cache_dir, f"journal_{a_kind}_{key}.jsonl")
@@ -0,0 +1,430 @@
+import os
+import sys
+import time
+import struct
+import sqlite3
+import fnmatch
+import threading
+from collections import namedtuple
+
+# Importer parameters
+from defaults import *
+from utils import *
+
+#######################################
+#
+# Camera maker and model of the staged photos, and capture date of the files
+# whose name has no date, read from the file headers.
+#
+# Only the APP1 segment of a JPEG file is read: the reader walks the segment
+# headers from the start of the file, seeking over the other segments, and
+# stops at the first APP1 holding EXIF data or at the start of the image
+# data. The pixels are never read, a photo costs a few small reads.
+#
+# Likewise, only the box headers of an MP4/MOV file are read, seeking over
+# the media data, up to the movie header (moov/mvhd). A video of several GB
+# costs a few reads of a few bytes.
+#
+
+# make and model are "" when a JPEG file has no EXIF camera information
+CameraInfo = namedtuple("CameraInfo", ["make", "model"])
+
+no_camera = CameraInfo("", "")
+
+jpeg_extensions = (".jpg", ".jpeg")
+mp4_extensions = (".mp4", ".mov", ".m4v", ".3gp")
+
+EXIF_TAG_MAKE = 0x010F
+EXIF_TAG_MODEL = 0x0110
+EXIF_TAG_DATETIME = 0x0132
+EXIF_TAG_EXIF_IFD = 0x8769
+EXIF_TAG_DATETIME_ORIGINAL = 0x9003
+EXIF_TYPE_ASCII = 2
+EXIF_TYPE_LONG = 4
+
+# Seconds between the MP4 epoch (1904-01-01) and the Unix epoch
+mp4_epoch_offset = 2082844800
+
+# Boxes looked at, at each level, before giving up on a malformed file
+max_mp4_boxes = 64
+
+# Segments looked at before giving up on a malformed file
+max_jpeg_segments = 32
+
+# Below this number of files, the headers are read in the calling process.
+# Starting the worker processes costs more than reading a few headers.
+process_pool_threshold = 256
+
+def IsJpegFile(a_file_name):
+    return a_file_name.lower().endswith(jpeg_extensions)
+
+# Read the EXIF payload (the TIFF structure) of a JPEG file.
+# Returns None when the file is not a JPEG or has no EXIF data.
+def ReadExifSegment(a_path):
+    with open(a_path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        for _ in range(max_jpeg_segments):
+            header = f.read(4)
+            if len(header) < 4 or header[0] != 0xFF:
+                return None
+            marker = header[1]
+            length = (header[2] << 8) | header[3]
+            # Start of scan or end of image: the metadata segments are over
+            if marker in (0xDA, 0xD9) or length < 2:
+                return None
+            if marker == 0xE1:
+                payload = f.read(length - 2)
+                if payload.startswith(b"Exif\x00\x00"):
+                    return payload[6:]
+            else:
+                f.seek(length - 2, os.SEEK_CUR)
+    return None
+
+# Read the tags a_tags of an IFD of a TIFF structure. Only ASCII and LONG
+# values are read. a_ifd_offset is the offset of the IFD, None for the first.
+# Returns a dictionary tag -> string or int.
+def ReadTiffTags(a_tiff, a_tags, a_ifd_offset=None):
+    values = {}
+    if a_tiff[:2] == b"II":
+        endian = "<"
+    elif a_tiff[:2] == b"MM":
+        endian = ">"
+    else:
+        return values
+    try:
+        ifd_offset = a_ifd_offset
+        if ifd_offset is None:
+            ifd_offset = struct.unpack_from(endian + "I", a_tiff, 4)[0]
+        num_entries = struct.unpack_from(endian + "H", a_tiff, ifd_offset)[0]
+        for i in range(num_entries):
+            tag, value_type, count = struct.unpack_from(endian + "HHI", a_tiff, ifd_offset + 2 + 12 * i)
+            if tag not in a_tags:
+                continue
+            value_offset = ifd_offset + 2 + 12 * i + 8
+            if value_type == EXIF_TYPE_LONG:
+                values[tag] = struct.unpack_from(endian + "I", a_tiff, value_offset)[0]
+            elif value_type == EXIF_TYPE_ASCII:
+                if count > 4:
+                    value_offset = struct.unpack_from(endian + "I", a_tiff, value_offset)[0]
+                raw = a_tiff[value_offset:value_offset + count]
+                values[tag] = raw.split(b"\x00", 1)[0].decode("ascii", "replace").strip()
+    except struct.error:
+        pass
+    return values
+
+# Camera of a JPEG file. Returns no_camera when the file has no EXIF camera
+# information, or cannot be read.
+def ReadCameraInfo(a_path):
+    try:
+        tiff = ReadExifSegment(a_path)
+    except OSError:
+        return no_camera
+    if not tiff:
+        return no_camera
+    tags = ReadTiffTags(tiff, (EXIF_TAG_MAKE, EXIF_TAG_MODEL))
+    return CameraInfo(tags.get(EXIF_TAG_MAKE, ""), tags.get(EXIF_TAG_MODEL, ""))
+
+# Convert an EXIF date "YYYY:MM:DD HH:MM:SS" to YYYYMMDD, "" if invalid
+def ExifDateToDate(a_exif_date):
+    date = a_exif_date[:10].replace(":", "").replace("-", "")
+    if len(date) != 8 or not date.isdigit() or date == "00000000":
+        return ""
+    return date
+
+# Capture date of a JPEG file as YYYYMMDD: DateTimeOriginal from the EXIF
+# sub-IFD, or the DateTime of the main IFD. "" when there is none.
+def ReadJpegCaptureDate(a_path):
+    tiff = ReadExifSegment(a_path)
+    if not tiff:
+        return ""
+    tags = ReadTiffTags(tiff, (EXIF_TAG_DATETIME, EXIF_TAG_EXIF_IFD))
+    if EXIF_TAG_EXIF_IFD in tags:
+        exif_tags = ReadTiffTags(tiff, (EXIF_TAG_DATETIME_ORIGINAL,), tags[EXIF_TAG_EXIF_IFD])
+        date = ExifDateToDate(exif_tags.get(EXIF_TAG_DATETIME_ORIGINAL, ""))
+        if date:
+            return date
+    return ExifDateToDate(tags.get(EXIF_TAG_DATETIME, ""))
+
+# Find the box a_type among the boxes between a_start and a_end of an open
+# MP4 file. Returns (start of the box content, end of the box), or None.
+def FindMp4Box(a_file, a_type, a_start, a_end):
+    position = a_start
+    for _ in range(max_mp4_boxes):
+        if position + 8 > a_end:
+            return None
+        a_file.seek(position)
+        header = a_file.read(8)
+        if len(header) < 8:
+            return None
+        size, box_type = struct.unpack(">I4s", header)
+        content = position + 8
+        if size == 1:
+            # 64-bit size follows the type
+            large = a_file.read(8)
+            if len(large) < 8:
+                return None
+            size = struct.unpack(">Q", large)[0]
+            content += 8
+        elif size == 0:
+            # The box extends to the end of the file
+            size = a_end - position
+        if size < content - position:
+            return None
+        if box_type == a_type:
+            return (content, position + size)
+        position += size
+    return None
+
+# Capture date of an MP4/MOV file as YYYYMMDD, from the creation time of the
+# movie header. The creation time is in UTC, it is converted to the local
+# date like the dates of the file names. "" when there is none.
+def ReadMp4CaptureDate(a_path):
+    with open(a_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        moov = FindMp4Box(f, b"moov", 0, file_size)
+        if not moov:
+            return ""
+        mvhd = FindMp4Box(f, b"mvhd", moov[0], moov[1])
+        if not mvhd:
+            return ""
+        f.seek(mvhd[0])
+        data = f.read(12)
+    if len(data) < 12:
+        return ""
+    if data[0] == 1:
+        creation_time = struct.unpack_from(">Q", data, 4)[0]
+    else:
+        creation_time = struct.unpack_from(">I", data, 4)[0]
+    if creation_time <= mp4_epoch_offset:
+        return ""
+    try:
+        return time.strftime("%Y%m%d", time.localtime(creation_time - mp4_epoch_offset))
+    except (OverflowError, OSError, ValueError):
+        return ""
+
+# Capture date of a photo or a video as YYYYMMDD, read from its metadata.
+# Returns "" for other files, or when the date is unknown.
+def ReadCaptureDate(a_path):
+    name = a_path.lower()
+    try:
+        if name.endswith(jpeg_extensions):
+            return ReadJpegCaptureDate(a_path)
+        if name.endswith(mp4_extensions):
+            return ReadMp4CaptureDate(a_path)
+    except OSError:
+        pass
+    return ""
+
+# Text identifying a camera in reports and filter rules: "make/model", or
+# "none" when the photo has no camera information
+def CameraKey(a_info):
+    if not a_info.make and not a_info.model:
+        return "none"
+    return f"{a_info.make}/{a_info.model}"
+
+class MetadataCache:
+    """
+    Sidecar index of the camera information, capture dates and perceptual
+    hashes (see SimilarPhotos) of the files already read.
+
+    Entries are keyed by the absolute path of a file, split into folder and
+    name so a folder is loaded with a single query. An entry is only valid
+    for the size and mtime the file had when it was read, a modified file is
+    read again.
+    """
+    ###########################
+    # Constructor
+    def __init__(self, a_db_path=None):
+        if a_db_path is None:
+            a_db_path = os.path.join(default_cache_dir, "metadata.db")
+        os.makedirs(os.path.dirname(os.path.abspath(a_db_path)), exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(a_db_path, check_same_thread=False)
+        self.__db.executescript("""
+            CREATE TABLE IF NOT EXISTS cameras (
+                folder TEXT NOT NULL,
+                name   TEXT NOT NULL,
+                size   INTEGER NOT NULL,
+                mtime  REAL NOT NULL,
+                make   TEXT NOT NULL,
+                model  TEXT NOT NULL,
+                PRIMARY KEY (folder, name)
+            );
+            CREATE TABLE IF NOT EXISTS capture_dates (
+                folder TEXT NOT NULL,
+                name   TEXT NOT NULL,
+                size   INTEGER NOT NULL,
+                mtime  REAL NOT NULL,
+                date   TEXT NOT NULL,
+                PRIMARY KEY (folder, name)
+            );
+            CREATE TABLE IF NOT EXISTS perceptual_hashes (
+                folder TEXT NOT NULL,
+                name   TEXT NOT NULL,
+                size   INTEGER NOT NULL,
+                mtime  REAL NOT NULL,
+                hash   TEXT NOT NULL,
+                PRIMARY KEY (folder, name)
+            );
+        """)
+        self.__folders = {}  # folder -> {name: (size, mtime, CameraInfo)}, loaded lazily
+
+    ###########################
+    # CameraInfo of a file, or None if the file is not in the cache or changed
+    def getCamera(self, a_path, a_size, a_mtime):
+        folder, name = os.path.split(os.path.abspath(a_path))
+        with self.__lock:
+            entry = self.__loadFolder(folder).get(name)
+        if entry is None or entry[0] != a_size or entry[1] != a_mtime:
+            return None
+        return entry[2]
+
+    # Store the CameraInfo of files, a_entries is a list of (path, size, mtime, CameraInfo)
+    def setCameras(self, a_entries):
+        rows = []
+        with self.__lock:
+            for path, size, mtime, info in a_entries:
+                folder, name = os.path.split(os.path.abspath(path))
+                self.__loadFolder(folder)[name] = (size, mtime, info)
+                rows.append((folder, name, size, mtime, info.make, info.model))
+            self.__db.executemany("INSERT OR REPLACE INTO cameras (folder, name, size, mtime, make, model) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.__db.commit()
+
+    def __loadFolder(self, a_folder):
+        entries = self.__folders.get(a_folder)
+        if entries is None:
+            entries = {}
+            for name, size, mtime, make, model in self.__db.execute(
+                    "SELECT name, size, mtime, make, model FROM cameras WHERE folder = ?", (a_folder,)):
+                entries[name] = (size, mtime, CameraInfo(make, model))
+            self.__folders[a_folder] = entries
+        return entries
+
+    # Capture date (YYYYMMDD, "" if unknown) of a file, or None if the file is
+    # not in the cache or changed
+    def getCaptureDate(self, a_path, a_size, a_mtime):
+        folder, name = os.path.split(os.path.abspath(a_path))
+        with self.__lock:
+            row = self.__db.execute("SELECT size, mtime, date FROM capture_dates WHERE folder = ? AND name = ?",
+                                    (folder, name)).fetchone()
+        if row is None or row[0] != a_size or row[1] != a_mtime:
+            return None
+        return row[2]
+
+    # Store the capture date of a file. The dates are saved by close().
+    def setCaptureDate(self, a_path, a_size, a_mtime, a_date):
+        folder, name = os.path.split(os.path.abspath(a_path))
+        with self.__lock:
+            self.__db.execute("INSERT OR REPLACE INTO capture_dates (folder, name, size, mtime, date) VALUES (?, ?, ?, ?, ?)",
+                              (folder, name, a_size, a_mtime, a_date))
+
+    # Perceptual hash ("" if the file cannot be decoded) of a file, or None if
+    # the file is not in the cache or changed
+    def getPerceptualHash(self, a_path, a_size, a_mtime):
+        folder, name = os.path.split(os.path.abspath(a_path))
+        with self.__lock:
+            row = self.__db.execute("SELECT size, mtime, hash FROM perceptual_hashes WHERE folder = ? AND name = ?",
+                                    (folder, name)).fetchone()
+        if row is None or row[0] != a_size or row[1] != a_mtime:
+            return None
+        return row[2]
+
+    # Store the perceptual hash of a file. The hashes are saved by close().
+    def setPerceptualHash(self, a_path, a_size, a_mtime, a_hash):
+        folder, name = os.path.split(os.path.abspath(a_path))
+        with self.__lock:
+            self.__db.execute("INSERT OR REPLACE INTO perceptual_hashes (folder, name, size, mtime, hash) VALUES (?, ?, ?, ?, ?)",
+                              (folder, name, a_size, a_mtime, a_hash))
+
+    def close(self):
+        with self.__lock:
+            self.__db.commit()
+            self.__db.close()
+
+#######################################
+#
+# Read the camera of the JPEG files among a_files (SourceFile entries).
+#
+# Files found in a_cache are not read. The others are read by a pool of
+# a_jobs processes, the headers are small and the work is spread in chunks.
+#
+# Returns a dictionary path -> CameraInfo. Files that are not JPEG files are
+# not in the dictionary.
+#
+def ScanCameras(a_files, a_cache=None, a_jobs=None):
+    cameras = {}
+    to_read = []
+    for src in a_files:
+        if not IsJpegFile(src.name):
+            continue
+        info = a_cache.getCamera(src.path, src.size, src.mtime) if a_cache else None
+        if info is None:
+            to_read.append(src)
+        else:
+            cameras[src.path] = info
+
+    paths = [src.path for src in to_read]
+    if len(paths) < process_pool_threshold:
+        infos = [ReadCameraInfo(path) for path in paths]
+    else:
+        import concurrent.futures
+        jobs = a_jobs or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            infos = list(pool.map(ReadCameraInfo, paths, chunksize=max(1, min(256, len(paths) // (jobs * 4)))))
+    read = [(src.path, src.size, src.mtime, info) for src, info in zip(to_read, infos)]
+
+    for path, _, _, info in read:
+        cameras[path] = info
+    if a_cache and read:
+        a_cache.setCameras(read)
+    return cameras
+
+class CameraFilter:
+    """
+    Include and exclude rules on the camera of the photos.
+
+    A rule is a case insensitive pattern with shell wildcards matched against
+    "make/model", e.g. "Google/Pixel 7", "samsung/*" or "*/iPhone*". A rule
+    without "/" applies to the make only. The rule "none" matches the photos
+    without camera information, such as the images saved by messaging apps.
+
+    A photo is accepted if it matches one of the include rules (or if there
+    are none) and none of the exclude rules.
+    """
+    ###########################
+    # Constructor
+    def __init__(self, a_include=(), a_exclude=()):
+        self.include = [self.__normalize(rule) for rule in a_include]
+        self.exclude = [self.__normalize(rule) for rule in a_exclude]
+
+    @staticmethod
+    def __normalize(a_rule):
+        rule = a_rule.lower()
+        if rule != "none" and "/" not in rule:
+            rule += "/*"
+        return rule
+
+    ###########################
+    # True if a photo taken with the camera a_info passes the rules
+    def accepts(self, a_info):
+        key = CameraKey(a_info).lower()
+        if self.include and not any(fnmatch.fnmatchcase(key, rule) for rule in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(key, rule) for rule in self.exclude)
+
+# List the cameras of the photos of a folder, to help writing filter rules
+def main():
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else default_stage_dir
+    cache = MetadataCache()
+    cameras = ScanCameras(ScanSourceFiles(source_dir), cache)
+    cache.close()
+    counts = {}
+    for info in cameras.values():
+        key = CameraKey(info)
+        counts[key] = counts.get(key, 0) + 1
+    for key, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"{count:8d}  {key}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import functools
+import math
+import time
+import threading
+
+#######################################
+#
+# Lightweight instrumentation of the importer: counters, histograms and
+# stage timers, plus a console log that batches its output.
+#
+# Stages nest per thread. Each stage records its duration in a histogram,
+# and its own time (its duration minus the time of the stages nested in it)
+# under its stack, e.g. "import;copy". The stacks are written as a folded
+# stacks file, the input of flamegraph.pl and speedscope, with the time in
+# microseconds as the sample count.
+#
+
+class Histogram:
+    """
+    Distribution of values in power-of-two buckets, with the exact count,
+    sum, minimum and maximum. Percentiles are estimated from the buckets.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {}  # exponent -> count of the values in [2^(e-1), 2^e)
+
+    def add(self, a_value):
+        self.count += 1
+        self.total += a_value
+        if self.min is None or a_value < self.min:
+            self.min = a_value
+        if self.max is None or a_value > self.max:
+            self.max = a_value
+        exponent = math.frexp(a_value)[1]
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    def percentile(self, a_fraction):
+        if not self.count:
+            return 0.0
+        rank = a_fraction * self.count
+        seen = 0
+        for exponent in sorted(self.buckets):
+            seen += self.buckets[exponent]
+            if seen >= rank:
+                return min(self.max, 2.0 ** exponent)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p90": self.percentile(0.90),
+            "p99": self.percentile(0.99),
+        }
+
+class Metrics:
+    """
+    Counters, histograms and stage timers shared by all the threads.
+    Times are in seconds.
+    """
+    ###########################
+    # Constructor
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.start = time.perf_counter()
+            self.counters = {}
+            self.histograms = {}
+            self.stacks = {}     # "stage;nested stage" -> own time
+
+    ###########################
+    # Counters and histograms
+    def count(self, a_name, a_increment=1):
+        with self.__lock:
+            self.counters[a_name] = self.counters.get(a_name, 0) + a_increment
+
+    def observe(self, a_name, a_value):
+        with self.__lock:
+            histogram = self.histograms.get(a_name)
+            if histogram is None:
+                histogram = self.histograms[a_name] = Histogram()
+            histogram.add(a_value)
+
+    ###########################
+    # Stage timers
+    # with metrics.stage("copy"):
+    #     ...
+    def stage(self, a_name):
+        return StageTimer(self, a_name)
+
+    # Decorator timing every call of a function as the stage a_name
+    def timer(self, a_name):
+        def decorator(a_function):
+            @functools.wraps(a_function)
+            def wrapper(*args, **kwargs):
+                with self.stage(a_name):
+                    return a_function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Time the production of each item of a_iterable as the stage a_name,
+    # e.g. the listing of a folder that is consumed as it is listed.
+    def timed(self, a_name, a_iterable):
+        iterator = iter(a_iterable)
+        while True:
+            with self.stage(a_name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def _enterStage(self, a_name):
+        stack = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = self.__local.stack = []
+        path = f"{stack[-1][0]};{a_name}" if stack else a_name
+        stack.append([path, 0.0])
+
+    def _exitStage(self, a_name, a_elapsed):
+        stack = self.__local.stack
+        path, nested = stack.pop()
+        if stack:
+            stack[-1][1] += a_elapsed
+        with self.__lock:
+            self.stacks[path] = self.stacks.get(path, 0.0) + a_elapsed - nested
+            histogram = self.histograms.get("stage." + a_name)
+            if histogram is None:
+                histogram = self.histograms["stage." + a_name] = Histogram()
+            histogram.add(a_elapsed)
+
+    ###########################
+    # Reports
+    def report(self):
+        with self.__lock:
+            return {
+                "elapsed": time.perf_counter() - self.start,
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            }
+
+    # Folded stacks, one "stage;nested stage microseconds" line per stack
+    def foldedStacks(self):
+        with self.__lock:
+            return [f"{path} {int(own_time * 1e6)}" for path, own_time in sorted(self.stacks.items())
+                    if own_time >= 1e-6]
+
+    # Write the JSON report to a_path, and the folded stacks next to it
+    # with the extension .folded. Returns the path of the folded stacks.
+    def writeReport(self, a_path, a_extra=None):
+        report = self.report()
+        if a_extra:
+            report.update(a_extra)
+        with open(a_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        folded_path = os.path.splitext(a_path)[0] + ".folded"
+        with open(folded_path, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in self.foldedStacks())
+        return folded_path
+
+    # Total time, number of calls, mean and p99 of every stage, as text lines
+    def stageSummary(self):
+        report = self.report()
+        lines = []
+        for name, histogram in report["histograms"].items():
+            if not name.startswith("stage."):
+                continue
+            lines.append(f"  {name[6:]:<16} {histogram['sum']:9.3f}s  {histogram['count']:8d} x  "
+                         f"mean {histogram['mean'] * 1000:8.3f}ms  p99 {histogram['p99'] * 1000:8.3f}ms")
+        return lines
+
+class StageTimer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, a_metrics, a_name):
+        self.metrics = a_metrics
+        self.name = a_name
+
+    def __enter__(self):
+        self.metrics._enterStage(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics._exitStage(self.name, time.perf_counter() - self.start)
+        return False
+
+class ConsoleLog:
+    """
+    Console output of the importer, safe to use from several threads.
+
+    Lines are buffered and written in batches, at most batch_lines lines or
+    batch_interval seconds apart, instead of one write per file. detail()
+    lines (one per file) are dropped in quiet mode, write() lines are always
+    shown.
+    """
+    batch_lines = 200
+    batch_interval = 0.25  # seconds
+
+    ###########################
+    # Constructor
+    def __init__(self, a_quiet=False):
+        self.quiet = a_quiet
+        self.__lock = threading.Lock()
+        self.__lines = []
+        self.__last_flush = time.perf_counter()
+
+    def detail(self, *args):
+        if not self.quiet:
+            self.write(*args)
+
+    def write(self, *args):
+        line = " ".join(str(arg) for arg in args)
+        with self.__lock:
+            self.__lines.append(line)
+            now = time.perf_counter()
+            if len(self.__lines) >= self.batch_lines or now - self.__last_flush >= self.batch_interval:
+                self.__flush(now)
+
+    def flush(self):
+        with self.__lock:
+            self.__flush(time.perf_counter())
+
+    def __flush(self, a_now):
+        self.__last_flush = a_now
+        if not self.__lines:
+            return
+        text = "\n".join(self.__lines) + "\n"
+        self.__lines = []
+        if sys.stdout is not None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+# Instances shared by the importer modules
+metrics = Metrics()
+log = ConsoleLog()
@@ -1,7 +1,12 @@
 import os
+import queue
 import re
 import shutil
+import stat
 import sys
+import threading
+import time
+from collections import namedtuple
 
 # Supporting libraries
 #from PIL import Image
@@ -9,8 +14,14 @@ import sys
 # Importer parameters
 from defaults import *
 from utils import *
-from PhoneTools import AndroidPhone
-from PhotoClassifier import GetDateFromFolderName
+from PhotoClassifier import GetDateFromFolderName, IsNameBefore, ParseFileName
+from Metrics import metrics, log
+
+# The phone (pywin32), the similar photos (NumPy, Pillow), the destination
+# catalog, the transfers, the journal, the metadata, the duplicate finder and
+# the thread pools are imported by the functions using them, so the command
+# line starts quickly and the actions that do not need a module run without
+# it installed.
 
 
 # def ClearDir(a_dir):
@@ -28,173 +39,1246 @@ from PhotoClassifier import GetDateFromFolderName
 #         print("Error occured clearing dir", a_dir)
 
 
-def QualifyFileSize(a_file):
+# Files smaller than this are not imported.
+# Default threshold is 100KB. Genuine files as small as 150KB have been found.
+min_file_size = 100*1024
+
+def QualifyFileSize(a_file_size):
     # File too small
-    # Default threshold is 100KB. Genuine files as small as 150KB have been found.
-    size_threshold = 100*1024
-    if os.path.getsize(a_file) < size_threshold:
-         return {"qualified": False, "reason": "Size under threshold of " + f"{size_threshold:,}"}
+    if a_file_size < min_file_size:
+         return {"qualified": False, "reason": "Size under threshold of " + f"{min_file_size:,}"}
     
     return {"qualified": True, "reason": ""}
 
-# Extract the file date from PXL_########_#########_???.jpg
-def GetFileDate_PXL(a_filename):
-    parts = a_filename.split('_')
-    # There must be at least 3 parts
-    if len(parts) < 3:
-        return ""
-    file_date_str = parts[1]
-    if len(file_date_str) != 8:
-        return ""
-    return file_date_str[:4] + "-" + file_date_str[4:6] + "-" + file_date_str[6:]
-
-# Extract the file date from IMG-########-???.jpg
-def GetFileDate_IMG(a_filename):
-    parts = a_filename.split('-')
-    # There must be at least 3 parts
-    if len(parts) < 3:
-        return ""
-    file_date_str = parts[1]
-    if len(file_date_str) != 8:
-        return ""
-    return file_date_str[:4] + "-" + file_date_str[4:6] + "-" + file_date_str[6:]
-
+# Extract the file date from any of the naming schemes known to PhotoClassifier,
+# e.g. PXL_########_#########_???.jpg or IMG-########-???.jpg.
+# Returns the date as YYYY-MM-DD, or "" if the name follows no known scheme.
 def GetFileDate(a_file):
     _, file_name = os.path.split(a_file)
-    file_date = ""
-    if file_name[:4] == "PXL_":
-        file_date = GetFileDate_PXL(file_name)
-    elif file_name[:4] == "IMG-":
-        file_date = GetFileDate_IMG(file_name)
-    return file_date
+    parsed = ParseFileName(file_name)
+    if not parsed:
+        return ""
+    return parsed.date[:4] + "-" + parsed.date[4:6] + "-" + parsed.date[6:]
 
 #######################################
 #
-# Syncs two directories based on name and size.
+# Syncs two directory trees based on name and size.
+#
+# The sync runs in two steps: BuildSyncPlan() compares the trees and lists
+# what has to be done, ExecuteSyncPlan() copies the missing files.
 #
-def sync_directories(reference_dir, update_dir):
+# to_copy:    SourceFile entries of reference files missing in update
+# conflicts:  (relative path, reference size, update size, reason) of files
+#             that exist in both trees but differ
+# extra:      relative paths of files only in update
+# duplicates: (relative path, original) of missing files whose content
+#             already exists in update under another name
+#
+SyncPlan = namedtuple("SyncPlan", ["to_copy", "conflicts", "extra", "duplicates"])
+
+@metrics.timer("plan")
+def BuildSyncPlan(reference_dir, update_dir, a_catalog=None, a_dedup=False):
+    """
+    Compares reference_dir and update_dir, including their subfolders.
+    If a_catalog is the DestinationCatalog of update_dir, the content of
+    update_dir is read from the catalog instead of the file system.
+    If a_dedup is True, missing files whose content already exists in
+    update_dir under another name are not copied, and files with the same
+    name and size are also compared by content.
+    Both trees are listed into a FileCatalog and matched in path order.
+    """
+    from DuplicateFinder import DuplicateFinder, PartialHash
+    from FileCatalog import FileCatalog, MatchFiles
+    ref_files = FileCatalog.fromScan(reference_dir, a_recursive=True)
+    if a_catalog:
+        upd_files = FileCatalog(update_dir)
+        for folder, name, size, _ in a_catalog.allFiles():
+            upd_files.add(folder, name, size)
+    elif os.path.isdir(update_dir):
+        upd_files = FileCatalog.fromScan(update_dir, a_recursive=True)
+    else:
+        upd_files = FileCatalog(update_dir)
+
+    to_copy = []
+    conflicts = []
+    extra = []
+    for ref_row, upd_row in MatchFiles(ref_files, upd_files):
+        if upd_row is None:
+            to_copy.append(ref_files.file(ref_row))
+            continue
+        if ref_row is None:
+            extra.append(upd_files.relPath(upd_row))
+            continue
+        src = ref_files.file(ref_row)
+        upd_size = upd_files.size(upd_row)
+        if upd_size != src.size:
+            conflicts.append((src.rel_path, src.size, upd_size, "sizes differ"))
+        elif a_dedup and PartialHash(src.path, src.size) != PartialHash(os.path.join(update_dir, src.rel_path), upd_size):
+            conflicts.append((src.rel_path, src.size, upd_size, "contents differ"))
+
+    duplicates = []
+    if a_dedup and to_copy:
+        finder = DuplicateFinder()
+        for row in upd_files.rows():
+            rel_path = upd_files.relPath(row)
+            size = upd_files.size(row)
+            file_hash = a_catalog.getFileHash(*os.path.split(rel_path)) if a_catalog else None
+            finder.addReference(os.path.join(update_dir, rel_path), size, file_hash)
+        found = finder.findDuplicates([(src.path, src.size) for src in to_copy])
+        duplicates = [(src.rel_path, found[src.path]) for src in to_copy if src.path in found]
+        to_copy = [src for src in to_copy if src.path not in found]
+        if a_catalog:
+            for path, file_hash in finder.computed_hashes.items():
+                rel_path = os.path.relpath(path, update_dir)
+                if not rel_path.startswith(".."):
+                    a_catalog.setFileHash(*os.path.split(rel_path), file_hash)
+
+    return SyncPlan(to_copy, conflicts, extra, duplicates)
+
+# Print the reports of a plan, and the copies it would make if a_dry_run is True
+def PrintSyncPlan(a_plan, a_dry_run=False):
+    if a_dry_run:
+        for src in a_plan.to_copy:
+            print(f"Would copy: {src.rel_path} ({src.size:,} bytes)")
+    for rel_path, ref_size, upd_size, reason in a_plan.conflicts:
+        print(f"REPORT: {rel_path} exists in both but {reason}! "
+              f"(Ref: {ref_size} bytes, Upd: {upd_size} bytes)")
+    for rel_path, original in a_plan.duplicates:
+        print(f"REPORT: {rel_path} not copied, duplicate of {original}.")
+    for rel_path in a_plan.extra:
+        print(f"REPORT: {rel_path} exists in update directory but not in reference.")
+    print(f"To copy: {len(a_plan.to_copy)} ({sum(src.size for src in a_plan.to_copy):,} bytes)    "
+          f"Conflicts: {len(a_plan.conflicts)}    Duplicates: {len(a_plan.duplicates)}    Extra: {len(a_plan.extra)}")
+
+# Copy the missing files of a plan, a_jobs files at a time, with the
+# FileTransfer mode a_mode. With a_verify, the files are copied and hashed in
+# a single pass and their digest is recorded in a_catalog. If a_fsync_batch
+# is set, the copies are synced to disk that many files at a time.
+# Returns the number of files copied.
+def ExecuteSyncPlan(a_plan, update_dir, a_jobs=1, a_catalog=None, a_mode="copy", a_verify=False, a_fsync_batch=0):
+    from FileTransfer import SyncBatch, TransferFileAtomic, TransferFileVerified
+    # Create the folders first, so the copies do not race to create them
+    for folder in sorted({os.path.dirname(src.rel_path) for src in a_plan.to_copy}):
+        folder_path = os.path.join(update_dir, folder)
+        if not os.path.isdir(folder_path):
+            os.makedirs(folder_path)
+            if a_catalog:
+                a_catalog.addFolder(folder)
+
+    sync_batch = SyncBatch(a_fsync_batch) if a_fsync_batch else None
+
+    # Returns the mode used and the digest of the copy, if verified
+    @metrics.timer("copy")
+    def copy_one(a_src):
+        # All modes preserve metadata (like timestamps), as copy2 does.
+        dest = os.path.join(update_dir, a_src.rel_path)
+        if a_verify:
+            return ("verified", TransferFileVerified(a_src.path, dest, None, sync_batch))
+        used_mode = TransferFileAtomic(a_src.path, dest, a_mode)
+        if sync_batch:
+            sync_batch.add(dest)
+        return (used_mode, None)
+
+    import concurrent.futures
+    num_copied = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, a_jobs)) as pool:
+        futures = {pool.submit(copy_one, src): src for src in a_plan.to_copy}
+        for future in concurrent.futures.as_completed(futures):
+            src = futures[future]
+            try:
+                used_mode, file_hash = future.result()
+            except OSError as e:
+                log.write(f"Error copying {src.rel_path}: {e}")
+                continue
+            if a_catalog:
+                a_catalog.recordFile(os.path.dirname(src.rel_path), src.name, src.size, src.mtime, file_hash)
+            log.detail(f"Copied: {src.rel_path} to update directory" + (f" ({used_mode})." if used_mode != "copy" else "."))
+            metrics.count("files_copied")
+            metrics.count("bytes_copied", src.size)
+            num_copied += 1
+    if sync_batch:
+        sync_batch.flush()
+        for path, error in sync_batch.errors:
+            log.write(f"Error syncing {path}: {error}")
+    log.flush()
+
+    if a_catalog:
+        a_catalog.commit()
+    return num_copied
+
+def sync_directories(reference_dir, update_dir, a_catalog=None, a_dedup=False, a_jobs=1, a_dry_run=False, a_mode="copy",
+                     a_verify=False, a_fsync_batch=0):
     """
-    Syncs the update_dir to match the reference_dir based on name and size.
+    Syncs the update_dir to match the reference_dir based on name and size,
+    including subfolders. With a_dry_run, only prints what would be done.
+    See BuildSyncPlan() for a_catalog and a_dedup, FileTransfer for a_mode
+    and ExecuteSyncPlan() for a_verify and a_fsync_batch.
     Example usage:
     sync_directories('./source_folder', './backup_folder')
     """
+    plan = BuildSyncPlan(reference_dir, update_dir, a_catalog, a_dedup)
+    PrintSyncPlan(plan, a_dry_run)
+    if a_dry_run:
+        return plan
+
     # Ensure the update directory exists
     if not os.path.exists(update_dir):
         os.makedirs(update_dir)
+    ExecuteSyncPlan(plan, update_dir, a_jobs, a_catalog, a_mode, a_verify, a_fsync_batch)
+    return plan
 
-    ref_files = os.listdir(reference_dir)
-    upd_files = os.listdir(update_dir)
 
-    # 1. Process files from reference to update
-    for filename in ref_files:
-        ref_path = os.path.join(reference_dir, filename)
-        upd_path = os.path.join(update_dir, filename)
+#######################################
+#
+# State shared by all the files of one import.
+#
+# lock serialises folder creation and reporting when several files are
+# imported concurrently. created_dirs remembers the folders already known to
+# exist so they are not checked again for every file. When catalog is set,
+# the destination is looked up in the DestinationCatalog instead of the
+# file system. duplicates maps staged files to an existing file with the same
+# content, see FindImportDuplicates(). mode is the FileTransfer mode used to
+# copy the files and used_modes counts the modes actually used. When journal
+# is set, the start of every transfer is recorded in the ImportJournal.
+# metadata is the MetadataCache of the capture dates read from the files,
+# opened on first use. When since is set (YYYYMMDD), files taken before it
+# are not imported. When verify is True, the files are copied and hashed in
+# a single pass, and sync_batch, if set, is the SyncBatch of the copies.
+#
+class ImportContext:
+    def __init__(self, a_source_dir, a_dest_dir, a_catalog=None, a_dedup=False, a_mode="copy", a_journal=None):
+        self.source_dir = a_source_dir
+        self.dest_dir = a_dest_dir
+        self.catalog = a_catalog
+        self.dedup = a_dedup
+        self.mode = a_mode
+        self.journal = a_journal
+        self.metadata = None
+        self.since = None
+        self.verify = False
+        self.sync_batch = None
+        self.used_modes = {}
+        self.duplicates = {}
+        self.hashes = {}
+        self.lock = threading.Lock()
+        self.created_dirs = set()
 
-        # Skip directories for this simple file-based implementation
-        if os.path.isdir(ref_path):
-            continue
+    # Per-file messages, hidden in quiet mode
+    def report(self, *args):
+        log.detail(*args)
 
-        ref_size = os.path.getsize(ref_path)
+    # Errors, always shown
+    def error(self, *args):
+        log.write(*args)
 
-        if filename in upd_files:
-            upd_size = os.path.getsize(upd_path)
-            
-            if ref_size == upd_size:
-                # Same name and same size - skip.
-                pass
+    # Make sure the destination folder exists. Returns False on error.
+    @metrics.timer("mkdir")
+    def ensureFolder(self, a_folder):
+        dest_file_path = os.path.join(self.dest_dir, a_folder)
+        with self.lock:
+            if dest_file_path in self.created_dirs:
+                return True
+            if self.catalog:
+                exists = self.catalog.hasFolder(a_folder)
             else:
-                # Same name but different size - report!
-                print(f"REPORT: {filename} exists in both but sizes differ! "
-                      f"(Ref: {ref_size} bytes, Upd: {upd_size} bytes)")
+                exists = os.path.isdir(dest_file_path)
+            if not exists:
+                try:
+                    os.mkdir(dest_file_path)
+                except FileExistsError:
+                    pass
+                except OSError:
+                    return False
+                if self.catalog:
+                    self.catalog.addFolder(a_folder)
+            self.created_dirs.add(dest_file_path)
+            return True
+
+    # Date of a staged file as YYYY-MM-DD, from its name or, when the name has
+    # no date, from its metadata. Returns "" if the date is unknown.
+    @metrics.timer("date")
+    def fileDate(self, a_src):
+        file_date = GetFileDate(a_src.name)
+        if file_date:
+            return file_date
+        from MediaMetadata import MetadataCache, ReadCaptureDate
+        with self.lock:
+            if self.metadata is None:
+                self.metadata = MetadataCache()
+        date = self.metadata.getCaptureDate(a_src.path, a_src.size, a_src.mtime)
+        if date is None:
+            date = ReadCaptureDate(a_src.path)
+            self.metadata.setCaptureDate(a_src.path, a_src.size, a_src.mtime, date)
+        if not date:
+            return ""
+        return date[:4] + "-" + date[4:6] + "-" + date[6:]
+
+    def close(self):
+        if self.metadata:
+            self.metadata.close()
+            self.metadata = None
+
+    # Size of an existing destination file, or None if it does not exist
+    @metrics.timer("dest_lookup")
+    def destFileSize(self, a_folder, a_name):
+        if self.catalog:
+            return self.catalog.getFileSize(a_folder, a_name)
+        try:
+            st = os.stat(os.path.join(self.dest_dir, a_folder, a_name))
+        except OSError:
+            return None
+        return st.st_size if stat.S_ISREG(st.st_mode) else None
+
+#######################################
+#
+# Import a single file from the staging folder into its dated destination folder.
+#
+# a_src is the SourceFile of the file. Its size comes from the listing of the
+# staging folder, the source file is not accessed again until it is copied.
+#
+# The file is written under a temporary name and renamed once complete, so
+# an interrupted import never leaves a partial file under the real name.
+#
+# Returns a tuple (action, bytes copied) where action is one of
+# "copied", "skipped", "overwritten", "duplicate", "rejected", "older" or "error".
+#
+@metrics.timer("import_file")
+def ImportOneFile(a_context, a_src):
+    from FileTransfer import TransferFileAtomic, TransferFileVerified
+    src_file_name = a_src.name
+    src_file_full_name = a_src.path
+
+    #
+    # The file must pass various checks to be imported.
+    #
+    with metrics.stage("qualify"):
+        file_qualification = QualifyFileSize(a_src.size)
+    if not file_qualification["qualified"]:
+        a_context.report(src_file_name, file_qualification["reason"])
+        return ("rejected", 0)
+
+    #
+    # Get the file's date. It will be used to name the file's destination folder.
+    #
+    file_date = a_context.fileDate(a_src)
+    if file_date == "":
+        a_context.report(src_file_name, "No date in file name or metadata")
+        return ("rejected", 0)
+
+    # Files named with a date were filtered out when listing, the others are
+    # only known to be older once their metadata was read.
+    if a_context.since and file_date.replace("-", "") < a_context.since:
+        a_context.report(src_file_name, "Older than the latest imported folder")
+        return ("older", 0)
+
+    dest_file_path = os.path.join(a_context.dest_dir, file_date)
+    dest_file_full_name = os.path.join(dest_file_path, src_file_name)
+
+    # Skip files whose content was already imported under another name
+    original = a_context.duplicates.get(src_file_full_name)
+    if original and original != dest_file_full_name:
+        a_context.report(src_file_name, "Duplicate of", original)
+        return ("duplicate", 0)
+
+    # If the photo's folder does not exist, create it.
+    if not a_context.ensureFolder(file_date):
+        a_context.error(src_file_name, "Error creating directory " + dest_file_path)
+        return ("error", 0)
+
+    #
+    # Copy the file to its destination folder.
+    #
+    src_size = a_src.size
+    action_string = "copied"
+    dest_size = a_context.destFileSize(file_date, src_file_name)
+    if dest_size is not None:
+        if a_context.dedup:
+            # The duplicate finder already compared the content of files with the same size
+            same_file = original == dest_file_full_name
         else:
-            # File doesn't exist in update, so copy it.
-            # copy2 preserves metadata (like timestamps) - copy does not.
-            shutil.copy2(ref_path, upd_path)
-            print(f"Copied: {filename} to update directory.")
+            same_file = dest_size == src_size
+        action_string = "skipped" if same_file else "overwritten"
 
-    # 2. Report files that exist in update but NOT in reference
-    for filename in upd_files:
-        if filename not in ref_files:
-            print(f"REPORT: {filename} exists in update directory but not in reference.")
+    try:
+        if action_string != "skipped":
+            if a_context.journal:
+                a_context.journal.startFile(a_src.rel_path)
+            file_hash = a_context.hashes.get(src_file_full_name)
+            with metrics.stage("copy"):
+                if a_context.verify:
+                    # Checked against the hash taken by the duplicate finder, if any
+                    file_hash = TransferFileVerified(src_file_full_name, dest_file_full_name, file_hash, a_context.sync_batch)
+                    used_mode = "verified"
+                else:
+                    used_mode = TransferFileAtomic(src_file_full_name, dest_file_full_name, a_context.mode)
+                    if a_context.sync_batch:
+                        a_context.sync_batch.add(dest_file_full_name)
+            metrics.observe("file_size", src_size)
+            with a_context.lock:
+                a_context.used_modes[used_mode] = a_context.used_modes.get(used_mode, 0) + 1
+            if a_context.catalog:
+                # All transfer modes preserve the modification time of the source
+                a_context.catalog.recordFile(file_date, src_file_name, src_size, a_src.mtime, file_hash)
+    except Exception as e:
+        a_context.error(src_file_name, "Error copying file to", dest_file_path, ": " + str(e))
+        return ("error", 0)
 
+    a_context.report("OK:", src_file_name, action_string)
+    return (action_string, src_size if action_string != "skipped" else 0)
 
 #######################################
 #
-# This function is the main coordinator of the workflow.
+# Find the staged files whose content already exists in the destination, or
+# in another staged file, and store them in a_context.duplicates.
 #
-def ImportPhonePhotos(a_source_dir, a_dest_dir):
-    #ClearDir(dest_dir)
-    all_files = GetSourceFiles(a_source_dir)
-    for src_file_name in all_files:
-        src_file_full_name = os.path.join(a_source_dir, src_file_name)
-
-        #
-        # The file must pass various checks to be imported.
-        #
-        file_qualification = QualifyFileSize(src_file_full_name)
-        if not file_qualification["qualified"]:
-            print(src_file_name, file_qualification["reason"])
+# The destination files are taken from the catalog when there is one,
+# otherwise the destination root and its folders are listed.
+#
+@metrics.timer("verify")
+def FindImportDuplicates(a_context, a_files, a_jobs=1):
+    from DuplicateFinder import DuplicateFinder
+    finder = DuplicateFinder(a_jobs)
+    catalog = a_context.catalog
+    if catalog:
+        for folder, name, size, file_hash in catalog.allFiles():
+            finder.addReference(os.path.join(a_context.dest_dir, folder, name), size, file_hash)
+    elif os.path.isdir(a_context.dest_dir):
+        folders = [a_context.dest_dir]
+        for folder in folders:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        finder.addReference(entry.path, entry.stat().st_size)
+                    elif entry.is_dir() and folder == a_context.dest_dir:
+                        folders.append(entry.path)
+
+    candidates = [(src.path, src.size) for src in a_files]
+
+    a_context.duplicates = finder.findDuplicates(candidates)
+    a_context.hashes = finder.computed_hashes
+
+    # Keep the hashes of the destination files for the next imports
+    if catalog:
+        for path, file_hash in finder.computed_hashes.items():
+            folder, name = os.path.split(os.path.relpath(path, a_context.dest_dir))
+            if not folder.startswith(".."):
+                catalog.setFileHash(folder, name, file_hash)
+
+    log.write(f"Content check: {len(candidates)} staged files, {len(finder.computed_hashes)} fully hashed")
+
+#######################################
+#
+# Files from different staging subfolders would land in the same destination
+# folder when they have the same name and date. Only the first file with a
+# given name is imported, the others are reported.
+#
+def UniqueSourceNames(a_files):
+    seen = {}
+    for src in a_files:
+        if src.name in seen:
+            log.write(src.rel_path, "Name already staged as", seen[src.name])
             continue
+        seen[src.name] = src.rel_path
+        yield src
+
+#######################################
+#
+# Tell how the journal of a run was opened, see ImportJournal.open().
+# a_kind is "import" or "copy".
+#
+def ReportJournalStart(a_journal, a_resume, a_resumed, a_kind):
+    if a_resume and not a_resumed:
+        if a_journal.replaced:
+            log.write(f"Warning: the interrupted {a_kind} was run with other options, starting a new one.")
+        else:
+            print(f"No interrupted {a_kind} to resume, starting a new one.")
+    elif a_journal.replaced:
+        log.write(f"Warning: the previous {a_kind} did not finish, starting a new one. Use --resume to continue it.")
 
-        #
-        # Get the file's date. It will be used to name the file's destination folder.
-        #
-        file_date = GetFileDate(src_file_full_name)
+#######################################
+#
+# Clean up after the imports interrupted in the middle of a transfer.
+# a_keys are the relative paths of the staged files, planned in a_journal.
+# A temporary file is the complete file when its source is gone (a move
+# falling back to a copy), otherwise it is partial and removed.
+#
+def RecoverInterruptedImports(a_context, a_journal, a_keys):
+    from FileTransfer import PartialPath
+    for rel_path in a_keys:
+        if rel_path not in a_journal.planned:
+            continue
+        size, mtime = a_journal.planned[rel_path]
+        name = os.path.basename(rel_path)
+        src = SourceFile(name, os.path.join(a_context.source_dir, rel_path), rel_path, size, mtime)
+        file_date = a_context.fileDate(src)
         if file_date == "":
-            print(src_file_name, "Error parsing file name")
             continue
-
-        # If the photo's folder does not exist, create it.
-        dest_file_path = os.path.join(a_dest_dir, file_date)
-        if not os.path.isdir(dest_file_path):
-            try:
-                os.mkdir(dest_file_path)
-            except OSError:
-                print(src_file_name, "Error creating directory " + dest_file_path)
-                continue
-        
-        #
-        # Copy the file to its destination folder.
-        #
-        dest_file_full_name = os.path.join(dest_file_path, src_file_name)
-        action_string = "copied"
-        if os.path.isfile(dest_file_full_name):
-            if os.path.getsize(dest_file_full_name) == os.path.getsize(src_file_full_name):
-                action_string = "skipped"
-            else:
-                action_string = "overwritten"
-        
+        dest_file_full_name = os.path.join(a_context.dest_dir, file_date, name)
+        temp = PartialPath(dest_file_full_name)
+        if not os.path.exists(temp):
+            continue
         try:
-            if action_string != "skipped":
-                shutil.copy2(src_file_full_name, dest_file_full_name)
-        except Exception as e:
-            print(src_file_name, "Error copying file to", dest_file_path, ": " + e.strerror)
+            if os.path.exists(src.path):
+                os.remove(temp)
+            else:
+                os.replace(temp, dest_file_full_name)
+        except OSError as e:
+            log.write(rel_path, "Error recovering interrupted import:", e)
+
+# Record every listed file in the journal as planned, and the end of the
+# listing once all the files were listed. Files done by the previous run are
+# not passed on.
+def PlanSourceFiles(a_journal, a_files):
+    for src in a_files:
+        if a_journal.isDone(src.rel_path):
+            continue
+        if src.rel_path not in a_journal.planned:
+            a_journal.planFile(src.rel_path, src.size, src.mtime)
+        yield src
+    a_journal.listingComplete()
+
+#######################################
+#
+# Read the camera of the staged photos of the FileCatalog a_files, in the
+# rows of a_selection, and keep those a_camera_filter accepts. The others
+# are passed to a_record as rejected.
+# Returns the selection of the accepted rows.
+#
+@metrics.timer("camera")
+def FilterCameras(a_camera_filter, a_files, a_jobs, a_record, a_selection=None):
+    from array import array
+    from MediaMetadata import CameraKey, MetadataCache, ScanCameras
+    cache = MetadataCache()
+    try:
+        cameras = ScanCameras(a_files.files(a_selection), cache, a_jobs)
+    finally:
+        cache.close()
+    accepted = array("I")
+    rows = a_files.rows(a_selection)
+    for row in rows:
+        src = a_files.file(row)
+        info = cameras.get(src.path)
+        if info is not None and not a_camera_filter.accepts(info):
+            log.detail(src.name, "Excluded camera:", CameraKey(info))
+            a_record(src, ("rejected", 0))
+            continue
+        accepted.append(row)
+    log.write(f"Camera check: {len(cameras)} photos, {len(rows) - len(accepted)} excluded")
+    return accepted
+
+# Reject the files of the FileCatalog a_files that are too small, see
+# QualifyFileSize(). They are passed to a_record as rejected.
+# Returns the selection of the others.
+def QualifyFileSizes(a_context, a_files, a_record):
+    with metrics.stage("qualify"):
+        qualified = a_files.select(a_min_size=min_file_size)
+        rejected = a_files.excluded(qualified) if len(qualified) < len(a_files) else ()
+    reason = QualifyFileSize(0)["reason"]
+    for row in rejected:
+        src = a_files.file(row)
+        a_context.report(src.name, reason)
+        a_record(src, ("rejected", 0))
+    return qualified
+
+# Pass on the files not in a_dropped, the others are passed to a_record as rejected.
+def DropReviewedFiles(a_dropped, a_files, a_record):
+    for src in a_files:
+        if src.rel_path in a_dropped:
+            log.detail(src.name, "Dropped in review")
+            a_record(src, ("rejected", 0))
             continue
+        yield src
 
-        print("OK:", src_file_name, action_string)
+#######################################
+#
+# Look for the groups of similar photos in the staging folder and write them
+# to a review file, where the user marks the photos not to import.
+#
+def ReviewSimilarPhotos(a_source_dir, a_review_file, a_max_distance, a_jobs=None, a_recursive=False):
+    import SimilarPhotos
+    from MediaMetadata import MetadataCache
+    if not SimilarPhotos.IsSimilarPhotosAvailable():
+        print("Looking for similar photos requires Pillow and NumPy (pip install pillow numpy).")
+        return
+    start = time.perf_counter()
+    files = list(ScanSourceFiles(a_source_dir, a_recursive))
+    cache = MetadataCache()
+    try:
+        groups = SimilarPhotos.FindSimilarPhotos(files, a_max_distance, cache, a_jobs)
+    finally:
+        cache.close()
+    SimilarPhotos.WriteReviewFile(groups, a_review_file, a_source_dir)
+    print(f"{len(groups)} groups of similar photos ({sum(len(group) for group in groups)} photos) "
+          f"among {len(files)} files in {time.perf_counter() - start:.2f}s")
+    print(f"Review them in {a_review_file}, then run: import --review {a_review_file}")
+
+#######################################
+#
+# This function is the main coordinator of the workflow.
+#
+# a_jobs is the number of files kept in flight. With a_jobs=1 the files are
+# imported one after the other, otherwise a pool of worker threads copies them
+# concurrently. Both paths make exactly the same decisions for every file.
+#
+# If a_catalog is the DestinationCatalog of a_dest_dir, the existing
+# destination files are looked up in the catalog, which is updated with the
+# imported files.
+#
+# If a_dedup is True, files whose content already exists in the destination
+# or in another staged file are reported and not imported.
+#
+# If a_recursive is True, the subfolders of a_source_dir are imported too.
+#
+# a_mode is the FileTransfer mode used to bring the files into the
+# destination: "copy", "move", "hardlink", "reflink" or "copy_file_range".
+#
+# If a_camera_filter is a CameraFilter, the camera of the staged photos is
+# read from their EXIF data and the photos it rejects are not imported.
+#
+# a_dropped is a set of relative paths of staged files not to import, the
+# photos marked "drop" in the review file of the similar photos.
+#
+# a_progress, if set, is called with (SourceFile, action) as each file is
+# done, from the thread running the import.
+#
+# If a_since is a date (YYYYMMDD), typically the date of the latest folder of
+# the destination, the files taken before it are not imported. Files with
+# the date in their name are left out of the listing before being stat'ed.
+#
+# If a_files is set, it is the iterable of the SourceFile entries to import,
+# instead of the listing of a_source_dir. It may be fed while the import
+# runs, see RunPipeline().
+#
+# If a_verify is True, the files are copied and hashed in a single pass (the
+# mode must be "copy") and the digest is recorded in the catalog. If
+# a_fsync_batch is set, the imported files are synced to disk that many at a
+# time, and all of them before the journal is closed.
+#
+# The progress is recorded in an ImportJournal. If a_resume is True and the
+# previous import of the same folders did not finish, it is continued: the
+# files it already imported are not looked at again.
+#
+# Returns a dictionary with the number of files per action.
+#
+def ImportPhonePhotos(a_source_dir, a_dest_dir, a_jobs=1, a_catalog=None, a_dedup=False, a_recursive=False, a_mode="copy", a_resume=False,
+                      a_camera_filter=None, a_dropped=None, a_progress=None, a_since=None, a_verify=False, a_fsync_batch=0,
+                      a_files=None):
+    from FileTransfer import SyncBatch
+    from ImportJournal import ImportJournal, JournalPath
+    #ClearDir(dest_dir)
+    journal = ImportJournal(JournalPath("import", a_source_dir, a_dest_dir))
+    context = ImportContext(a_source_dir, a_dest_dir, a_catalog, a_dedup, a_mode, journal)
+    context.since = a_since
+    context.verify = a_verify
+    if a_fsync_batch:
+        context.sync_batch = SyncBatch(a_fsync_batch)
+    header = {"source": os.path.abspath(a_source_dir), "dest": os.path.abspath(a_dest_dir), "recursive": a_recursive,
+              "since": a_since}
+    # The partial files of an interrupted import are cleaned up on every run
+    resumed = journal.open(header, a_resume,
+                           lambda a_journal: RecoverInterruptedImports(context, a_journal, a_journal.interrupted()))
+    ReportJournalStart(journal, a_resume, resumed, "import")
+    if resumed:
+        interrupted = journal.interrupted()
+        print(f"Resuming: {len(journal.done) - list(journal.done.values()).count('error')} files already done, "
+              f"{len(interrupted)} interrupted")
+
+    num_older_names = 0
+    if resumed and journal.listing_complete and a_files is None:
+        # The journal has the complete list, the staging folder is not listed again
+        all_files = (SourceFile(os.path.basename(rel_path), os.path.join(a_source_dir, rel_path), rel_path, size, mtime)
+                     for rel_path, (size, mtime) in journal.pending())
+    elif a_files is not None:
+        all_files = PlanSourceFiles(journal, a_files)
+    else:
+        name_filter = None
+        if a_since:
+            def name_filter(a_name):
+                nonlocal num_older_names
+                if IsNameBefore(a_name, a_since):
+                    num_older_names += 1
+                    return False
+                return True
+        all_files = metrics.timed("list", ScanSourceFiles(a_source_dir, a_recursive, name_filter))
+        if a_recursive:
+            all_files = UniqueSourceNames(all_files)
+        all_files = PlanSourceFiles(journal, all_files)
+    counts = {"copied": 0, "skipped": 0, "overwritten": 0, "duplicate": 0, "rejected": 0, "older": 0, "error": 0}
+    bytes_copied = 0
+    finished = False
+    start = time.perf_counter()
+
+    def record(a_src, a_result):
+        nonlocal bytes_copied
+        action, num_bytes = a_result
+        journal.finishFile(a_src.rel_path, action)
+        metrics.count("files_" + action)
+        metrics.count("bytes_copied", num_bytes)
+        counts[action] += 1
+        bytes_copied += num_bytes
+        if a_progress:
+            a_progress(a_src, action)
+
+    try:
+        if a_dropped:
+            all_files = DropReviewedFiles(a_dropped, all_files, record)
+
+        # The listing of the staging folder, or of the journal, is kept in a
+        # FileCatalog where the qualify, camera and duplicate stages work on
+        # selections of its rows, and the import takes the selected files one
+        # at a time. The files fed by the pipeline are imported as they come,
+        # unless the camera filter or the duplicates need them all.
+        if a_files is None or a_camera_filter or a_dedup:
+            from FileCatalog import FileCatalog
+            staged = FileCatalog.fromFiles(a_source_dir, all_files)
+            selection = QualifyFileSizes(context, staged, record)
+            if a_camera_filter:
+                selection = FilterCameras(a_camera_filter, staged, a_jobs, record, selection)
+            if a_dedup:
+                FindImportDuplicates(context, staged.files(selection), a_jobs)
+            all_files = staged.files(selection)
+
+        if a_jobs <= 1:
+            for src in all_files:
+                record(src, ImportOneFile(context, src))
+        else:
+            # Keep a bounded number of files in flight so a huge staging folder
+            # does not queue tens of thousands of pending tasks at once.
+            import concurrent.futures
+            max_in_flight = a_jobs * 2
+            with concurrent.futures.ThreadPoolExecutor(max_workers=a_jobs) as pool:
+                in_flight = {}
+                for src in all_files:
+                    if len(in_flight) >= max_in_flight:
+                        done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            record(in_flight.pop(future), future.result())
+                    in_flight[pool.submit(ImportOneFile, context, src)] = src
+                for future in concurrent.futures.as_completed(in_flight):
+                    record(in_flight[future], future.result())
+        finished = True
+    finally:
+        if context.sync_batch:
+            context.sync_batch.flush()
+            for path, error in context.sync_batch.errors:
+                log.write(f"Error syncing {path}: {error}")
+            finished = finished and not context.sync_batch.errors
+        # Files that failed are retried by --resume, a clean run leaves no journal
+        journal.close(a_finished=finished and counts["error"] == 0)
+        context.close()
+
+    if a_catalog:
+        a_catalog.commit()
+
+    log.flush()
+    elapsed = time.perf_counter() - start
+    num_files = sum(counts.values())
+    print(f"Copied: {counts['copied']}    Overwritten: {counts['overwritten']}    Skipped: {counts['skipped']}    "
+          f"Duplicates: {counts['duplicate']}    Rejected: {counts['rejected']}    Errors: {counts['error']}")
+    if a_since:
+        print(f"Older than {a_since[:4]}-{a_since[4:6]}-{a_since[6:]}: {num_older_names} left out by name, "
+              f"{counts['older']} by metadata")
+    if context.used_modes:
+        print("Transfers: " + ", ".join(f"{mode} {n}" for mode, n in sorted(context.used_modes.items())))
+    if elapsed > 0:
+        print(f"{num_files} files in {elapsed:.2f}s ({a_jobs} jobs): "
+              f"{num_files / elapsed:.1f} files/s, {bytes_copied / elapsed / (1024*1024):.1f} MB/s")
+    return counts
+
+#######################################
+#
+# Move a file copied from the phone into the staging folder.
+# The Shell may still hold the new file for a moment after it reached its
+# full size, the rename is retried for a few seconds.
+#
+def CommitPhoneFile(a_temp_file, a_local_file):
+    for attempt in range(20):
+        try:
+            os.replace(a_temp_file, a_local_file)
+            return True
+        except PermissionError:
+            time.sleep(0.25)
+        except OSError:
+            break
+    log.write(f"Error moving {a_temp_file} to {a_local_file}.")
+    return False
 
 #######################################
 #
 # Copy photos from the phone to the stage folder
 #
-def CopyPhotosFromPhone(a_dest_folder):
+# a_jobs is the number of transfers kept in flight.
+#
+# The files are copied to a temporary folder inside the staging folder and
+# moved into the staging folder once complete, so an interrupted copy never
+# leaves a partial file in the staging folder. The progress is recorded in
+# an ImportJournal; if a_resume is True and the previous copy from the same
+# phone did not finish, the files it already copied are not checked again.
+#
+# If a_since is a date (YYYYMMDD), the files taken before it are left out of
+# the phone listing and not copied.
+#
+# a_staged, if set, is called with the name of every file of the listing
+# that is complete in the staging folder: already there, or as soon as its
+# copy is committed.
+#
+# a_serial selects the phone when several are connected. a_claim, if set, is
+# called with the name and size of every file to copy and returns False
+# when the same file is staged from another phone, which is then not copied.
+# Such a file is left unfinished in the journal, the other phone may still
+# fail to copy it. a_release is called with the name and size of every file
+# claimed but not copied, for another phone to claim it again.
+#
+# a_policy is the order of the transfers, see OrderTransfers(). The number
+# of transfers in flight starts at a_jobs and follows the throughput, see
+# TransferEngine.
+#
+# Returns a dictionary with the number of files "copied", "skipped",
+# "duplicate", "resumed" and "error".
+#
+def CopyPhotosFromPhone(a_dest_folder, a_jobs=4, a_resume=False, a_since=None, a_staged=None, a_serial=None, a_claim=None,
+                        a_policy=default_transfer_policy, a_release=None):
     num_skipped_files = 0;
+    num_duplicate_files = 0;
     num_copied_files = 0;
     num_errors = 0;
-    phone = AndroidPhone()
+    from FileTransfer import partial_folder_name
+    from ImportJournal import ImportJournal, JournalPath
+    from PhoneTools import AndroidPhone
+    with metrics.stage("enumerate"):
+        phone = AndroidPhone(a_since, a_serial=a_serial)
+    if not phone.phone:
+        return None
     file_list = phone.listFileNames()
-    for file_name in file_list:
-        # If the file already exists in the staging folder, skip the copy.
-        if os.path.exists(os.path.join(a_dest_folder, file_name)):
-            num_skipped_files += 1
+
+    journal = ImportJournal(JournalPath("copy", f"phone:{phone.serial}", a_dest_folder))
+    header = {"device": phone.serial, "dest": os.path.abspath(a_dest_folder), "since": a_since}
+    resumed = journal.open(header, a_resume)
+    ReportJournalStart(journal, a_resume, resumed, "copy")
+
+    # Anything left in the temporary folder is partial
+    temp_folder = os.path.join(a_dest_folder, partial_folder_name)
+    os.makedirs(temp_folder, exist_ok=True)
+    for entry in os.scandir(temp_folder):
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+    num_resumed_files = 0
+    to_copy = []
+    pending = set()   # claimed files not copied yet
+    finished = False
+    try:
+        for file_name in file_list:
+            if resumed and journal.isDone(file_name):
+                num_resumed_files += 1
+                if a_staged and os.path.exists(os.path.join(a_dest_folder, file_name)):
+                    a_staged(file_name)
+                continue
+            if file_name not in journal.planned:
+                journal.planFile(file_name, phone.getFileSize(file_name))
+            # If the complete file already exists in the staging folder, skip the copy.
+            local_file = os.path.join(a_dest_folder, file_name)
+            if os.path.exists(local_file) and os.path.getsize(local_file) == phone.getFileSize(file_name):
+                num_skipped_files += 1
+                journal.finishFile(file_name, "skipped")
+                if a_staged:
+                    a_staged(file_name)
+                continue
+            # Not finished: --resume checks the claim again
+            if a_claim and not a_claim(file_name, phone.getFileSize(file_name)):
+                num_duplicate_files += 1
+                continue
+            to_copy.append(file_name)
+            pending.add(file_name)
+        journal.listingComplete()
+
+        # Copy the files
+        for file_name in to_copy:
+            journal.startFile(file_name)
+        for file_name, success in phone.copyFilesToLocal(to_copy, temp_folder, a_jobs, a_policy):
+            pending.discard(file_name)
+            if success:
+                with metrics.stage("commit"):
+                    success = CommitPhoneFile(os.path.join(temp_folder, file_name), os.path.join(a_dest_folder, file_name))
+            journal.finishFile(file_name, "copied" if success else "error")
+            metrics.count("files_copied" if success else "files_error")
+            num_copied_files += success # Increment copied files if success
+            num_errors += not success   # Increment the number of errors if not success
+            if success and a_staged:
+                a_staged(file_name)
+            if not success and a_release:
+                a_release(file_name, phone.getFileSize(file_name))
+        finished = True
+    finally:
+        # Files that failed are retried by --resume, a clean run leaves no journal
+        journal.close(a_finished=finished and num_errors == 0)
+        if a_release:
+            for file_name in pending:
+                a_release(file_name, phone.getFileSize(file_name))
+
+    # Through the log, the copies from several phones may end at the same time
+    if resumed:
+        log.write(f"Resumed: {num_resumed_files} files already copied by the previous run")
+    log.write(f"Copied: {num_copied_files}    Skipped: {num_skipped_files}    Errors: {num_errors}"
+              + (f"    From another phone: {num_duplicate_files}" if a_claim else ""))
+    log.flush()
+    return {"copied": num_copied_files, "skipped": num_skipped_files, "duplicate": num_duplicate_files,
+            "resumed": num_resumed_files, "error": num_errors}
+
+#######################################
+#
+# Files of the staging folder, shared by the copies from several phones.
+#
+# A file is identified by its name and size. The files already staged, in
+# the staging folder or the folder of any phone, belong to their folder, and
+# the first copy claiming a new file gets it: a photo shared between the
+# phones (WhatsApp, shared albums) is only transferred once.
+#
+class StagedFiles:
+    def __init__(self, a_stage_dir):
+        self.__lock = threading.Lock()
+        self.__owners = {}   # (name, size) -> staging subfolder
+        if os.path.isdir(a_stage_dir):
+            for src in ScanSourceFiles(a_stage_dir, a_recursive=True):
+                self.__owners.setdefault((src.name, src.size), os.path.dirname(src.rel_path))
+
+    # Returns True if the file is for a_owner to copy
+    def claim(self, a_owner, a_name, a_size):
+        with self.__lock:
+            return self.__owners.setdefault((a_name, a_size), a_owner) == a_owner
+
+    # Gives up the claim of a_owner on a file it failed to copy
+    def release(self, a_owner, a_name, a_size):
+        with self.__lock:
+            if self.__owners.get((a_name, a_size)) == a_owner:
+                del self.__owners[(a_name, a_size)]
+
+#######################################
+#
+# Copy the photos from every connected phone at the same time, each one to
+# its own subfolder of the staging folder, named after its serial number.
+#
+# Every phone is copied by CopyPhotosFromPhone() in a thread of its own, the
+# Shell objects of a phone belong to the thread that created them. Files
+# with the same name and size on several phones are only copied once, see
+# StagedFiles. The progress of all the phones is reported every
+# progress_interval seconds.
+#
+# Returns a dictionary serial -> counts of CopyPhotosFromPhone().
+#
+progress_interval = 5 # seconds
+
+def CopyFromAllPhones(a_stage_dir, a_jobs=4, a_resume=False, a_since=None, a_policy=default_transfer_policy):
+    import concurrent.futures
+    from PhoneTools import InitializeComThread, ListDevices, UninitializeComThread
+    with metrics.stage("enumerate"):
+        devices = ListDevices()
+    if not devices:
+        print("Android device not found. Ensure it's in 'File Transfer' mode.")
+        return {}
+    print(f"Phones: {', '.join(f'{name} ({serial})' for serial, name in devices)}")
+
+    staged = StagedFiles(a_stage_dir)
+    num_staged = {serial: 0 for serial, _ in devices}
+    lock = threading.Lock()
+
+    def copy_phone(a_serial):
+        dest_folder = os.path.join(a_stage_dir, a_serial)
+        os.makedirs(dest_folder, exist_ok=True)
+
+        def on_staged(a_file_name):
+            with lock:
+                num_staged[a_serial] += 1
+
+        InitializeComThread()
+        try:
+            return CopyPhotosFromPhone(dest_folder, a_jobs, a_resume, a_since, on_staged, a_serial,
+                                       lambda name, size: staged.claim(a_serial, name, size), a_policy,
+                                       lambda name, size: staged.release(a_serial, name, size))
+        finally:
+            UninitializeComThread()
+
+    results = {}
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(devices)) as pool:
+        futures = {pool.submit(copy_phone, serial): serial for serial, _ in devices}
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=progress_interval)
+            for future in done:
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    log.write(f"Error copying from {futures[future]}: {e}")
+                    results[futures[future]] = None
+            if pending:
+                with lock:
+                    log.write("Staged: " + ", ".join(f"{name} {num_staged[serial]}" for serial, name in devices))
+
+    log.flush()
+    print(f"Summary of {len(devices)} phones in {time.perf_counter() - start:.2f}s:")
+    for serial, name in devices:
+        counts = results.get(serial)
+        if counts is None:
+            print(f"  {name} ({serial}): failed")
             continue
+        print(f"  {name} ({serial}): Copied: {counts['copied']}    Skipped: {counts['skipped'] + counts['resumed']}    "
+              f"From another phone: {counts['duplicate']}    Errors: {counts['error']}")
+    print("Import them with -r to include the folders of the phones.")
+    return results
+
+# Raised in the phone copy when the import of the pipeline stopped
+class ImportStopped(Exception):
+    pass
+
+#######################################
+#
+# Copy the photos from the phone and import them in the same run.
+#
+# The phone copy runs in the calling thread, the Shell objects of the phone
+# belong to the thread that created them, and the import in a background
+# thread. Every file complete in the staging folder is passed to the import
+# through a bounded queue: the destination works while the phone transfers,
+# and a destination slower than the phone holds the phone back instead of
+# letting the staged files pile up.
+#
+# With a_dedup or a_camera_filter, the import needs the complete list of
+# files and only starts once the copy is done.
+#
+# See CopyPhotosFromPhone() and ImportPhonePhotos() for the options.
+# Returns the counts of ImportPhonePhotos(), None if the phone was not found.
+#
+def RunPipeline(a_stage_dir, a_dest_dir, a_copy_jobs=4, a_import_jobs=1, a_catalog=None, a_dedup=False, a_mode="copy",
+                a_resume=False, a_camera_filter=None, a_dropped=None, a_since=None, a_verify=False, a_fsync_batch=0,
+                a_policy=default_transfer_policy):
+    staged = queue.Queue(maxsize=max(16, a_import_jobs * 4))
+    end_of_files = None
+    result = {}
+
+    # Files of the queue, as the phone copy completes them
+    def staged_files():
+        while True:
+            with metrics.stage("wait_phone"):
+                src = staged.get()
+            if src is end_of_files:
+                return
+            yield src
+
+    def run_import():
+        start = time.perf_counter()
+        try:
+            result["counts"] = ImportPhonePhotos(a_stage_dir, a_dest_dir, a_import_jobs, a_catalog, a_dedup, False, a_mode,
+                                                 a_resume, a_camera_filter, a_dropped, a_since=a_since, a_verify=a_verify,
+                                                 a_fsync_batch=a_fsync_batch, a_files=staged_files())
+        except BaseException as e:
+            result["error"] = e
+        result["time"] = time.perf_counter() - start
+
+    import_thread = threading.Thread(target=run_import, name="import")
+
+    # Wait for room in the queue, unless the import stopped
+    def put(a_item):
+        with metrics.stage("wait_import"):
+            while True:
+                try:
+                    staged.put(a_item, timeout=0.5)
+                    return
+                except queue.Full:
+                    if not import_thread.is_alive():
+                        raise ImportStopped()
+
+    def on_staged(a_file_name):
+        path = os.path.join(a_stage_dir, a_file_name)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            log.write(a_file_name, "Error reading staged file:", e)
+            return
+        put(SourceFile(a_file_name, path, a_file_name, st.st_size, st.st_mtime))
+
+    start = time.perf_counter()
+    import_thread.start()
+    copy_counts = None
+    try:
+        copy_counts = CopyPhotosFromPhone(a_stage_dir, a_copy_jobs, a_resume, a_since, on_staged, a_policy=a_policy)
+    except ImportStopped:
+        # The error of the import is raised below, the copy can be resumed
+        pass
+    finally:
+        copy_time = time.perf_counter() - start
+        # The import finishes the files already queued
+        try:
+            put(end_of_files)
+        except ImportStopped:
+            pass
+        import_thread.join()
+    if "error" in result:
+        raise result["error"]
+
+    elapsed = time.perf_counter() - start
+    counts = result["counts"]
+    print("Pipeline summary:")
+    if copy_counts is None:
+        print("  Phone:  not found")
+    else:
+        print(f"  Phone:  Copied: {copy_counts['copied']}    Skipped: {copy_counts['skipped'] + copy_counts['resumed']}    "
+              f"Errors: {copy_counts['error']}    in {copy_time:.2f}s")
+    print(f"  Import: Copied: {counts['copied'] + counts['overwritten']}    Skipped: {counts['skipped']}    "
+          f"Not imported: {counts['duplicate'] + counts['rejected'] + counts['older']}    Errors: {counts['error']}    "
+          f"in {result['time']:.2f}s")
+    print(f"  Total:  {elapsed:.2f}s")
+    return counts if copy_counts is not None else None
+
+
+
+#######################################
+#
+# Import photos from the phone straight into their dated destination folder,
+# without a copy in the staging folder: every file is written once.
+#
+# The date of a file comes from the phone listing: its name, else the date
+# the photo was taken, else its modification time. The files go through the
+# same checks as ImportOneFile(): too small files are rejected, files taken
+# before a_since (YYYYMMDD) are left out, a destination file with the same
+# size is skipped and one with another size is overwritten.
+#
+# The files are copied to a temporary folder of the destination and moved
+# into their dated folder once complete, so an interrupted import never
+# leaves a partial file. The progress is recorded in an ImportJournal, see
+# CopyPhotosFromPhone() for a_resume, and for a_jobs and a_policy, which
+# set the transfers in flight and their order.
+#
+# Returns a dictionary with the number of files per action, None if the
+# phone was not found.
+#
+def ImportFromPhone(a_dest_dir, a_jobs=4, a_catalog=None, a_resume=False, a_since=None, a_policy=default_transfer_policy):
+    from FileTransfer import partial_folder_name
+    from ImportJournal import ImportJournal, JournalPath
+    from PhoneTools import AndroidPhone
+    with metrics.stage("enumerate"):
+        phone = AndroidPhone(a_since)
+    if not phone.phone:
+        return None
+
+    journal = ImportJournal(JournalPath("direct", f"phone:{phone.serial}", a_dest_dir))
+    header = {"device": phone.serial, "dest": os.path.abspath(a_dest_dir), "since": a_since}
+    resumed = journal.open(header, a_resume)
+    ReportJournalStart(journal, a_resume, resumed, "import")
+    context = ImportContext(None, a_dest_dir, a_catalog, a_journal=journal)
+    context.since = a_since
+
+    # Anything left in the temporary folder is partial
+    temp_folder = os.path.join(a_dest_dir, partial_folder_name)
+    os.makedirs(temp_folder, exist_ok=True)
+    for entry in os.scandir(temp_folder):
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+    counts = {"copied": 0, "skipped": 0, "overwritten": 0, "rejected": 0, "older": 0, "error": 0}
+    num_resumed_files = 0
+    bytes_copied = 0
+    folders = {}    # file name -> date folder, of the files to transfer
+    actions = {}    # file name -> "copied" or "overwritten"
+    finished = False
+    start = time.perf_counter()
+
+    def record(a_file_name, a_action, a_num_bytes=0):
+        nonlocal bytes_copied
+        journal.finishFile(a_file_name, a_action)
+        metrics.count("files_" + a_action)
+        metrics.count("bytes_copied", a_num_bytes)
+        counts[a_action] += 1
+        bytes_copied += a_num_bytes
+
+    try:
+        # 1. Decide what to do with every file from the listing
+        for file_name in phone.listFileNames():
+            if resumed and journal.isDone(file_name):
+                num_resumed_files += 1
+                continue
+            size = phone.getFileSize(file_name)
+            if file_name not in journal.planned:
+                journal.planFile(file_name, size)
+            file_qualification = QualifyFileSize(size)
+            if not file_qualification["qualified"]:
+                context.report(file_name, file_qualification["reason"])
+                record(file_name, "rejected")
+                continue
+            with metrics.stage("date"):
+                file_date = phone.getFileDate(file_name)
+            if file_date == "":
+                context.report(file_name, "No date in file name or on the phone")
+                record(file_name, "rejected")
+                continue
+            if a_since and file_date.replace("-", "") < a_since:
+                context.report(file_name, "Older than the latest imported folder")
+                record(file_name, "older")
+                continue
+            dest_size = context.destFileSize(file_date, file_name)
+            if dest_size == size:
+                context.report("OK:", file_name, "skipped")
+                record(file_name, "skipped")
+                continue
+            if not context.ensureFolder(file_date):
+                context.error(file_name, "Error creating directory " + os.path.join(a_dest_dir, file_date))
+                record(file_name, "error")
+                continue
+            folders[file_name] = file_date
+            actions[file_name] = "copied" if dest_size is None else "overwritten"
+        journal.listingComplete()
+
+        # 2. Transfer the files and move each one into its dated folder
+        to_copy = list(folders)
+        for file_name in to_copy:
+            journal.startFile(file_name)
+        for file_name, success in phone.copyFilesToLocal(to_copy, temp_folder, a_jobs, a_policy):
+            dest_file_full_name = os.path.join(a_dest_dir, folders[file_name], file_name)
+            if success:
+                with metrics.stage("commit"):
+                    success = CommitPhoneFile(os.path.join(temp_folder, file_name), dest_file_full_name)
+            if not success:
+                context.error(file_name, "Error copying file to", os.path.dirname(dest_file_full_name))
+                record(file_name, "error")
+                continue
+            try:
+                st = os.stat(dest_file_full_name)
+            except OSError as e:
+                context.error(file_name, "Error reading imported file:", e)
+                record(file_name, "error")
+                continue
+            if a_catalog:
+                a_catalog.recordFile(folders[file_name], file_name, st.st_size, st.st_mtime)
+            metrics.observe("file_size", st.st_size)
+            context.report("OK:", file_name, actions[file_name])
+            record(file_name, actions[file_name], st.st_size)
+        finished = True
+    finally:
+        # Files that failed are retried by --resume, a clean run leaves no journal
+        journal.close(a_finished=finished and counts["error"] == 0)
+        context.close()
+        try:
+            os.rmdir(temp_folder)
+        except OSError:
+            pass
 
-        # Copy the file
-        success = phone.copyFileToLocal(file_name, a_dest_folder)
-        num_copied_files += success # Increment copied files if success
-        num_errors += not success   # Increment the number of errors if not success
+    if a_catalog:
+        a_catalog.commit()
 
-    print(f"Copied: {num_copied_files}    Skipped: {num_skipped_files}    Errors: {num_errors}")
+    log.flush()
+    elapsed = time.perf_counter() - start
+    if resumed:
+        print(f"Resumed: {num_resumed_files} files already imported by the previous run")
+    print(f"Copied: {counts['copied']}    Overwritten: {counts['overwritten']}    Skipped: {counts['skipped']}    "
+          f"Rejected: {counts['rejected']}    Older: {counts['older']}    Errors: {counts['error']}")
+    if elapsed > 0:
+        num_files = sum(counts.values())
+        print(f"{num_files} files in {elapsed:.2f}s (from {a_jobs} transfers in flight): "
+              f"{num_files / elapsed:.1f} files/s, {bytes_copied / elapsed / (1024*1024):.1f} MB/s")
+    return counts
 
 
 
@@ -203,8 +1287,14 @@ def CopyPhotosFromPhone(a_dest_folder):
 # Find the date of the latest folder.
 #
 # If must_have_underscore=True, only look at folder names that end with "_".
+# If a_catalog is the DestinationCatalog of a_dir, the folders are read from
+# the catalog.
+# Returns the date as YYYYMMDD, or None when no folder has one.
 #
-def DateOfLatestFolder(a_dir, must_have_underscore=True):
+def DateOfLatestFolder(a_dir, must_have_underscore=True, a_catalog=None):
+    if a_catalog:
+        return a_catalog.latestFolderDate(must_have_underscore)
+
     # 1. Find the folder with the latest date
     # Pattern: yyyy-mm-dd_ (or yyyy-mm-dd if must_have_underscore is False)
     latest_folder = None
@@ -224,86 +1314,412 @@ def DateOfLatestFolder(a_dir, must_have_underscore=True):
                 latest_folder_date = folder_date
                 latest_folder = item
 
-    return latest_folder_date
+    return latest_folder_date or None
 
 
 
+#######################################
+#
+# Actions of the command line.
+#
+# Every action is a function taking the CommandLine options, registered with
+# @RegisterAction in the order of the help. The modules an action needs beyond the
+# common ones (the phone, the image libraries) are imported by its function,
+# so "import" runs without pywin32 and the help shows without loading any.
+# The modules an action cannot run without are listed in its requires, as
+# (module, package to install), and checked before it starts.
+#
+Action = namedtuple("Action", ["run", "summary", "uses_catalog", "uses_since", "confirm", "requires"])
+
+actions = {}  # name -> Action
+
+phone_modules = (("win32com", "pywin32"),)
+similar_modules = (("numpy", "numpy"), ("PIL", "pillow"))
+
+def RegisterAction(a_name, a_summary, a_uses_catalog=False, a_uses_since=False, a_confirm=False, a_requires=()):
+    def decorator(a_run):
+        actions[a_name] = Action(a_run, a_summary, a_uses_catalog, a_uses_since, a_confirm, a_requires)
+        return a_run
+    return decorator
+
+# Packages to install for the modules of a_action that are missing
+def MissingPackages(a_action):
+    import importlib.util
+    return [package for module, package in a_action.requires if importlib.util.find_spec(module) is None]
+
+@RegisterAction("copy", "Copy photos from the phone to the staging folder", a_uses_since=True,
+                a_requires=phone_modules)
+def CopyAction(a_options):
+    print(f"Copying from phone to: {a_options.stage_dir}")
+    if a_options.all_devices:
+        CopyFromAllPhones(a_options.stage_dir, a_options.jobs or 4, a_options.resume, a_options.since,
+                          a_options.transfer_policy)
+    else:
+        CopyPhotosFromPhone(a_options.stage_dir, a_options.jobs or 4, a_options.resume, a_options.since,
+                            a_policy=a_options.transfer_policy)
+
+# Camera filter and photos dropped in the review file, for import and pipeline
+def ImportFilters(a_options):
+    from MediaMetadata import CameraFilter
+    camera_filter = None
+    if a_options.include_cameras or a_options.exclude_cameras:
+        camera_filter = CameraFilter(a_options.include_cameras, a_options.exclude_cameras)
+    dropped = None
+    if a_options.review_file:
+        from SimilarPhotos import ReadReviewDrops
+        dropped = ReadReviewDrops(a_options.review_file)
+        print(f"Review: {len(dropped)} photos dropped")
+    return camera_filter, dropped
+
+@RegisterAction("import", "Sort photos from the staging folder into the destination",
+                a_uses_catalog=True, a_uses_since=True, a_confirm=True)
+def ImportAction(a_options):
+    print(f"Importing from {a_options.stage_dir} to: {a_options.dest_dir}")
+    if a_options.jobs is None:
+        a_options.jobs = DefaultJobCount(a_options.dest_dir)
+    camera_filter, dropped = ImportFilters(a_options)
+    ImportPhonePhotos(a_options.stage_dir, a_options.dest_dir, a_options.jobs, a_options.catalog, a_options.dedup,
+                      a_options.recursive, a_options.mode, a_options.resume, camera_filter, dropped,
+                      a_since=a_options.since, a_verify=a_options.verify, a_fsync_batch=a_options.fsync_batch)
+
+@RegisterAction("pipeline", """Copy photos from the phone and import each one into the
+destination as soon as it is in the staging folder. With
+--dedup or a camera filter, the import waits for the copy.""",
+                a_uses_catalog=True, a_uses_since=True, a_confirm=True, a_requires=phone_modules)
+def PipelineAction(a_options):
+    print(f"Copying from phone to {a_options.stage_dir} and importing to: {a_options.dest_dir}")
+    if a_options.jobs is None:
+        a_options.jobs = DefaultJobCount(a_options.dest_dir)
+    camera_filter, dropped = ImportFilters(a_options)
+    RunPipeline(a_options.stage_dir, a_options.dest_dir, a_options.copy_jobs, a_options.jobs, a_options.catalog, a_options.dedup,
+                a_options.mode, a_options.resume, camera_filter, dropped, a_options.since, a_options.verify,
+                a_options.fsync_batch, a_options.transfer_policy)
+
+@RegisterAction("direct", """Import photos from the phone straight into the destination,
+without a copy in the staging folder""",
+                a_uses_catalog=True, a_uses_since=True, a_confirm=True, a_requires=phone_modules)
+def DirectAction(a_options):
+    print(f"Importing from phone to: {a_options.dest_dir}")
+    ImportFromPhone(a_options.dest_dir, a_options.jobs or 4, a_options.catalog, a_options.resume, a_options.since,
+                    a_options.transfer_policy)
+
+@RegisterAction("sync", "Sync the staging folder into the destination", a_uses_catalog=True)
+def SyncAction(a_options):
+    print(f"Syncing {a_options.stage_dir} into {a_options.dest_dir}")
+    if a_options.jobs is None:
+        a_options.jobs = DefaultJobCount(a_options.dest_dir)
+    sync_directories(a_options.stage_dir, a_options.dest_dir, a_options.catalog, a_options.dedup, a_options.jobs,
+                     a_options.dry_run, a_options.mode, a_options.verify, a_options.fsync_batch)
+
+@RegisterAction("similar", """Find the groups of similar photos (bursts, variants) in the
+staging folder and write them to a review file""", a_requires=similar_modules)
+def SimilarAction(a_options):
+    import SimilarPhotos
+    print(f"Looking for similar photos in {a_options.stage_dir}")
+    max_distance = a_options.max_distance
+    if max_distance is None:
+        max_distance = SimilarPhotos.default_max_distance
+    ReviewSimilarPhotos(a_options.stage_dir, a_options.review_file or SimilarPhotos.default_review_file,
+                        max_distance, a_options.jobs, a_options.recursive)
+
 #######################################
 #
 # Display usage instructions
 #
 def DisplayHelp():
+    action_lines = []
+    for name, action in actions.items():
+        summary = action.summary.split("\n")
+        action_lines.append(f"  {name:<10} {summary[0]}")
+        action_lines.extend(f"             {line}" for line in summary[1:])
     help_text = """
 Usage: python PhonePhotoImporter.py [action] [options]
 
 Actions:
-  copy       Copy photos from the phone to the staging folder
-  import     Sort photos from the staging folder into the destination
-  sync       Sync the staging folder into the destination
+""" + "\n".join(action_lines) + """
 
 Options:
-  -h, /h     Show this help message
+  -h, /h, --help
+             Show this help message
   -t, /t     Run in test mode
+  -j N, --jobs N
+             Number of files transferred or imported concurrently (import
+             default depends on the number of CPUs and on whether the
+             destination is a network share, copy default is 4). For
+             pipeline, the number of files imported concurrently, see
+             --copy-jobs for the phone. For direct, the number of transfers
+             in flight to start with (default 4)
+  --copy-jobs N
+             For pipeline, the number of transfers from the phone in flight
+             to start with (default 4)
+  --no-catalog
+             Do not use the destination catalog, look up every file on disk
+  --rescan   List every destination folder again to rebuild the catalog
+  -r, --recursive
+             Also import the files in the subfolders of the staging folder
+  --mode MODE
+             How files get into the destination: copy (default), move,
+             hardlink, reflink or copy_file_range. Unsupported modes fall
+             back to the next cheapest one.
+  --verify   For import, pipeline and sync, copy each file and hash it in
+             the same pass, and record its digest in the catalog (--mode
+             copy only)
+  --fsync N  For import, pipeline and sync, flush the copied files to disk
+             N files at a time, and the last ones before finishing
+  --order POLICY
+             For copy, pipeline and direct, the order of the transfers from
+             the phone: photos-first (default, photos before videos, the
+             smallest first), smallest-first, newest-first or listing. The
+             number of transfers in flight starts at --jobs and follows the
+             measured throughput.
+  --resume   For copy, import, pipeline and direct, continue the previous
+             run where it stopped instead of starting over
+  --include-camera RULE, --exclude-camera RULE
+             For import and pipeline, only import the photos taken with a
+             matching camera, or skip them. RULE is "make/model" with wildcards
+             ("Google/*", "*/Pixel 7"), a make alone, or "none" for photos
+             without camera information. Both can be given several times.
+             Run MediaMetadata.py to list the cameras of the staged photos.
+  --max-distance N
+             For similar, the number of bits two photo hashes may differ by
+             (default 6)
+  --review FILE
+             For similar, the review file to write (default SimilarPhotos.txt).
+             For import and pipeline, do not import the photos marked "drop"
+             in it.
+  -q, --quiet
+             Only show errors and summaries, not one line per file
+  --profile FILE
+             Write the time spent in each stage, counters and histograms to
+             FILE (JSON), and the stage stacks to FILE with the extension
+             .folded (for flamegraph.pl or speedscope)
+  --all-devices
+             For copy, copy from every connected phone at the same time,
+             each one to a subfolder of the staging folder named after its
+             serial number. A photo found on several phones is copied once.
+  --since-last
+             For copy, import, pipeline and direct, leave out the photos
+             taken before the latest completed folder of the destination
+             (named yyyy-mm-dd_), so only the photos since the last import
+             are looked at
+  --dry-run  For sync, only print the files that would be copied
+  --dedup    For import, pipeline and sync, compare file contents and skip
+             files that already exist in the destination under another name
   """
     print(help_text)
-    
-def main():
-    stage_dir = default_stage_dir
-    dest_dir = default_destination_dir
-    
-    # Initialize variables to track user choice
-    action = None
-    is_test = False
 
-    # Process arguments
-    args = sys.argv[1:]
-    
-    if not args:
+class CommandLine:
+    """
+    Options of the command line, with their defaults. ParseCommandLine()
+    fills them in, main() adds the catalog and the since date the action
+    needs.
+    """
+    def __init__(self):
+        self.action = None
+        self.stage_dir = default_stage_dir
+        self.dest_dir = default_destination_dir
+        self.is_test = False
+        self.jobs = None
+        self.copy_jobs = 4
+        self.use_catalog = True
+        self.full_rescan = False
+        self.dedup = False
+        self.recursive = False
+        self.dry_run = False
+        self.resume = False
+        self.since_last = False
+        self.all_devices = False
+        self.verify = False
+        self.fsync_batch = 0
+        self.include_cameras = []
+        self.exclude_cameras = []
+        self.max_distance = None
+        self.profile_file = None
+        self.review_file = None
+        self.mode = "copy"
+        self.transfer_policy = default_transfer_policy
+        self.catalog = None
+        self.since = None
+
+# Parse a_args into a CommandLine.
+# Returns None, after showing the help or the error, when there is no action to run.
+def ParseCommandLine(a_args):
+    options = CommandLine()
+
+    if not a_args:
         DisplayHelp()
-        return    
+        return None
 
-    for arg in args:
-        if arg in ("-h", "/h"):
+    args = a_args
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        i += 1
+        if arg in ("-h", "/h", "--help"):
             DisplayHelp()
-            return
+            return None
         elif arg in ("-t", "/t"):
-            is_test = True
-            dest_dir = default_test_dir
-        elif arg.lower() == "copy":
-            action = "copy"
-        elif arg.lower() == "import":
-            action = "import"
-        elif arg.lower() == "sync":
-            action = "sync"
+            options.is_test = True
+            options.dest_dir = default_test_dir
+        elif arg in ("-j", "--jobs"):
+            if i >= len(args) or not args[i].isdigit() or int(args[i]) < 1:
+                print(f"Error: {arg} requires a positive number of jobs.")
+                return None
+            options.jobs = int(args[i])
+            i += 1
+        elif arg == "--copy-jobs":
+            if i >= len(args) or not args[i].isdigit() or int(args[i]) < 1:
+                print(f"Error: {arg} requires a positive number of jobs.")
+                return None
+            options.copy_jobs = int(args[i])
+            i += 1
+        elif arg == "--no-catalog":
+            options.use_catalog = False
+        elif arg == "--rescan":
+            options.full_rescan = True
+        elif arg == "--dedup":
+            options.dedup = True
+        elif arg == "--mode":
+            from FileTransfer import transfer_modes
+            if i >= len(args) or args[i] not in transfer_modes:
+                print(f"Error: {arg} requires one of: {', '.join(transfer_modes)}.")
+                return None
+            options.mode = args[i]
+            i += 1
+        elif arg == "--order":
+            if i >= len(args) or args[i] not in transfer_policies:
+                print(f"Error: {arg} requires one of: {', '.join(transfer_policies)}.")
+                return None
+            options.transfer_policy = args[i]
+            i += 1
+        elif arg in ("--include-camera", "--exclude-camera"):
+            if i >= len(args):
+                print(f"Error: {arg} requires a camera rule.")
+                return None
+            (options.include_cameras if arg == "--include-camera" else options.exclude_cameras).append(args[i])
+            i += 1
+        elif arg == "--max-distance":
+            if i >= len(args) or not args[i].isdigit() or not 0 <= int(args[i]) < 32:
+                print(f"Error: {arg} requires a number of bits below 32.")
+                return None
+            options.max_distance = int(args[i])
+            i += 1
+        elif arg == "--review":
+            if i >= len(args):
+                print(f"Error: {arg} requires a file name.")
+                return None
+            options.review_file = args[i]
+            i += 1
+        elif arg in ("-q", "--quiet"):
+            log.quiet = True
+        elif arg == "--profile":
+            if i >= len(args):
+                print(f"Error: {arg} requires a file name.")
+                return None
+            options.profile_file = args[i]
+            i += 1
+        elif arg == "--resume":
+            options.resume = True
+        elif arg == "--since-last":
+            options.since_last = True
+        elif arg == "--all-devices":
+            options.all_devices = True
+        elif arg == "--verify":
+            options.verify = True
+        elif arg == "--fsync":
+            if i >= len(args) or not args[i].isdigit() or int(args[i]) < 1:
+                print(f"Error: {arg} requires a positive number of files.")
+                return None
+            options.fsync_batch = int(args[i])
+            i += 1
+        elif arg == "--dry-run":
+            options.dry_run = True
+        elif arg in ("-r", "--recursive"):
+            options.recursive = True
+        elif arg.lower() in actions:
+            options.action = arg.lower()
         else:
             print(f"Unrecognized argument: {arg}")
-            return
-        
-    if not action:
-        print("Error: You must specify an action ('copy' or 'import').")
+            return None
+
+    if not options.action:
+        print(f"Error: You must specify an action ({', '.join(actions)}).")
+        return None
+
+    if options.verify and options.mode != "copy":
+        print(f"Error: --verify copies the files, it cannot be used with --mode {options.mode}.")
+        return None
+
+    # The phone files go straight to their folder, none of the staged file checks apply
+    if options.action == "direct":
+        unsupported = [option for option, used in (("--mode", options.mode != "copy"), ("--verify", options.verify),
+                                                   ("--fsync", options.fsync_batch), ("--dedup", options.dedup),
+                                                   ("--include-camera", options.include_cameras),
+                                                   ("--exclude-camera", options.exclude_cameras),
+                                                   ("--review", options.review_file)) if used]
+        if unsupported:
+            print(f"Error: direct does not support {', '.join(unsupported)}, use pipeline instead.")
+            return None
+    return options
+
+def main():
+    options = ParseCommandLine(sys.argv[1:])
+    if options is None:
         return
-    
-    if is_test:
+    action = actions[options.action]
+    dest_dir = options.dest_dir
+
+    missing = MissingPackages(action)
+    if missing:
+        print(f"Error: {options.action} requires {', '.join(missing)} (pip install {' '.join(missing)}).")
+        return
+
+    if options.is_test:
         print(">>> Testing mode active")
-    elif action == "import":
+    elif action.confirm:
         input(f"Importing to {dest_dir}. Press ENTER to continue, ^C to abort.")
 
-    print(f"     Stage: {stage_dir}")
+    print(f"     Stage: {options.stage_dir}")
     print(f"      Dest: {dest_dir}")
 
-    # Execute based on choice
-    if action == "copy":
-        print(f"Copying from phone to: {stage_dir}")
-        CopyPhotosFromPhone(stage_dir)
-    elif action == "import":
-        print(f"Importing from {stage_dir} to: {dest_dir}")
-        lf = DateOfLatestFolder(dest_dir, must_have_underscore=True)
-        print(lf)
-        #ImportPhonePhotos(stage_dir, dest_dir)
-    elif action == "sync":
-        print(f"Syncing {stage_dir} into {dest_dir}")
-        sync_directories(stage_dir, dest_dir)
+    # Open the destination catalog
+    if options.use_catalog and action.uses_catalog:
+        from DestinationCatalog import DestinationCatalog
+        options.catalog = DestinationCatalog(dest_dir)
+        with metrics.stage("catalog_refresh"):
+            options.catalog.refresh(a_full=options.full_rescan)
+        print(f"   Catalog: {len(options.catalog.folderNames())} folders, "
+              f"{options.catalog.numRescannedFolders()} rescanned")
+
+    # Photos taken before the latest completed folder were already imported
+    if action.uses_since:
+        lf = DateOfLatestFolder(dest_dir, must_have_underscore=True, a_catalog=options.catalog)
+        print(f"Latest folder: {lf}")
+        if options.since_last:
+            if lf:
+                options.since = lf
+                print(f"     Since: {lf[:4]}-{lf[4:6]}-{lf[6:]}")
+            else:
+                print("No completed folder in the destination, --since-last ignored.")
+
+    action.run(options)
+
+    if options.catalog:
+        options.catalog.close()
+    log.flush()
+
+    if options.profile_file:
+        folded_file = metrics.writeReport(options.profile_file,
+                                          {"action": options.action, "jobs": options.jobs, "mode": options.mode})
+        print("Stages:")
+        for line in metrics.stageSummary():
+            print(line)
+        print(f"Profile written to {options.profile_file} and {folded_file}")
 
 
 if __name__ == "__main__":
+    # The EXIF reader uses worker processes, which need this in the frozen executable
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+        multiprocessing.freeze_support()
     main()
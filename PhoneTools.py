@@ -1,34 +1,270 @@
 import win32com.client
 import time
 import os
+import re
+import json
+import concurrent.futures
+from collections import namedtuple
 from typing import Iterable, Callable
 
+# Importer parameters
+from defaults import *
+from Metrics import metrics, log
+from FileCatalog import FileCatalog
+from PhotoClassifier import FileClass, ParseFileName, extension_classes
+
+# One file of a device listing. modified is a POSIX timestamp, 0 if unknown.
+FileEntry = namedtuple("FileEntry", ["name", "size", "modified"])
+
+class DeviceSnapshot:
+    """
+    Immutable listing of the photo folder of a device: name, size and
+    modification time of every file.
+
+    Snapshots are saved per device so the next enumeration only needs to ask
+    the phone for the size of new or modified files.
+    """
+    def __init__(self, a_entries):
+        self.entries = tuple(a_entries)
+        self.__by_name = {entry.name: entry for entry in self.entries}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, a_name):
+        return self.__by_name.get(a_name)
+
+    def names(self):
+        return [entry.name for entry in self.entries]
+
+    # Compare with an older snapshot.
+    # Returns (added, changed, removed) lists of file names.
+    def diff(self, a_previous):
+        added = []
+        changed = []
+        for entry in self.entries:
+            old = a_previous.get(entry.name)
+            if old is None:
+                added.append(entry.name)
+            elif old != entry:
+                changed.append(entry.name)
+        removed = [entry.name for entry in a_previous.entries if entry.name not in self.__by_name]
+        return (added, changed, removed)
+
+    def save(self, a_path):
+        os.makedirs(os.path.dirname(os.path.abspath(a_path)), exist_ok=True)
+        temp_path = a_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump([list(entry) for entry in self.entries], f)
+        os.replace(temp_path, a_path)
+
+    # Returns the saved snapshot, or an empty snapshot if there is none
+    @staticmethod
+    def load(a_path):
+        try:
+            with open(a_path, encoding="utf-8") as f:
+                return DeviceSnapshot(FileEntry(*entry) for entry in json.load(f))
+        except (OSError, ValueError, TypeError):
+            return DeviceSnapshot([])
+
+# Stable identifier of a device: the serial number found in its shell path
+# (...\\?\usb#vid_18d1&pid_4ee1#<serial>#{...}), or its name when the path
+# has no serial number.
+def DeviceSerial(a_device_item):
+    m = re.search(r"usb#vid_[0-9a-f]+&pid_[0-9a-f]+#([^#]+)#", a_device_item.Path, re.IGNORECASE)
+    serial = m.group(1) if m else a_device_item.Name
+    return re.sub(r"[^\w\-]", "_", serial)
+
+# Items of "This PC" that are connected phones
+def DeviceItems(a_shell):
+    # "This PC" (represented by the Shell Constant 17) is the root where
+    # MTP devices (phones) appear
+    this_pc = a_shell.Namespace(17)
+    for item in this_pc.Items():
+        # Android phones usually appear with their model name
+        # We check if it's a folder-like object without a drive letter
+        if not os.path.exists(item.Path) and item.IsFolder:
+            yield item
+
+# Every connected phone, as a list of (serial, name). The serial is the
+# stable identifier to pass to AndroidPhone().
+def ListDevices():
+    shell = win32com.client.Dispatch("Shell.Application")
+    return [(DeviceSerial(item), item.Name) for item in DeviceItems(shell)]
+
+def SnapshotPath(a_serial):
+    return os.path.join(default_cache_dir, f"device_{a_serial}.json")
+
+# Shell paths of the scanned folders of a device, so they are reopened
+# directly instead of walked down name by name
+def FolderCachePath(a_serial):
+    return os.path.join(default_cache_dir, f"device_{a_serial}_folders.json")
+
+class MediaFilter:
+    """
+    Which files and subfolders of the phone folders are scanned.
+
+    Files are kept by extension, case-insensitive. Hidden files and folders
+    (.thumbnails, .trashed-...) are always left out, and so are the folders
+    named in pruned_folders, whatever their case.
+    """
+    def __init__(self, a_extensions=default_media_extensions, a_pruned_folders=default_pruned_folders):
+        self.extensions = frozenset(extension.lower() for extension in a_extensions)
+        self.pruned_folders = frozenset(name.lower() for name in a_pruned_folders)
+
+    def acceptsFile(self, a_name):
+        return not a_name.startswith(".") and os.path.splitext(a_name)[1].lower() in self.extensions
+
+    def acceptsFolder(self, a_name):
+        return not a_name.startswith(".") and a_name.lower() not in self.pruned_folders
+
+#######################################
+#
+# List a folder of the phone and its subfolders, in a thread of its own.
+#
+# The Shell objects belong to the thread that created them, so the folder is
+# opened again from its shell path with a Shell of this thread, and the
+# result is plain data: (FileEntry, shell path of its folder) of the files
+# a_filter accepts.
+#
+# As in AndroidPhone.takeSnapshot(), the size is only asked for the files
+# not in a_previous with the same modification time, and files taken before
+# a_since are left out. Their entry in a_previous is returned in a second
+# list, so they stay in the saved snapshot.
+#
+def ScanPhoneFolder(a_shell_path, a_filter, a_previous, a_since=None):
+    entries = []
+    older = []
+    shell = win32com.client.Dispatch("Shell.Application")
+    root = shell.Namespace(a_shell_path)
+    if root is None:
+        return (entries, older)
+    folders = [(root, a_shell_path)]
+    while folders:
+        folder, folder_path = folders.pop()
+        for item in folder.Items():
+            name = item.Name
+            if item.IsFolder:
+                if a_filter.acceptsFolder(name):
+                    subfolder = item.GetFolder
+                    folders.append((subfolder, subfolder.Self.Path))
+                continue
+            if not a_filter.acceptsFile(name):
+                continue
+            modified = ItemModifiedTime(item)
+            old = a_previous.get(name)
+            if a_since and IsEntryBefore(name, modified, a_since):
+                if old:
+                    older.append(old)
+                continue
+            if old and modified and old.modified == modified:
+                size = old.size
+            else:
+                size = ItemSize(item)
+            entries.append((FileEntry(name, size, modified), folder_path))
+    return (entries, older)
+
+# COM must be initialized in every thread using the Shell, and uninitialized
+# once the thread is done with its Shell objects
+def InitializeComThread():
+    import pythoncom
+    pythoncom.CoInitialize()
+
+def UninitializeComThread():
+    import pythoncom
+    pythoncom.CoUninitialize()
+
+# ScanPhoneFolder() in a thread of the scan pool
+def ScanPhoneFolderThread(a_shell_path, a_media_filter, a_previous, a_since):
+    InitializeComThread()
+    try:
+        return ScanPhoneFolder(a_shell_path, a_media_filter, a_previous, a_since)
+    finally:
+        UninitializeComThread()
+
+# Modification time of a FolderItem as a POSIX timestamp, 0 if unknown
+def ItemModifiedTime(a_item):
+    try:
+        return a_item.ModifyDate.timestamp()
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+# Date a photo was taken (System.Photo.DateTaken) as a POSIX timestamp, 0 if
+# unknown. Asking for it is one more round-trip to the phone.
+def ItemDateTaken(a_item):
+    metrics.count("mtp_date_queries")
+    try:
+        return a_item.ExtendedProperty("System.Photo.DateTaken").timestamp()
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+# Tell whether a file of the phone was taken before a_since (YYYYMMDD).
+# The date comes from the file name, or from the modification time when the
+# name has no date. A file with no known date is never before a_since.
+def IsEntryBefore(a_name, a_modified, a_since):
+    parsed = ParseFileName(a_name)
+    if parsed:
+        return parsed.date < a_since
+    if a_modified:
+        return time.strftime("%Y%m%d", time.localtime(a_modified)) < a_since
+    return False
+
+# Exact size of a FolderItem.
+# This is more exact than current_folder.GetDetailsOf(file, 2)
+def ItemSize(a_item):
+    metrics.count("mtp_size_queries")
+    try:
+        return int(a_item.ExtendedProperty("System.Size"))
+    except (ValueError, TypeError):
+        return 0
+
 class AndroidPhone:
     """
     Properties:
     phone
-    __photoFolder
+    serial
+    since
+    roots
+    media_filter
+    __folderPaths
     __connected
     __files
+    __snapshot
     """
+    # Number of phone folders listed at the same time
+    max_scan_threads = 4
+
     ###########################
     # Constructor
-    def __init__(self):
+    # If a_since is a date (YYYYMMDD), the files taken before it are left out
+    # of the listing and never transferred.
+    # a_roots are the folders scanned, relative to the storage of the phone,
+    # and a_media_filter the MediaFilter of the files and subfolders scanned.
+    # a_serial selects the phone when several are connected (see ListDevices),
+    # by default the first one found is used.
+    def __init__(self, a_since=None, a_roots=None, a_media_filter=None, a_serial=None):
+        self.since = a_since
+        self.roots = a_roots or default_phone_roots
+        self.media_filter = a_media_filter or MediaFilter()
         self.__connected = False
+        self.__items = {}
+        self.__localShell = None
+        self.__localFolders = {}
+        self.__folderPaths = {}   # root -> shell path
+        self.__openFolders = {}   # shell path -> Folder
+        self.__fileFolders = {}   # file name -> shell path of its folder
+        self.__snapshot = DeviceSnapshot([])
 
         # 1. Initialize the Windows Shell Application
         shell = win32com.client.Dispatch("Shell.Application")
+        self.__shell = shell
 
-        # 2. Access "This PC" (represented by the Shell Constant 17)
-        # This is the root where MTP devices (phones) appear
-        this_pc = shell.Namespace(17)
+        # 2. The phones are the items of "This PC" without a drive letter
 
         self.phone = None
         # 3. Look for your phone in the list of "This PC" items
-        for item in this_pc.Items():
-            # Android phones usually appear with their model name
-            # We check if it's a folder-like object without a drive letter
-            if not os.path.exists(item.Path) and item.IsFolder:
+        for item in DeviceItems(shell):
+            if a_serial is None or DeviceSerial(item) == a_serial:
                 self.phone = item
                 break
 
@@ -36,24 +272,27 @@ class AndroidPhone:
             print("Android device not found. Ensure it's in 'File Transfer' mode.")
             return
         
-        self.__photoFolder = self.goToPhotoFolder()
+        self.serial = DeviceSerial(self.phone)
+        self.__folderPaths = self.resolveFolders()
+        if not self.__folderPaths:
+            print("Could not find any photo folder on the phone.")
+            return
         self.__connected = True
-        print (f"Phone {self.phone.Name} initialized. At {self.__photoFolder.Title}.")
+        print (f"Phone {self.phone.Name} initialized. At {', '.join(self.__folderPaths)}.")
+        self.__snapshot = self.takeSnapshot()
         self.__files = self.listFileNames()
         print(f"Found {len(self.__files)} files.")
 
     ###########################
-    # Go to photo folder
-    def goToPhotoFolder(self):
-
-        # Specify location of camera photos
-        target_path = ["Internal shared storage", "DCIM", "Camera"]
+    # Go to a folder of the phone storage, a_path being "DCIM/Camera".
+    # Returns the Folder, or None if it does not exist.
+    def goToFolder(self, a_path):
 
         # Start at the phone root
         current_folder = self.phone.GetFolder
 
         # Navigate through the subfolders
-        for folder_name in target_path:
+        for folder_name in [default_phone_storage] + a_path.split("/"):
             found = False
             for item in current_folder.Items():
                 if item.Name.lower() == folder_name.lower():
@@ -61,27 +300,134 @@ class AndroidPhone:
                     found = True
                     break
             if not found:
-                print(f"Could not find folder: {folder_name}")
-                return
+                return None
         return current_folder
 
+    ###########################
+    # Find the shell path of every root folder.
+    # Paths saved by the previous run are reopened with Namespace(), only
+    # the roots not found that way are walked down name by name.
+    # Returns a dictionary root -> shell path of the roots on the phone.
+    def resolveFolders(self):
+        try:
+            with open(FolderCachePath(self.serial), encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+
+        paths = {}
+        for root in self.roots:
+            folder = None
+            if cached.get(root):
+                folder = self.__shell.Namespace(cached[root])
+                if folder is not None:
+                    paths[root] = cached[root]
+            if folder is None:
+                metrics.count("mtp_folder_walks")
+                folder = self.goToFolder(root)
+                if folder is None:
+                    continue
+                paths[root] = folder.Self.Path
+            self.__openFolders[paths[root]] = folder
+
+        if paths != cached:
+            os.makedirs(default_cache_dir, exist_ok=True)
+            temp_path = FolderCachePath(self.serial) + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(paths, f)
+            os.replace(temp_path, FolderCachePath(self.serial))
+        return paths
+
+    # Folder of a shell path, opened once per path by this thread
+    def openFolder(self, a_shell_path):
+        folder = self.__openFolders.get(a_shell_path)
+        if folder is None:
+            folder = self.__shell.Namespace(a_shell_path)
+            self.__openFolders[a_shell_path] = folder
+        return folder
+
+
+    ###########################
+    # Scan the root folders once and build a DeviceSnapshot.
+    #
+    # Names and modification times come with the enumeration. The exact size
+    # needs one more round-trip per file, so it is only asked for files that
+    # are new or modified since the snapshot saved by the previous run.
+    #
+    # The roots are scanned in parallel, max_scan_threads at a time. A file
+    # name found in several folders is only taken from the first one, in
+    # the order of the roots, since the files are copied to a single folder.
+    # The files left out are logged.
+    #
+    # Files taken before self.since are dropped before their size is asked
+    # for. The saved snapshot keeps their previous entry so the next full
+    # listing does not ask for their size either.
+    def takeSnapshot(self):
+        previous = DeviceSnapshot.load(SnapshotPath(self.serial))
+
+        shell_paths = list(self.__folderPaths.values())
+        if len(shell_paths) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_scan_threads, len(shell_paths))) as pool:
+                results = list(pool.map(lambda path: ScanPhoneFolderThread(path, self.media_filter, previous, self.since),
+                                        shell_paths))
+        else:
+            results = [ScanPhoneFolder(path, self.media_filter, previous, self.since) for path in shell_paths]
+
+        entries = []
+        older = []
+        self.__items = {}
+        self.__fileFolders = {}
+        num_duplicate_names = 0
+        for found, found_older in results:
+            for entry, folder_path in found:
+                if entry.name in self.__fileFolders:
+                    num_duplicate_names += 1
+                    log.write(f"{self.displayPath(folder_path, entry.name)} left out: "
+                              f"{self.displayPath(self.__fileFolders[entry.name], entry.name)} has the same name.")
+                    continue
+                entries.append(entry)
+                self.__fileFolders[entry.name] = folder_path
+            older += found_older
+
+        snapshot = DeviceSnapshot(entries)
+        saved = DeviceSnapshot(entries + older) if older else snapshot
+        added, changed, removed = saved.diff(previous)
+        log.flush()
+        print(f"Since last listing: {len(added)} new, {len(changed)} changed, {len(removed)} removed.")
+        if num_duplicate_names:
+            print(f"{num_duplicate_names} files left out: their name is already used in another folder, see above.")
+        if self.since:
+            print(f"Listed {len(entries)} files from {self.since[:4]}-{self.since[4:6]}-{self.since[6:]} on.")
+        saved.save(SnapshotPath(self.serial))
+        return snapshot
+
+
+    # Path of a file for the messages: its root followed by the subfolders
+    # between the root and a_folder_path, the shell path of its folder
+    def displayPath(self, a_folder_path, a_name):
+        root, root_path = max(((root, path) for root, path in self.__folderPaths.items() if a_folder_path.startswith(path)),
+                              key=lambda root_and_path: len(root_and_path[1]), default=("", a_folder_path))
+        subfolder = a_folder_path[len(root_path):].strip("\\").replace("\\", "/")
+        return "/".join(part for part in (root, subfolder, a_name) if part)
+
+
+    ###########################
+    # Get the snapshot of the photo folder
+    def getSnapshot(self):
+        return self.__snapshot
+
 
     ###########################
     # List files
-    def listFileNames(self):
-        files = []
+    # The names come from the snapshot taken when connecting, unless
+    # a_refresh is True.
+    def listFileNames(self, a_refresh=False):
         if not self.__connected:
             print("Not connected.")
-            return files
-        
-        extensions = ('.jpg', '.jpeg', '.png', '.mpeg', '.mov')
-        for file in self.__photoFolder.Items():
-            if file.Name.lower().startswith(".trashed"):
-                continue
-            if not file.Name.lower().endswith(extensions):
-                continue    
-            files.append(file.Name)
-        return files
+            return []
+        if a_refresh:
+            self.__snapshot = self.takeSnapshot()
+        return self.__snapshot.names()
 
 
     ###########################
@@ -90,154 +436,385 @@ class AndroidPhone:
         if not self.__connected:
             print("Not connected.")
             return 0
-        
-        # Find the file in the folder
-        file = self.__photoFolder.ParseName(a_file_name)
 
-        # This is more exact than current_folder.GetDetailsOf(file, 2)
-        exact_size = file.ExtendedProperty("System.Size")
-        file_size = 0
-        try:
-            file_size = int(exact_size)
-        except ValueError:
-            file_size = 0
+        entry = self.__snapshot.get(a_file_name)
+        if entry:
+            return entry.size
+
+        # Find the file in the folders
+        file = self.getFileItem(a_file_name)
+        if not file:
+            return 0
+        return ItemSize(file)
+
+
+    ###########################
+    # Get the date of a file as YYYY-MM-DD, "" if unknown.
+    # The date comes from the file name, else from the date the photo was
+    # taken, else from the modification time of the file.
+    def getFileDate(self, a_file_name):
+        parsed = ParseFileName(a_file_name)
+        if parsed:
+            return parsed.date[:4] + "-" + parsed.date[4:6] + "-" + parsed.date[6:]
+        file_item = self.getFileItem(a_file_name)
+        timestamp = ItemDateTaken(file_item) if file_item else 0
+        if not timestamp:
+            entry = self.__snapshot.get(a_file_name)
+            timestamp = entry.modified if entry else 0
+        if not timestamp:
+            return ""
+        return time.strftime("%Y-%m-%d", time.localtime(timestamp))
 
-        return file_size
+
+    ###########################
+    # Get the FolderItem of a file on the phone.
+    # The listing runs in other threads and only keeps the folder of every
+    # file: the item is looked up by name in its folder, once. Files not in
+    # the listing are looked up in every root folder.
+    def getFileItem(self, a_file_name):
+        file_item = self.__items.get(a_file_name)
+        if file_item is not None:
+            return file_item
+        folder_path = self.__fileFolders.get(a_file_name)
+        folder_paths = [folder_path] if folder_path else list(self.__folderPaths.values())
+        for folder_path in folder_paths:
+            folder = self.openFolder(folder_path)
+            file_item = folder.ParseName(a_file_name) if folder is not None else None
+            if file_item:
+                self.__items[a_file_name] = file_item
+                return file_item
+        return None
+
+
+    ###########################
+    # Get the Shell folder object of a local destination.
+    # The namespace is created once per destination and reused for every copy.
+    def getLocalFolder(self, a_dest_path):
+        dest_path = os.path.abspath(a_dest_path)
+        dest_folder = self.__localFolders.get(dest_path)
+        if dest_folder is None:
+            # NOTE: Reusing the same shell as the phone results in an error. Need a new shell.
+            if self.__localShell is None:
+                self.__localShell = win32com.client.Dispatch("Shell.Application")
+            dest_folder = self.__localShell.NameSpace(dest_path)
+            self.__localFolders[dest_path] = dest_folder
+        return dest_folder
 
 
     ###########################
     # Copy file to local folder
     def copyFileToLocal(self, a_file_name, a_dest_path):
         """
-        Docstring for copyFileToLocal
-        
+        Copies one file from the phone to a local folder.
+
         :param self: Description
         :param a_file_name: Name of file to copy.
         :param a_dest_path: Path on local file system to copy the file to.
         Returns True on success, False on error.
         """
+        for _, success in self.copyFilesToLocal([a_file_name], a_dest_path, 1):
+            return success
+        return False
+
+
+    ###########################
+    # Copy files to local folder
+    def copyFilesToLocal(self, a_file_names, a_dest_path, a_max_in_flight=4, a_policy=default_transfer_policy):
+        """
+        Copies files from the phone to a local folder, starting with
+        a_max_in_flight transfers running at the same time.
+
+        :param a_file_names: Names of the files to copy.
+        :param a_dest_path: Path on local file system to copy the files to.
+        :param a_max_in_flight: Initial number of concurrent transfers, see TransferEngine.
+        :param a_policy: Order of the transfers, see OrderTransfers().
+        Yields a tuple (file name, success) as each transfer completes.
+        """
         if not self.__connected:
             print("Not connected.")
-            return False
-        
+            return
+
         # To copy files from an Android device (MTP) to a local folder using win32com, 
         # you must use the Folder.CopyHere() method on the destination folder. 
 
         # Since Android devices are not assigned drive letters, standard Python libraries 
         # like shutil won't work; you must treat the destination as a Shell namespace.
 
-        # 1. Ensure the destination directory exists
+        # Ensure the destination directory exists
         if not os.path.exists(a_dest_path):
             print(f"Folder '{a_dest_path}' does not exist on local drive.")
-            return False
-        
-        # 2. Get the FolderItem object for the file on the phone
-        file_item = self.__photoFolder.ParseName(a_file_name)
+            for file_name in a_file_names:
+                yield (file_name, False)
+            return
+
+        engine = TransferEngine(self, self.getLocalFolder(a_dest_path), a_dest_path, a_max_in_flight)
+        yield from engine.run(OrderTransfers(self, a_file_names, a_policy))
+
+
+#######################################
+#
+# Order in which the files are transferred from the phone.
+#
+# photos-first:   photos, then videos, the smallest first in both, so the
+#                 photos are usable early and multi-GB videos come last
+# smallest-first: the smallest files first, whatever their type
+# newest-first:   the most recently modified files first
+# listing:        the order of the phone listing
+#
+# Sizes and modification times come from the snapshot of a_phone, nothing
+# is asked to the phone. The sort is stable: equal files keep the order of
+# the listing.
+#
+def IsVideoFile(a_file_name):
+    return extension_classes.get(os.path.splitext(a_file_name)[1][1:].lower()) == FileClass.VIDEO
+
+def OrderTransfers(a_phone, a_file_names, a_policy=default_transfer_policy):
+    if a_policy == "photos-first":
+        return sorted(a_file_names, key=lambda name: (IsVideoFile(name), a_phone.getFileSize(name)))
+    if a_policy == "smallest-first":
+        return sorted(a_file_names, key=a_phone.getFileSize)
+    if a_policy == "newest-first":
+        snapshot = a_phone.getSnapshot()
+        def modified(a_name):
+            entry = snapshot.get(a_name)
+            return entry.modified if entry else 0
+        return sorted(a_file_names, key=modified, reverse=True)
+    return list(a_file_names)
+
+
+class TransferEngine:
+    """
+    Copies files from the phone to a local folder with Folder.CopyHere().
+
+    CopyHere() is asynchronous and there is no other way to know when a copy
+    completed than to look at the destination file. The file appears as soon
+    as the copy starts, so a transfer is complete only when the local file
+    reaches the size reported by the phone (System.Size).
+
+    The files are started in the order given, see OrderTransfers(). Free
+    slots are refilled in batches and all the running transfers are checked
+    in a single polling loop.
+
+    The number of transfers in flight starts at a_max_in_flight and follows
+    the throughput: every adapt_interval, the bytes written to the local files
+    are compared with the previous interval. While adding a transfer made the
+    throughput grow, one more is added; when the last change made it drop,
+    the change is undone and the search goes the other way. The number stays
+    between 1 and max(a_max_in_flight, max_concurrency).
+
+    A transfer fails when it takes longer than timeout plus the time of its
+    size at min_transfer_rate, so a large video gets the time it needs and a
+    stuck photo does not hold its slot for long.
+
+    When the phone reports no size, the size is asked again to the file item.
+    If it is still unknown, the file is complete once its size did not change
+    for settle_time, a stalled write does not pass for a complete file.
+
+    The shell may still be writing a failed transfer: its file is removed once
+    the shell released it. The files still held when the engine is done stay
+    in the destination, which the callers empty at the start of every run.
+    """
+    # CopyHere options:
+    #    4 = No progress bar
+    #    8 = Automatically rename the file if the target name exists (FOF_RENAMEONCOLLISION)
+    #   16 = Respond "Yes to All" for dialogs 
+    #   64 = Preserve undo information (FOF_ALLOWUNDO)
+    #  128 = Perform operation only if a wildcard (*.*) is used (FOF_FILESONLY)
+    #  256 = Show progress dialog but hide file names (FOF_SIMPLEPROGRESS)
+    #  512 = Do not confirm new directory creation (FOF_NOCONFIRMMKDIR)
+    # 1024 = No UI on file copy errors
+    # 4096 = Copy only local files in a folder, disabling recursion (FOF_NORECURSION)
+    # Constants for readability
+    FOF_SILENT = 4
+    FOF_NOCONFIRMATION = 16
+    FOF_NOERRORUI = 1024
+
+    poll_interval = 0.1 # seconds
+    timeout = 30 # seconds, plus the time of the file size at min_transfer_rate
+    min_transfer_rate = 1024 * 1024 # bytes/s
+    settle_time = 3.0 # seconds without growing for a file of unknown size
+
+    # Adaptive concurrency
+    adapt_interval = 2.0 # seconds
+    adapt_tolerance = 0.05 # throughput changes below 5% are noise
+    max_concurrency = 16
+
+    ###########################
+    # Constructor
+    def __init__(self, a_phone, a_dest_folder, a_dest_path, a_max_in_flight=4):
+        self.phone = a_phone
+        self.dest_folder = a_dest_folder
+        self.dest_path = a_dest_path
+        self.max_in_flight = max(1, a_max_in_flight)
+        self.concurrency_limit = max(self.max_in_flight, self.max_concurrency)
+
+    ###########################
+    # Start the copy of one file. Returns the expected size, or None on error.
+    def __submit(self, a_file_name):
+        file_item = self.phone.getFileItem(a_file_name)
         if not file_item:
-            print(f"File '{a_file_name}' not found on phone.")
+            log.write(f"File '{a_file_name}' not found on phone.")
+            return None
+        expected_size = self.phone.getFileSize(a_file_name)
+        if expected_size <= 0:
+            # The listing may have missed it, the item is asked directly
+            expected_size = ItemSize(file_item)
+        with metrics.stage("mtp_submit"):
+            self.dest_folder.CopyHere(file_item, self.FOF_NOERRORUI + self.FOF_NOCONFIRMATION + self.FOF_SILENT)
+        return expected_size
+
+    # Time allowed to the transfer of a file of a_size bytes (0 if unknown)
+    def transferTimeout(self, a_size):
+        return self.timeout + max(0, a_size) / self.min_transfer_rate
+
+    ###########################
+    # Check a running transfer. Returns True when the local file is complete.
+    # a_size is the size of the local file, -1 if it does not exist yet, and
+    # a_stable the time since its size last changed. When the phone did not
+    # report a size, the file is complete once its size did not change for
+    # settle_time.
+    def __isComplete(self, a_size, a_stable, a_expected):
+        if a_size < 0:
             return False
-        
-        # 3. Create a Shell folder object for the local destination
-        # NOTE: Reusing the same shell as the phone results in an error. Need a new shell.
-        shell = win32com.client.Dispatch("Shell.Application")
-        dest_folder = shell.NameSpace(os.path.abspath(a_dest_path))
-
-        # 4. Use CopyHere to pull the file from the phone to the PC
-        # Options: 
-        #    4 = No progress bar
-        #    8 = Automatically rename the file if the target name exists (FOF_RENAMEONCOLLISION)
-        #   16 = Respond "Yes to All" for dialogs 
-        #   64 = Preserve undo information (FOF_ALLOWUNDO)
-        #  128 = Perform operation only if a wildcard (*.*) is used (FOF_FILESONLY)
-        #  256 = Show progress dialog but hide file names (FOF_SIMPLEPROGRESS)
-        #  512 = Do not confirm new directory creation (FOF_NOCONFIRMMKDIR)
-        # 1024 = No UI on file copy errors
-        # 4096 = Copy only local files in a folder, disabling recursion (FOF_NORECURSION)
-        # Constants for readability
-        FOF_SILENT = 4
-        FOF_NOCONFIRMATION = 16
-        FOF_NOERRORUI = 1024
-        dest_folder.CopyHere(file_item, FOF_NOERRORUI + FOF_NOCONFIRMATION + FOF_SILENT)
-
-        # 5. Poll for completion.
-        # CopyHere() is asynchronous and there is no other way to know
-        # when it completed.
-        local_file = os.path.join(a_dest_path, a_file_name)
-        timeout = 30 # seconds
-        start = time.time()
-        while time.time() - start < timeout:
-            if os.path.exists(local_file):
-                return True
-            time.sleep(0.1)
+        if a_expected > 0:
+            return a_size == a_expected
+        return a_size > 0 and a_stable >= self.settle_time
+
+    # Remove the files of the failed transfers the shell released.
+    # Returns the ones still held.
+    @staticmethod
+    def __removeAbandoned(a_files):
+        held = []
+        for local_file in a_files:
+            try:
+                os.remove(local_file)
+            except FileNotFoundError:
+                # Not created yet, the shell may still start the copy
+                held.append(local_file)
+            except OSError:
+                held.append(local_file)
+        return held
+
+    @staticmethod
+    def __localSize(a_local_file):
+        try:
+            return os.path.getsize(a_local_file)
+        except OSError:
+            return -1
 
-        print(f"Error copying file {a_file_name} to {a_dest_path}.")
-        return False
+    ###########################
+    # Adjust the number of transfers in flight to the throughput of the last
+    # interval. a_bytes is the number of bytes written since the last poll.
+    def __adapt(self, a_now, a_bytes):
+        self.__window_bytes += a_bytes
+        elapsed = a_now - self.__window_start
+        if elapsed < self.adapt_interval:
+            return
+        throughput = self.__window_bytes / elapsed
+        self.__window_bytes = 0
+        self.__window_start = a_now
+        metrics.observe("transfer_throughput", throughput)
+        previous = self.__throughput
+        self.__throughput = throughput
+        if previous is None:
+            step = self.__direction
+        elif throughput > previous * (1 + self.adapt_tolerance):
+            step = self.__direction
+        elif throughput < previous * (1 - self.adapt_tolerance):
+            self.__direction = -self.__direction
+            step = self.__direction
+        else:
+            return
+        concurrency = min(self.concurrency_limit, max(1, self.concurrency + step))
+        if concurrency == self.concurrency:
+            self.__direction = -self.__direction
+            return
+        log.detail(f"Transfers in flight: {self.concurrency} -> {concurrency} ({throughput / (1024*1024):.1f} MB/s)")
+        self.concurrency = concurrency
+        metrics.count("transfer_concurrency_changes")
 
+    ###########################
+    # Copy the files, in the given order.
+    # Yields (file name, success) as each transfer completes.
+    def run(self, a_file_names):
+        pending = list(reversed(a_file_names))
+        in_flight = {}
+        abandoned = []   # local files of the failed transfers, see __removeAbandoned()
+        self.concurrency = self.max_in_flight
+        self.__direction = 1
+        self.__throughput = None
+        self.__window_start = time.time()
+        self.__window_bytes = 0
+
+        while pending or in_flight:
+            # 1. Fill the free transfer slots
+            while pending and len(in_flight) < self.concurrency:
+                file_name = pending.pop()
+                expected_size = self.__submit(file_name)
+                if expected_size is None:
+                    yield (file_name, False)
+                    continue
+                start = time.time()
+                in_flight[file_name] = {"expected": expected_size, "start": start, "size": -1, "changed": start,
+                                        "deadline": start + self.transferTimeout(expected_size)}
+
+            if not in_flight:
+                continue
 
+            # 2. Poll all the running transfers at once
+            with metrics.stage("mtp_wait"):
+                time.sleep(self.poll_interval)
+            metrics.count("mtp_polls")
+            now = time.time()
+            progress = 0
+            for file_name, state in list(in_flight.items()):
+                local_file = os.path.join(self.dest_path, file_name)
+                size = self.__localSize(local_file)
+                previous = state["size"]
+                progress += max(0, size - max(0, previous))
+                state["size"] = size
+                if size != previous:
+                    state["changed"] = now
+                if self.__isComplete(size, now - state["changed"], state["expected"]):
+                    del in_flight[file_name]
+                    metrics.observe("transfer_time", now - state["start"])
+                    metrics.count("bytes_copied", max(0, state["expected"]))
+                    yield (file_name, True)
+                elif now > state["deadline"]:
+                    # Still growing or stalled, the file is partial
+                    del in_flight[file_name]
+                    log.write(f"Error copying file {file_name} to {self.dest_path}: "
+                              f"not complete after {now - state['start']:.0f}s.")
+                    abandoned.append(local_file)
+                    yield (file_name, False)
+
+            # 3. Do not leave a partial file that would later pass for a complete one
+            if abandoned:
+                abandoned = self.__removeAbandoned(abandoned)
+
+            # 4. Only adapt while there are files waiting for a slot
+            if pending:
+                self.__adapt(now, progress)
+            metrics.observe("transfers_in_flight", len(in_flight))
+
+        for local_file in self.__removeAbandoned(abandoned):
+            if os.path.exists(local_file):
+                log.write(f"Partial file {local_file} is still in use, the next run removes it.")
 
 
+# List the photo files of the phone into a FileCatalog
 def list_android_photos(functions: Iterable[Callable[[str, int], None]]):
     print("Listing photos")
-    # 1. Initialize the Windows Shell Application
-    shell = win32com.client.Dispatch("Shell.Application")
-
-    # 2. Access "This PC" (represented by the Shell Constant 17)
-    # This is the root where MTP devices (phones) appear
-    this_pc = shell.Namespace(17)
-
-    phone = None
-    # 3. Look for your phone in the list of "This PC" items
-    for item in this_pc.Items():
-        # Android phones usually appear with their model name
-        # We check if it's a folder-like object without a drive letter
-        if not os.path.exists(item.Path) and item.IsFolder:
-            phone = item
-            break
-
-    if not phone:
-        print("Android device not found. Ensure it's in 'File Transfer' mode.")
+    phone = AndroidPhone()
+    if not phone.phone:
         return
-    
-    # Image extensions to search for
-    target_path = ["Internal shared storage", "DCIM", "Camera"]
-    files = []
-
-    # Start at the phone root
-    current_folder = phone.GetFolder
-
-    # Navigate through the subfolders
-    for folder_name in target_path:
-        found = False
-        for item in current_folder.Items():
-            if item.Name.lower() == folder_name.lower():
-                current_folder = item.GetFolder
-                found = True
-                break
-        if not found:
-            print(f"Could not find folder: {folder_name}")
-            return
-
-    # 4. Run the input funciton on the photo files
-    print(f"\nListing photos in {phone.Name}\\{'\\'.join(target_path)}:")
-    extensions = ('.jpg', '.jpeg', '.png', '.mpeg', '.mov')
-    for file in current_folder.Items():
-        if file.Name.lower().startswith(".trashed"):
-            continue
-        if not file.Name.lower().endswith(extensions):
-            continue
-
-        # This is more exact than current_folder.GetDetailsOf(file, 2)
-        exact_size = file.ExtendedProperty("System.Size")
-        file_size = 0
-        try:
-            file_size = int(exact_size)
-        except ValueError:
-            file_size = 0
-        
-        files.append({"name": file.Name, "size": file_size})
 
+    # Run the input functions on the photo files
+    files = FileCatalog()
+    for entry in phone.getSnapshot().entries:
+        files.add("", entry.name, entry.size, entry.modified)
         for func in functions:
-            func(file.Name, file_size)
+            func(entry.name, entry.size)
     
     return files
 
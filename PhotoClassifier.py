@@ -1,5 +1,7 @@
-from typing import List, Tuple
+from typing import Iterable, Iterator, Tuple, Union
+from collections import namedtuple
 import re
+import itertools
 import os
 import enum
 
@@ -11,58 +13,181 @@ class FileClass(enum.Enum):
     UNKNOWN = 0
     PHOTO = 1
     VIDEO = 2
+    SCREENSHOT = 3
+
+# Result of ParseFileName()
+# date is YYYYMMDD, time is HHMMSS (or "" when the name has no time) and
+# variant is whatever follows the time, e.g. "~2.NIGHT" or "WA0012".
+ParsedName = namedtuple("ParsedName", ["file_class", "scheme", "date", "time", "variant"])
+
+# Known file naming schemes, as (scheme name, expression of the name without extension).
+# Each expression must define exactly three groups: date, time and variant,
+# the variant being (.*?) at the end of the expression.
+# Anything may follow the date and time: copies ("WA0012 (1)", "WA0012-01")
+# and renamed files keep the date of their name.
+naming_schemes = [
+    # PXL_20230520_123456789.jpg, PXL_20230520_123456789~2.NIGHT.jpg,
+    # PXL_20230520_123456789.LONG_EXPOSURE-02.ORIGINAL.jpg, PXL_20230520_123456789.TS.mp4
+    ("PXL",        r"PXL_(\d{8})_(\d+)(.*?)"),
+    # IMG_20230520_123456.jpg, VID_20230520_123456.mp4 (Android camera apps)
+    ("IMG",        r"IMG_(\d{8})_(\d{6})(.*?)"),
+    ("VID",        r"VID_(\d{8})_(\d{6})(.*?)"),
+    # IMG-20230520-WA0012.jpg, VID-20230520-WA0003.mp4 (WhatsApp media folders)
+    ("WhatsApp",   r"(?:IMG|VID)-(\d{8})-()(.*?)"),
+    # Screenshot_20230520-123456.png, Screenshot_20230520_123456_Chrome.jpg
+    ("Screenshot", r"Screenshot_(\d{8})[\-_](\d{6})(.*?)"),
+    # WhatsApp Image 2023-05-20 at 12.34.56.jpeg (WhatsApp desktop and web exports)
+    ("WhatsAppExport", r"WhatsApp (?:Image|Video) (\d{4}-\d{2}-\d{2}) at (\d{1,2}\.\d{2}\.\d{2})(.*?)"),
+]
+
+# Class of a file by extension
+extension_classes = {
+    "jpg": FileClass.PHOTO, "jpeg": FileClass.PHOTO, "png": FileClass.PHOTO,
+    "heic": FileClass.PHOTO, "webp": FileClass.PHOTO, "dng": FileClass.PHOTO, "gif": FileClass.PHOTO,
+    "mp4": FileClass.VIDEO, "mov": FileClass.VIDEO, "3gp": FileClass.VIDEO, "mkv": FileClass.VIDEO,
+    "mpeg": FileClass.VIDEO,
+}
+
+# All the schemes compiled into a single expression. Every scheme is wrapped
+# in an outer group followed by its extension, so a match's lastindex (the
+# last group to close) identifies the scheme: scheme k owns groups
+# 5k+1 (whole name), 5k+2 (date), 5k+3 (time), 5k+4 (variant), 5k+5 (extension).
+# The extension is optional, its group is None for a name without one.
+# Dates, times and extensions are ASCII.
+name_parser = re.compile("|".join(f"({expression}(?:\\.(\\w+))?)" for _, expression in naming_schemes), re.ASCII)
+scheme_by_group = {5*k + 1: name for k, (name, _) in enumerate(naming_schemes)}
+
+# First three characters of the names of all the schemes. A name that starts
+# with none of them is rejected without running the expression.
+name_prefixes = frozenset(["PXL", "IMG", "VID", "Scr", "Wha"])
+
+# The schemes for ClassifyPhotos(), which only needs the extension and whether
+# the name is a screenshot. It runs over many names, each followed by a new
+# line, one match per name (. never matches a new line). The groups of the
+# schemes are made non-capturing and their variant is left to the extension
+# group, which is empty for a name that follows no scheme. Names with no
+# "Screenshot_" in them are matched by the single group of classify_parser,
+# the others by screenshot_classify_parser where the screenshot scheme also
+# captures its first character ("S").
+def ClassifyExpression(a_screenshots: bool) -> str:
+    alternatives = []
+    for name, expression in naming_schemes:
+        expression = re.sub(r"(?<!\\)\((?!\?)", "(?:", expression[:-len("(.*?)")])
+        alternatives.append(f"(?=(.)){expression}" if a_screenshots and name == "Screenshot" else expression)
+    return f"(?:{'|'.join(alternatives)})(?:.*\\.(\\w+)\n|.*\n)|.*\n"
+
+classify_parser = re.compile(ClassifyExpression(False), re.ASCII)
+screenshot_classify_parser = re.compile(ClassifyExpression(True), re.ASCII)
+
+# Number of names classified by a single call of classify_parser
+classify_chunk = 10000
+
+# Variant of the simple PXL names: PXL_20230520_123456789~2.NIGHT.jpg
+simple_variant_parser = re.compile(r"(?:~\d+)?(?:\.[\w\-]+)*")
+
+folder_name_parser = re.compile(r"^(\d{4})-(\d{2})-(\d{2})(?:[_-][\w\-]*)?$")
+
+# Parse a file name against all the known naming schemes in a single match.
+# Returns a ParsedName, or None if the name follows none of the schemes.
+def ParseFileName(a_file_name: str) -> Union[ParsedName, None]:
+    if a_file_name[:3] not in name_prefixes:
+        return None
+    m = name_parser.fullmatch(a_file_name)
+    if not m:
+        return None
+    g = m.lastindex
+    scheme = scheme_by_group[g]
+    date, time, variant, ext = m.group(g + 1, g + 2, g + 3, g + 4)
+    if scheme == "WhatsAppExport":
+        date = date.replace("-", "")
+        time = time.replace(".", "").zfill(6)
+    if scheme == "Screenshot":
+        file_class = FileClass.SCREENSHOT
+    else:
+        file_class = extension_classes.get(ext.lower(), FileClass.UNKNOWN) if ext else FileClass.UNKNOWN
+    return ParsedName(file_class, scheme, date, time, variant)
 
 def isSimplePhoto(a_file) -> bool:
-    # Match name formats: 
+    # Match name formats:
     # * PXL_12345678_123456789.jpg
     # * PXL_12345678_123456789.NIGHT.jpg
     # * PXL_12345678_123456789.LONG_EXPOSURE-02.ORIGINAL.jpg
-    m = re.fullmatch(r"^PXL_\d+_\d+(~\d+)?(\.[\w\_\-]+)*\.jpg$", a_file)
-    if not m:
-        return False
-    return True
+    p = ParseFileName(a_file)
+    return (p is not None and p.scheme == "PXL" and p.time != "" and a_file.endswith(".jpg")
+            and simple_variant_parser.fullmatch(p.variant) is not None)
 
 def isSimpleVideo(a_file) -> bool:
     # Match name formats:
     # * PXL_12345678_123456789.mp4
     # * PXL_12345678_123456789.TS.mp4
-    m = re.fullmatch(r"^PXL_\d+_\d+(~\d+)?(\.[\w\_\-]+)*\.mp4$", a_file)
-    if not m:
-        return False
-    return True
+    p = ParseFileName(a_file)
+    return (p is not None and p.scheme == "PXL" and p.time != "" and a_file.endswith(".mp4")
+            and simple_variant_parser.fullmatch(p.variant) is not None)
 
 # Extract the date from a folder name formatted as YYYY-MM-DD with an optional description
 # Returns the date as YYYYMMDD
 def GetDateFromFolderName(a_folder_name: str) -> str:
     # Pattern matches dates (YYYY-MM-DD) optionally followed by a description.
     # Examples: 2023-05-20, 2023-05-20_Party, 2023-05-20-Trip
-    m = re.match(r"^(\d{4})-(\d{2})-(\d{2})(?:[_-][\w\-]*)?$", a_folder_name)
+    m = folder_name_parser.match(a_folder_name)
     if m:
         return "".join(m.groups())
     return ""
 
+# Tell whether the date in a file name is before a_date (YYYYMMDD).
+# Returns False if the name follows no known scheme: its date is unknown.
+def IsNameBefore(a_file_name: str, a_date: str) -> bool:
+    p = ParseFileName(a_file_name)
+    return p is not None and p.date < a_date
+
 def ClassifyOneFile(a_file) -> Tuple[str, FileClass]:
-    c = FileClass.UNKNOWN
-    if isSimplePhoto(a_file):
-        c = FileClass.PHOTO
-    elif isSimpleVideo(a_file):
-        c = FileClass.VIDEO
-    return (a_file, c)
-
-def ClassifyPhotos(a_file_or_dir) -> List[Tuple[str, FileClass]]:
-    r = []
-    if os.path.isdir(a_file_or_dir):
-        all_files = GetSourceFiles(a_file_or_dir)
-        for current_file in all_files:
-            r.append(ClassifyOneFile(current_file))
-    else:
-        r.append(ClassifyOneFile(a_file_or_dir))
-    return r
+    p = ParseFileName(a_file)
+    return (a_file, p.file_class if p else FileClass.UNKNOWN)
+
+# FileClass of the extension group of classify_parser, or of the
+# (screenshot, extension) groups of screenshot_classify_parser
+class ClassOfGroups(dict):
+    def __missing__(self, a_groups):
+        screenshot, ext = ("", a_groups) if isinstance(a_groups, str) else a_groups
+        if screenshot:
+            file_class = FileClass.SCREENSHOT
+        else:
+            file_class = extension_classes.get(ext.lower(), FileClass.UNKNOWN)
+        self[a_groups] = file_class
+        return file_class
+
+# Classify files.
+# a_files is a directory, a single file name, an iterable of file names, or a
+# FileCatalog, whose class column is used as is.
+# Yields (file name, FileClass) tuples as the names are consumed, a chunk at a time.
+def ClassifyPhotos(a_files: Union[str, Iterable[str]]) -> Iterator[Tuple[str, FileClass]]:
+    from FileCatalog import FileCatalog
+    if isinstance(a_files, FileCatalog):
+        yield from a_files.classified()
+        return
+    if isinstance(a_files, str):
+        a_files = GetSourceFiles(a_files) if os.path.isdir(a_files) else [a_files]
+
+    # The names of a chunk are matched in one call and the groups turned into
+    # classes by dictionary lookups, without a Python step per name
+    class_of_groups = ClassOfGroups()
+    names = iter(a_files)
+    while True:
+        chunk = list(itertools.islice(names, classify_chunk))
+        if not chunk:
+            break
+        text = "\n".join(chunk) + "\n"
+        if text.count("\n") == len(chunk):
+            parser = screenshot_classify_parser if "Screenshot_" in text else classify_parser
+            yield from zip(chunk, map(class_of_groups.__getitem__, parser.findall(text)))
+        else:
+            # A name with a new line in it
+            yield from map(ClassifyOneFile, chunk)
 
 def main():
     source_dir = default_stage_dir
-    r = ClassifyPhotos(source_dir)
-    list(map(lambda x: print(x[0], x[1]), r) )
+    for name, file_class in ClassifyPhotos(source_dir):
+        print(name, file_class)
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,207 @@
 # https://www.youtube.com/watch?v=mop6g-c5HEY
 # Last stop: 17:31:57
 
+import os
+import queue
+import threading
+import tkinter as tk
+from collections import OrderedDict
 import customtkinter as ctk
 import darkdetect
 from settings import *
 
+# Supporting libraries, without them the photos have no thumbnail
+try:
+    from PIL import Image, ImageTk
+except ImportError:
+    Image = None
+    ImageTk = None
+
+# Importer parameters
+from defaults import *
+from utils import *
+from ThumbnailCache import ThumbnailCache, ThumbnailLoader, HasThumbnail
+
+# Thumbnails kept as Tk images, about three screens of photos
+max_tk_images = 300
+
+# Interval of the checks for thumbnails and background task messages
+poll_interval_ms = 30
+
+class VirtualGrid(ctk.CTkFrame):
+    """
+    Grid of photos drawn on a canvas, able to show tens of thousands of files.
+
+    Only the cells of the visible rows exist: scrolling moves the cells and
+    gives them the files of their new position, so the cost of a redraw
+    depends on the size of the window, not on the number of files.
+    Thumbnails are asked to the ThumbnailLoader for the visible files only
+    and drawn when they arrive, a placeholder is shown meanwhile.
+    """
+    ###########################
+    # Constructor
+    def __init__(self, a_master, a_loader, **kwargs):
+        super().__init__(a_master, **kwargs)
+        self.loader = a_loader
+        self.items = []          # SourceFile entries, path is None for files without a thumbnail
+        self.offset = 0          # scroll position in pixels
+        self.columns = 1
+        self.__cells = {}        # item index -> (image id, text id) for the visible items
+        self.__free_cells = []
+        self.__images = OrderedDict()  # item key -> Tk image, least recently used first
+        self.__requested = set()
+
+        self.is_dark = darkdetect.isDark()
+        self.canvas = tk.Canvas(self, bg=DARK_GRAY if self.is_dark else WHITE, highlightthickness=0)
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.__onScrollbar)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        self.placeholder = self.__makePlaceholder()
+
+        self.canvas.bind("<Configure>", lambda event: self.redraw())
+        self.canvas.bind("<MouseWheel>", lambda event: self.scrollBy(-event.delta // 120 * CELL_HEIGHT // 2))
+        self.canvas.bind("<Button-4>", lambda event: self.scrollBy(-CELL_HEIGHT // 2))
+        self.canvas.bind("<Button-5>", lambda event: self.scrollBy(CELL_HEIGHT // 2))
+
+    def __makePlaceholder(self):
+        if ImageTk is None:
+            return None
+        size = CELL_WIDTH - 20
+        return ImageTk.PhotoImage(Image.new("RGB", (size, CELL_HEIGHT - CAPTION_HEIGHT - 10), LIGHT_GRAY if not self.is_dark else GRAY))
+
+    @staticmethod
+    def key(a_item):
+        return (a_item.rel_path, a_item.size, a_item.mtime)
+
+    ###########################
+    # Show a new list of files
+    def setItems(self, a_items):
+        self.items = a_items
+        self.offset = 0
+        for index in list(self.__cells):
+            self.__releaseCell(index)
+        self.redraw()
+
+    ###########################
+    # Scrolling
+    def totalHeight(self):
+        rows = (len(self.items) + self.columns - 1) // self.columns
+        return rows * CELL_HEIGHT
+
+    def scrollTo(self, a_offset):
+        max_offset = max(0, self.totalHeight() - self.canvas.winfo_height())
+        self.offset = int(min(max(0, a_offset), max_offset))
+        self.redraw()
+
+    def scrollBy(self, a_delta):
+        self.scrollTo(self.offset + a_delta)
+
+    def __onScrollbar(self, *args):
+        if args[0] == "moveto":
+            self.scrollTo(float(args[1]) * self.totalHeight())
+        elif args[0] == "scroll":
+            step = self.canvas.winfo_height() if args[2] == "pages" else CELL_HEIGHT // 2
+            self.scrollBy(int(args[1]) * step)
+
+    ###########################
+    # Draw the visible rows
+    def redraw(self):
+        width = max(1, self.canvas.winfo_width())
+        height = max(1, self.canvas.winfo_height())
+        self.columns = max(1, width // CELL_WIDTH)
+
+        first = (self.offset // CELL_HEIGHT) * self.columns
+        last = min(len(self.items), ((self.offset + height) // CELL_HEIGHT + 1) * self.columns)
+        visible = range(first, last)
+
+        # Recycle the cells scrolled out of view
+        for index in [index for index in self.__cells if index not in visible]:
+            self.__releaseCell(index)
+
+        wanted = set()
+        for index in visible:
+            item = self.items[index]
+            x = (index % self.columns) * CELL_WIDTH + CELL_WIDTH // 2
+            y = (index // self.columns) * CELL_HEIGHT - self.offset
+            cell = self.__cells.get(index)
+            if cell is None:
+                cell = self.__takeCell()
+                self.__cells[index] = cell
+                self.canvas.itemconfigure(cell[0], image=self.__imageOf(item) or "")
+                self.canvas.itemconfigure(cell[1], text=self.__caption(item))
+            key = self.key(item)
+            if key in self.__requested:
+                wanted.add(key)
+            self.canvas.coords(cell[0], x, y + (CELL_HEIGHT - CAPTION_HEIGHT) // 2)
+            self.canvas.coords(cell[1], x, y + CELL_HEIGHT - CAPTION_HEIGHT // 2)
+
+        # Only the visible thumbnails are worth making
+        self.loader.forget(wanted)
+        self.__requested &= wanted
+
+        total = self.totalHeight()
+        if total <= height:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.offset / total, (self.offset + height) / total)
+
+    def __takeCell(self):
+        if self.__free_cells:
+            cell = self.__free_cells.pop()
+            self.canvas.itemconfigure(cell[0], state="normal")
+            self.canvas.itemconfigure(cell[1], state="normal")
+            return cell
+        image_id = self.canvas.create_image(0, 0, anchor="center")
+        text_id = self.canvas.create_text(0, 0, anchor="center", width=CELL_WIDTH - 10,
+                                          fill=WHITE if self.is_dark else BLACK, font=("Segoe UI", 9))
+        return (image_id, text_id)
+
+    def __releaseCell(self, a_index):
+        cell = self.__cells.pop(a_index)
+        self.canvas.itemconfigure(cell[0], state="hidden", image="")
+        self.canvas.itemconfigure(cell[1], state="hidden")
+        self.__free_cells.append(cell)
+
+    @staticmethod
+    def __caption(a_item):
+        name = a_item.name if len(a_item.name) <= 22 else a_item.name[:10] + "..." + a_item.name[-9:]
+        return f"{name}\n{a_item.size / (1024*1024):.1f} MB"
+
+    # Tk image of an item, or the placeholder while its thumbnail is made
+    def __imageOf(self, a_item):
+        key = self.key(a_item)
+        image = self.__images.get(key)
+        if image is not None:
+            self.__images.move_to_end(key)
+            return image
+        if a_item.path and HasThumbnail(a_item.name) and ImageTk is not None:
+            if key not in self.__requested:
+                self.__requested.add(key)
+                self.loader.request(key, a_item.path, a_item.size, a_item.mtime)
+        return self.placeholder
+
+    ###########################
+    # Draw the thumbnails made by the loader. Called from the Tk thread.
+    def showThumbnails(self):
+        visible = {self.key(self.items[index]): cell for index, cell in self.__cells.items()}
+        while True:
+            try:
+                key, thumbnail = self.loader.results.get_nowait()
+            except queue.Empty:
+                break
+            self.__requested.discard(key)
+            if thumbnail is None or key not in visible:
+                continue
+            try:
+                with Image.open(thumbnail) as img:
+                    image = ImageTk.PhotoImage(img)
+            except OSError:
+                continue
+            self.__images[key] = image
+            while len(self.__images) > max_tk_images:
+                self.__images.popitem(last=False)
+            self.canvas.itemconfigure(visible[key][0], image=image)
+
 class PhotoImporterGUI(ctk.CTk):
     def __init__(self):
 
@@ -13,11 +210,19 @@ class PhotoImporterGUI(ctk.CTk):
         self.is_dark = darkdetect.isDark()
         super().__init__(fg_color=(WHITE, BLACK))
         ctk.set_appearance_mode(f'{'dark' if self.is_dark else 'light'}')
-        self.geometry(f'1000x400')
-        self.resizable(False, False)
+        self.geometry(f'1000x600')
+        self.resizable(True, True)
         self.title("Photo importer")
         self.iconbitmap('PhotoImporterIcon.ico')
 
+        self.stage_dir = default_stage_dir
+        self.dest_dir = default_destination_dir
+
+        # Messages from the background tasks, handled in the Tk thread
+        self.events = queue.Queue()
+        self.import_thread = None
+        self.loader = ThumbnailLoader(ThumbnailCache())
+
         # layout
         # https://youtu.be/mop6g-c5HEY?t=50389
         self.rowconfigure((0,1), weight = 1, uniform='a')
@@ -25,11 +230,141 @@ class PhotoImporterGUI(ctk.CTk):
         self.columnconfigure(1, weight=4, uniform='a')
 
         # https://youtu.be/mop6g-c5HEY?t=50554
+        panel = ctk.CTkFrame(self)
+        panel.grid(row=0, column=0, rowspan=2, sticky="nsew", padx=10, pady=10)
+        self.source = ctk.CTkSegmentedButton(panel, values=["Staged", "Phone"], command=lambda value: self.refresh())
+        self.source.set("Staged")
+        self.source.pack(fill="x", padx=10, pady=(10, 5))
+        self.refresh_button = ctk.CTkButton(panel, text="Refresh", command=self.refresh)
+        self.refresh_button.pack(fill="x", padx=10, pady=5)
+        self.import_button = ctk.CTkButton(panel, text="Import", command=self.startImport)
+        self.import_button.pack(fill="x", padx=10, pady=5)
+        self.progress = ctk.CTkProgressBar(panel)
+        self.progress.set(0)
+        self.progress.pack(fill="x", padx=10, pady=5)
+        self.status = ctk.CTkLabel(panel, text="", wraplength=170, justify="left")
+        self.status.pack(fill="x", padx=10, pady=5)
+
+        self.grid_view = VirtualGrid(self, self.loader)
+        self.grid_view.grid(row=0, column=1, rowspan=2, sticky="nsew", padx=(0, 10), pady=10)
+
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        # The files are listed in the background, the window shows at once
+        self.refresh()
+        self.after(poll_interval_ms, self.poll)
 
-        self.mainloop()
+    ###########################
+    # Background tasks
+    def runInBackground(self, a_function, *args):
+        thread = threading.Thread(target=a_function, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    # List the files of the current source in the background
+    def refresh(self):
+        self.status.configure(text="Listing files...")
+        if self.source.get() == "Phone":
+            self.runInBackground(self.listPhone)
+        else:
+            self.runInBackground(self.listStaged)
+
+    def listStaged(self):
+        try:
+            files = sorted(ScanSourceFiles(self.stage_dir), key=lambda src: src.name)
+        except OSError as e:
+            self.events.put(("error", f"Cannot list {self.stage_dir}: {e}"))
+            return
+        self.events.put(("files", "Staged", files))
+
+    def listPhone(self):
+        # The Shell objects of the phone belong to the thread that created them
+        import pythoncom
+        from PhoneTools import AndroidPhone
+        pythoncom.CoInitialize()
+        try:
+            phone = AndroidPhone()
+            snapshot = phone.getSnapshot() if phone.phone else None
+            if snapshot is None:
+                self.events.put(("error", "Phone not found."))
+                return
+            files = [SourceFile(entry.name, None, entry.name, entry.size, entry.modified)
+                     for entry in snapshot.entries]
+            files.sort(key=lambda src: src.name)
+            self.events.put(("files", "Phone", files))
+        finally:
+            pythoncom.CoUninitialize()
+
+    # Import the staged files off the Tk thread
+    def startImport(self):
+        if self.import_thread and self.import_thread.is_alive():
+            return
+        self.import_button.configure(state="disabled")
+        self.progress.set(0)
+        self.import_thread = self.runInBackground(self.runImport)
+
+    def runImport(self):
+        from PhonePhotoImporter import ImportPhonePhotos
+        from DestinationCatalog import DestinationCatalog
+        total = max(1, sum(1 for _ in ScanSourceFiles(self.stage_dir)))
+        done = 0
+
+        def progress(a_src, a_action):
+            nonlocal done
+            done += 1
+            self.events.put(("progress", done / total, f"{done}/{total} {a_src.name}: {a_action}"))
+
+        catalog = None
+        try:
+            catalog = DestinationCatalog(self.dest_dir)
+            catalog.refresh()
+            counts = ImportPhonePhotos(self.stage_dir, self.dest_dir, DefaultJobCount(self.dest_dir), catalog,
+                                       a_progress=progress)
+            self.events.put(("finished", ", ".join(f"{action} {n}" for action, n in counts.items() if n)))
+        except Exception as e:
+            self.events.put(("finished", f"Import failed: {e}"))
+        finally:
+            if catalog:
+                catalog.close()
+
+    ###########################
+    # Handle the messages of the background tasks and the new thumbnails
+    def poll(self):
+        # Coalesce the progress messages, only the last one is shown
+        progress = None
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "files":
+                _, source, files = event
+                if source == self.source.get():
+                    self.grid_view.setItems(files)
+                    self.status.configure(text=f"{len(files)} files")
+            elif event[0] == "progress":
+                progress = event
+            elif event[0] == "finished":
+                self.progress.set(1)
+                self.status.configure(text=event[1])
+                self.import_button.configure(state="normal")
+                progress = None
+                if self.source.get() == "Staged":
+                    self.runInBackground(self.listStaged)
+            elif event[0] == "error":
+                self.status.configure(text=event[1])
+        if progress:
+            self.progress.set(progress[1])
+            self.status.configure(text=progress[2])
+        self.grid_view.showThumbnails()
+        self.after(poll_interval_ms, self.poll)
+
+    def close(self):
+        self.loader.stop()
+        self.destroy()
 
 def main():
-    PhotoImporterGUI()
-     
+    PhotoImporterGUI().mainloop()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
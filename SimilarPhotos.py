@@ -0,0 +1,251 @@
+import os
+import sys
+import concurrent.futures
+
+# Supporting libraries, only needed to look for similar photos
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+# Importer parameters
+from defaults import *
+from utils import *
+from PhotoClassifier import ParseFileName
+from MediaMetadata import MetadataCache
+
+#######################################
+#
+# Near-duplicate photos: bursts, and the .NIGHT/.LONG_EXPOSURE/.ORIGINAL
+# variants of a Pixel shot.
+#
+# Every photo gets a 64-bit difference hash (dHash) computed from a small
+# grayscale thumbnail. JPEG files are decoded at a reduced scale, the full
+# image is never decoded. Two photos are similar when their hashes differ by
+# at most max_distance bits.
+#
+# Similar pairs are found with a multi-index hash rather than by comparing
+# all the pairs: the hash is split in max_distance + 1 bands, and two hashes
+# within max_distance bits have at least one identical band. Only the photos
+# sharing a band are compared, with NumPy bit operations on whole buckets.
+#
+# Files with the same name date and time (PXL_20230520_123456789.jpg and
+# PXL_20230520_123456789.NIGHT.jpg) are grouped as well, whatever their hash.
+#
+
+image_extensions = (".jpg", ".jpeg", ".png", ".webp")
+
+dhash_size = 8
+default_max_distance = 6
+
+# Below this number of files, the hashes are computed in the calling process
+process_pool_threshold = 64
+
+# Buckets are compared in blocks of this many rows by as many columns, so
+# the distances held at once stay bounded (2 MB) whatever the bucket size
+max_bucket_rows = 512
+
+default_review_file = "SimilarPhotos.txt"
+
+def IsSimilarPhotosAvailable():
+    return np is not None and Image is not None
+
+# dHash of a photo: each bit tells whether a pixel of a 9x8 grayscale
+# thumbnail is brighter than its left neighbour.
+# Returns the hash as a 16 character hexadecimal string, "" if the file
+# cannot be decoded.
+def DHash(a_path):
+    try:
+        with Image.open(a_path) as img:
+            # Let the JPEG decoder skip most of the pixels
+            img.draft("L", (dhash_size * 8, dhash_size * 8))
+            thumbnail = img.convert("L").resize((dhash_size + 1, dhash_size), Image.Resampling.BILINEAR)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return ""
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return bits.tobytes().hex()
+
+# Number of bits set in each element of an array of uint64
+def PopCount(a_values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(a_values)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[a_values.view(np.uint8).reshape(a_values.shape + (8,))].sum(axis=-1)
+
+#######################################
+#
+# Compute the dHash of the photos among a_files (SourceFile entries).
+#
+# Hashes found in a_cache are not computed again. The others are computed
+# by a pool of a_jobs processes.
+#
+# Returns a dictionary path -> hash (hexadecimal string). Photos that cannot
+# be decoded are not in the dictionary.
+#
+def ScanPerceptualHashes(a_files, a_cache=None, a_jobs=None):
+    hashes = {}
+    to_hash = []
+    for src in a_files:
+        if not src.name.lower().endswith(image_extensions):
+            continue
+        file_hash = a_cache.getPerceptualHash(src.path, src.size, src.mtime) if a_cache else None
+        if file_hash is None:
+            to_hash.append(src)
+        elif file_hash:
+            hashes[src.path] = file_hash
+
+    paths = [src.path for src in to_hash]
+    if len(paths) < process_pool_threshold:
+        computed = [DHash(path) for path in paths]
+    else:
+        jobs = a_jobs or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            computed = list(pool.map(DHash, paths, chunksize=max(1, min(64, len(paths) // (jobs * 4)))))
+
+    for src, file_hash in zip(to_hash, computed):
+        if a_cache:
+            a_cache.setPerceptualHash(src.path, src.size, src.mtime, file_hash)
+        if file_hash:
+            hashes[src.path] = file_hash
+    return hashes
+
+class UnionFind:
+    def __init__(self, a_size):
+        self.parent = list(range(a_size))
+
+    def find(self, a_item):
+        root = a_item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[a_item] != root:
+            self.parent[a_item], a_item = root, self.parent[a_item]
+        return root
+
+    def union(self, a_first, a_second):
+        self.parent[self.find(a_first)] = self.find(a_second)
+
+# Link in a_groups the hashes of a_hashes (array of uint64) that differ by at
+# most a_max_distance bits.
+def LinkSimilarHashes(a_hashes, a_max_distance, a_groups):
+    # Identical hashes (blank frames, repeated shots) are linked directly and
+    # the bands only compare the distinct values, a_hashes[first]
+    values, first, inverse = np.unique(a_hashes, return_index=True, return_inverse=True)
+    for index, value in enumerate(inverse.ravel().tolist()):
+        if index != first[value]:
+            a_groups.union(index, int(first[value]))
+
+    num_bands = a_max_distance + 1
+    shift = 0
+    for band in range(num_bands):
+        width = 64 // num_bands + (1 if band < 64 % num_bands else 0)
+        keys = (values >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        shift += width
+
+        # Buckets of the hashes sharing this band
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(keys)]))
+        for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            members = first[order[start:end]]
+            bucket = values[order[start:end]]
+            # Every pair once: the blocks on and above the diagonal
+            for row in range(0, len(members), max_bucket_rows):
+                rows = bucket[row:row + max_bucket_rows]
+                for column in range(row, len(members), max_bucket_rows):
+                    columns = bucket[column:column + max_bucket_rows]
+                    distances = PopCount(rows[:, None] ^ columns[None, :])
+                    for i, j in zip(*np.nonzero(distances <= a_max_distance)):
+                        if row + i < column + j:
+                            a_groups.union(int(members[row + i]), int(members[column + j]))
+
+# Name date and time of a file, when its naming scheme has a time
+def VariantKey(a_file_name):
+    parsed = ParseFileName(a_file_name)
+    if not parsed or not parsed.time:
+        return None
+    return (parsed.scheme, parsed.date, parsed.time)
+
+#######################################
+#
+# Find the groups of similar photos among a_files (SourceFile entries).
+#
+# Returns a list of groups, each a list of SourceFile with the largest file
+# first (the one with the most detail).
+#
+def FindSimilarPhotos(a_files, a_max_distance=default_max_distance, a_cache=None, a_jobs=None):
+    a_files = list(a_files)
+    groups = UnionFind(len(a_files))
+
+    # Variants of the same shot, by name
+    first_of_variant = {}
+    for index, src in enumerate(a_files):
+        key = VariantKey(src.name)
+        if key is None:
+            continue
+        if key in first_of_variant:
+            groups.union(index, first_of_variant[key])
+        else:
+            first_of_variant[key] = index
+
+    # Similar content
+    hashes = ScanPerceptualHashes(a_files, a_cache, a_jobs)
+    hashed = [index for index, src in enumerate(a_files) if src.path in hashes]
+    if len(hashed) > 1:
+        values = np.array([int(hashes[a_files[index].path], 16) for index in hashed], dtype=np.uint64)
+        hashed_groups = UnionFind(len(hashed))
+        LinkSimilarHashes(values, a_max_distance, hashed_groups)
+        for position, index in enumerate(hashed):
+            groups.union(index, hashed[hashed_groups.find(position)])
+
+    members = {}
+    for index in range(len(a_files)):
+        members.setdefault(groups.find(index), []).append(a_files[index])
+    similar = [sorted(group, key=lambda src: (-src.size, src.rel_path)) for group in members.values() if len(group) > 1]
+    similar.sort(key=lambda group: min(src.rel_path for src in group))
+    return similar
+
+#######################################
+#
+# Review file of the groups of similar photos.
+#
+# Every photo of a group is on a line starting with "keep". Changing it to
+# "drop" excludes the photo from the import (option --review).
+#
+def WriteReviewFile(a_groups, a_path, a_source_dir):
+    with open(a_path, "w", encoding="utf-8") as review:
+        review.write(f"# Similar photos in {os.path.abspath(a_source_dir)}\n")
+        review.write("# Change \"keep\" to \"drop\" for the photos not to import, then run\n")
+        review.write(f"#   PhonePhotoImporter.py import --review {a_path}\n")
+        for number, group in enumerate(a_groups, 1):
+            review.write(f"\n# Group {number}: {len(group)} photos\n")
+            for src in group:
+                review.write(f"keep  {src.rel_path}\n")
+
+# Relative paths of the photos marked "drop" in a review file
+def ReadReviewDrops(a_path):
+    dropped = set()
+    with open(a_path, "r", encoding="utf-8") as review:
+        for line in review:
+            decision, _, rel_path = line.strip().partition(" ")
+            if decision.lower() == "drop" and rel_path.strip():
+                dropped.add(rel_path.strip())
+    return dropped
+
+def main():
+    if not IsSimilarPhotosAvailable():
+        print("Looking for similar photos requires Pillow and NumPy (pip install pillow numpy).")
+        return
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else default_stage_dir
+    cache = MetadataCache()
+    groups = FindSimilarPhotos(ScanSourceFiles(source_dir), a_cache=cache)
+    cache.close()
+    for number, group in enumerate(groups, 1):
+        print(f"Group {number}: " + ", ".join(src.rel_path for src in group))
+
+if __name__ == "__main__":
+    main()
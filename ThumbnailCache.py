@@ -0,0 +1,170 @@
+import os
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Supporting libraries, without them the photos have no thumbnail
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Importer parameters
+from defaults import *
+
+thumbnail_size = 128
+default_thumbnail_dir = os.path.join(default_cache_dir, "thumbnails")
+default_max_cache_bytes = 512 * 1024 * 1024
+
+thumbnail_extensions = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif")
+
+class ThumbnailCache:
+    """
+    On-disk LRU cache of thumbnails.
+
+    A thumbnail is a small JPEG file named after the path, size and mtime of
+    its photo, so a modified photo gets a new thumbnail. The access order is
+    kept in memory and in the mtime of the thumbnail files: when the cache
+    grows over max_bytes, the least recently used thumbnails are removed.
+    """
+    ###########################
+    # Constructor
+    def __init__(self, a_folder=default_thumbnail_dir, a_max_bytes=default_max_cache_bytes):
+        self.folder = a_folder
+        self.max_bytes = a_max_bytes
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()  # file name -> size, least recently used first
+        self.__total_bytes = 0
+        os.makedirs(a_folder, exist_ok=True)
+        entries = []
+        with os.scandir(a_folder) as listing:
+            for entry in listing:
+                if entry.is_file() and entry.name.endswith(".jpg"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(entries):
+            self.__entries[name] = size
+            self.__total_bytes += size
+
+    @staticmethod
+    def key(a_path, a_size, a_mtime):
+        return hashlib.sha1(f"{os.path.abspath(a_path)}|{a_size}|{a_mtime}".encode("utf-8")).hexdigest() + ".jpg"
+
+    ###########################
+    # Path of the cached thumbnail of a photo, or None if it is not cached
+    def get(self, a_path, a_size, a_mtime):
+        name = self.key(a_path, a_size, a_mtime)
+        with self.__lock:
+            if name not in self.__entries:
+                return None
+            self.__entries.move_to_end(name)
+        thumbnail = os.path.join(self.folder, name)
+        try:
+            os.utime(thumbnail)
+        except OSError:
+            with self.__lock:
+                self.__total_bytes -= self.__entries.pop(name, 0)
+            return None
+        return thumbnail
+
+    ###########################
+    # Make the thumbnail of a photo and store it in the cache.
+    # Returns the path of the thumbnail, or None if the photo cannot be decoded.
+    def make(self, a_path, a_size, a_mtime):
+        if Image is None:
+            return None
+        name = self.key(a_path, a_size, a_mtime)
+        thumbnail = os.path.join(self.folder, name)
+        temp = f"{thumbnail}.{threading.get_ident()}.tmp"
+        try:
+            with Image.open(a_path) as img:
+                # Let the JPEG decoder skip most of the pixels
+                img.draft("RGB", (thumbnail_size, thumbnail_size))
+                img.thumbnail((thumbnail_size, thumbnail_size))
+                img.convert("RGB").save(temp, "JPEG", quality=80)
+            os.replace(temp, thumbnail)
+            size = os.path.getsize(thumbnail)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return None
+        with self.__lock:
+            self.__total_bytes += size - self.__entries.pop(name, 0)
+            self.__entries[name] = size
+            self.__evict()
+        return thumbnail
+
+    # Remove the least recently used thumbnails until the cache fits max_bytes
+    def __evict(self):
+        while self.__total_bytes > self.max_bytes and len(self.__entries) > 1:
+            name, size = self.__entries.popitem(last=False)
+            self.__total_bytes -= size
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+class ThumbnailLoader:
+    """
+    Pool of worker threads filling the ThumbnailCache in the background.
+
+    request() queues a photo, the most recent requests are served first so
+    the rows on screen come before the rows scrolled past. The result is put
+    on the results queue as (key, thumbnail path or None), to be picked up by
+    the GUI thread. forget() drops the requests of the photos no longer on
+    screen.
+    """
+    ###########################
+    # Constructor
+    def __init__(self, a_cache, a_num_workers=None):
+        self.cache = a_cache
+        self.results = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__pending = OrderedDict()  # key -> (path, size, mtime), oldest first
+        self.__wake = threading.Semaphore(0)
+        self.__stopped = False
+        num_workers = a_num_workers or max(2, min(8, (os.cpu_count() or 1)))
+        self.__workers = [threading.Thread(target=self.__work, daemon=True) for _ in range(num_workers)]
+        for worker in self.__workers:
+            worker.start()
+
+    ###########################
+    # Ask for the thumbnail of a photo. a_key identifies the photo in the results.
+    def request(self, a_key, a_path, a_size, a_mtime):
+        with self.__lock:
+            if a_key in self.__pending:
+                self.__pending.move_to_end(a_key)
+                return
+            self.__pending[a_key] = (a_path, a_size, a_mtime)
+        self.__wake.release()
+
+    # Drop the pending requests whose key is not in a_keys
+    def forget(self, a_keys):
+        with self.__lock:
+            for key in [key for key in self.__pending if key not in a_keys]:
+                del self.__pending[key]
+
+    def stop(self):
+        self.__stopped = True
+        for _ in self.__workers:
+            self.__wake.release()
+
+    def __work(self):
+        while True:
+            self.__wake.acquire()
+            if self.__stopped:
+                return
+            with self.__lock:
+                if not self.__pending:
+                    continue
+                key, (path, size, mtime) = self.__pending.popitem(last=True)
+            thumbnail = self.cache.get(path, size, mtime)
+            if thumbnail is None:
+                thumbnail = self.cache.make(path, size, mtime)
+            self.results.put((key, thumbnail))
+
+def HasThumbnail(a_file_name):
+    return a_file_name.lower().endswith(thumbnail_extensions)
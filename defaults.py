@@ -1,4 +1,34 @@
+import os
+
 # Importer parameters
 default_stage_dir = "TestSrc"
 default_destination_dir = "TestDest"
-default_test_dir = "TestDest"
\ No newline at end of file
+default_test_dir = "TestDest"
+
+# Local folder for the importer's catalogs, journals and caches. The
+# PHOTO_IMPORTER_CACHE environment variable moves it elsewhere, so tests and
+# benchmarks leave the user's folder alone.
+default_cache_dir = (os.environ.get("PHOTO_IMPORTER_CACHE")
+                     or os.path.join(os.path.expanduser("~"), ".PhonePhotoImporter"))
+
+# Folders of the phone scanned for photos and videos, relative to its storage
+default_phone_storage = "Internal shared storage"
+default_phone_roots = [
+    "DCIM/Camera",
+    "Pictures/Screenshots",
+    "Movies",
+    "Android/media/com.whatsapp/WhatsApp/Media/WhatsApp Images",
+    "Android/media/com.whatsapp/WhatsApp/Media/WhatsApp Video",
+    "WhatsApp/Media/WhatsApp Images",   # WhatsApp before Android 11
+    "WhatsApp/Media/WhatsApp Video",
+]
+
+# Files of the phone transferred, by extension (case-insensitive). Subfolders
+# of the roots are scanned too, except hidden ones and the ones named here.
+default_media_extensions = (".jpg", ".jpeg", ".png", ".heic", ".webp", ".dng", ".gif",
+                            ".mp4", ".mov", ".3gp", ".mkv", ".mpeg")
+default_pruned_folders = ("Sent", "Private")
+
+# Order of the transfers from the phone, see OrderTransfers()
+transfer_policies = ("photos-first", "smallest-first", "newest-first", "listing")
+default_transfer_policy = "photos-first"
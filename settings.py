@@ -1,2 +1,10 @@
 BLACK = '#000000'
-WHITE = '#EEEEEE'
\ No newline at end of file
+WHITE = '#EEEEEE'
+GRAY = '#808080'
+DARK_GRAY = '#2B2B2B'
+LIGHT_GRAY = '#D0D0D0'
+
+# Photo grid
+CELL_WIDTH = 150
+CELL_HEIGHT = 160
+CAPTION_HEIGHT = 20
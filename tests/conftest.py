@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The modules of the importer are at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Journals and caches of the tests go to a temporary folder, read by
+# defaults.py when the modules are first imported
+os.environ["PHOTO_IMPORTER_CACHE"] = tempfile.mkdtemp(prefix="photo_importer_tests_")
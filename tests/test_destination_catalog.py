@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import PhonePhotoImporter
+from DestinationCatalog import DestinationCatalog
+
+def make_folder(a_dir, a_mtime, *a_names):
+    os.makedirs(a_dir, exist_ok=True)
+    for name in a_names:
+        with open(os.path.join(a_dir, name), "wb") as f:
+            f.write(b"x")
+    os.utime(a_dir, (a_mtime, a_mtime))
+
+@pytest.fixture
+def dest(tmp_path):
+    dest = tmp_path / "dest"
+    make_folder(dest / "2023-05-20_", 1000000, "a.jpg")
+    return dest
+
+def open_catalog(a_dest):
+    catalog = DestinationCatalog(str(a_dest), str(a_dest.parent / "catalog.db"))
+    catalog.refresh()
+    return catalog
+
+def test_unchanged_folders_are_not_listed(dest):
+    open_catalog(dest).close()
+    catalog = open_catalog(dest)
+    assert catalog.numRescannedFolders() == 0
+    assert catalog.folderFiles("2023-05-20_") == {"a.jpg": 1}
+
+def test_recent_folder_is_listed_again(dest):
+    # Within the mtime resolution of the listing, a later change may keep the same mtime
+    os.utime(dest / "2023-05-20_")
+    open_catalog(dest).close()
+    assert open_catalog(dest).numRescannedFolders() == 1
+
+def test_write_after_the_importer_is_seen(dest):
+    catalog = open_catalog(dest)
+    folder = dest / "2023-05-20_"
+    make_folder(folder, 1000010, "b.jpg")
+    catalog.recordFile("2023-05-20_", "b.jpg", 1, 0.0)
+    # Another process writes in the folder after the importer
+    make_folder(folder, 1000020, "c.jpg")
+    catalog.close()
+    catalog = open_catalog(dest)
+    assert catalog.numRescannedFolders() == 1
+    assert catalog.folderFiles("2023-05-20_") == {"a.jpg": 1, "b.jpg": 1, "c.jpg": 1}
+
+def test_importer_write_keeps_the_folder(dest):
+    catalog = open_catalog(dest)
+    make_folder(dest / "2023-05-20_", 1000010, "b.jpg")
+    catalog.recordFile("2023-05-20_", "b.jpg", 1, 0.0)
+    catalog.close()
+    assert open_catalog(dest).numRescannedFolders() == 0
+
+def test_latest_folder_date(dest):
+    catalog = open_catalog(dest)
+    assert PhonePhotoImporter.DateOfLatestFolder(str(dest)) == catalog.latestFolderDate() == "20230520"
+    empty = dest.parent / "empty"
+    empty.mkdir()
+    catalog = open_catalog(empty)
+    assert PhonePhotoImporter.DateOfLatestFolder(str(empty)) is None
+    assert catalog.latestFolderDate() is None
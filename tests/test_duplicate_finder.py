@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from DuplicateFinder import DuplicateFinder, FullHash, partial_block_size
+
+def write(a_path, a_content):
+    os.makedirs(os.path.dirname(a_path), exist_ok=True)
+    with open(a_path, "wb") as f:
+        f.write(a_content)
+    return (str(a_path), len(a_content))
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_find_duplicates(tmp_path, jobs):
+    photo = os.urandom(3 * partial_block_size)
+    # Same size, head and tail as photo, only the middle differs
+    middle = photo[:partial_block_size] + os.urandom(partial_block_size) + photo[-partial_block_size:]
+    other = os.urandom(len(photo))
+
+    finder = DuplicateFinder(jobs)
+    ref_path, ref_size = write(tmp_path / "dest" / "photo.jpg", photo)
+    finder.addReference(ref_path, ref_size)
+    finder.addReference(*write(tmp_path / "dest" / "small.jpg", b"small"))
+
+    candidates = [
+        write(tmp_path / "stage" / "a_copy.jpg", photo),
+        write(tmp_path / "stage" / "b_middle.jpg", middle),
+        write(tmp_path / "stage" / "c_other.jpg", other),
+        write(tmp_path / "stage" / "d_other.jpg", other),
+        write(tmp_path / "stage" / "e_unique.jpg", b"unique"),
+    ]
+    duplicates = finder.findDuplicates(candidates)
+    assert duplicates == {
+        candidates[0][0]: ref_path,
+        candidates[3][0]: candidates[2][0],   # the first in sorted order is the original
+    }
+    # Files of a size no other file has are not read
+    assert candidates[4][0] not in finder.computed_hashes
+    assert finder.computed_hashes[ref_path] == FullHash(ref_path)
+
+def test_known_hashes_are_reused(tmp_path):
+    photo = os.urandom(2 * partial_block_size)
+    finder = DuplicateFinder()
+    ref_path, ref_size = write(tmp_path / "dest" / "photo.jpg", photo)
+    finder.addReference(ref_path, ref_size, FullHash(ref_path))
+    candidate = write(tmp_path / "stage" / "copy.jpg", photo)
+    assert finder.findDuplicates([candidate]) == {candidate[0]: ref_path}
+    assert list(finder.computed_hashes) == [candidate[0]]
+
+def test_unreadable_candidate(tmp_path):
+    finder = DuplicateFinder()
+    finder.addReference(*write(tmp_path / "dest" / "photo.jpg", b"x" * 100))
+    missing = (str(tmp_path / "stage" / "missing.jpg"), 100)
+    assert finder.findDuplicates([missing]) == {}
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+import FileCatalog as file_catalog
+from FileCatalog import FileCatalog, MatchFiles
+from PhotoClassifier import ClassifyPhotos, FileClass
+
+def catalog(a_paths, a_root="root"):
+    files = FileCatalog(a_root)
+    for folder, name in a_paths:
+        files.add(folder, name, 10, 0.0)
+    return files
+
+def test_match_files():
+    first = catalog([("", "z"), ("a", "x"), ("a-b", "y"), ("a", "a")])
+    second = catalog([("a", "x"), ("q", "r"), ("", "z")])
+    assert list(MatchFiles(first, second)) == [(0, 2), (3, None), (1, 0), (2, None), (None, 1)]
+
+def test_match_files_empty():
+    first = catalog([("", "a"), ("b", "c")])
+    assert list(MatchFiles(first, FileCatalog())) == [(0, None), (1, None)]
+    assert list(MatchFiles(FileCatalog(), first)) == [(None, 0), (None, 1)]
+    assert list(MatchFiles(FileCatalog(), FileCatalog())) == []
+
+def test_match_files_unicode():
+    first = catalog([("", "é.jpg"), ("", "e.jpg")])
+    second = catalog([("", "e.jpg"), ("", "é.jpg")])
+    assert sorted(MatchFiles(first, second)) == [(0, 1), (1, 0)]
+
+def test_rows():
+    files = FileCatalog("root")
+    files.add("2023", "PXL_20230520_123456789.jpg", 1234, 5.0)
+    files.add("", "notes.txt", 3)
+    assert len(files) == 2
+    src = files.file(0)
+    assert src.rel_path == os.path.join("2023", "PXL_20230520_123456789.jpg")
+    assert src.path == os.path.join("root", "2023", "PXL_20230520_123456789.jpg")
+    assert (src.size, src.mtime) == (1234, 5.0)
+    assert files.relPath(1) == "notes.txt"
+    assert files.totalSize() == 1237
+
+def test_classified():
+    names = ["PXL_20230520_123456789.jpg", "PXL_20230520_123456789.mp4", "Screenshot_20230520-123456.png", "notes.txt"]
+    files = catalog([("", name) for name in names])
+    assert list(files.classified()) == list(ClassifyPhotos(names))
+    assert list(ClassifyPhotos(files)) == list(ClassifyPhotos(names))
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_select(monkeypatch, numpy):
+    if not numpy:
+        monkeypatch.setattr(file_catalog, "numpy_module", False)
+    elif file_catalog.Numpy() is None:
+        pytest.skip("NumPy is not installed")
+    files = FileCatalog()
+    files.add("", "PXL_20230101_000000001.jpg", 100)
+    files.add("", "PXL_20230601_000000001.jpg", 200)
+    files.add("", "PXL_20230601_000000002.mp4", 300)
+    files.add("", "notes.txt", 400)
+    assert list(files.select(a_min_size=200)) == [1, 2, 3]
+    assert list(files.select(a_since="20230301")) == [1, 2, 3]
+    assert list(files.select(a_until="20230301")) == [0, 3]
+    assert list(files.select(a_classes=[FileClass.PHOTO])) == [0, 1]
+    selection = files.select(a_min_size=200)
+    assert list(files.select(a_classes=[FileClass.VIDEO, FileClass.UNKNOWN], a_selection=selection)) == [2, 3]
+    assert list(files.names(files.select(a_since="20230301", a_classes=[FileClass.PHOTO]))) == ["PXL_20230601_000000001.jpg"]
+    assert list(files.excluded(selection)) == [0]
+    assert list(files.excluded(files.select(a_min_size=300), selection)) == [1]
+    assert list(files.excluded(files.select(a_min_size=500))) == [0, 1, 2, 3]
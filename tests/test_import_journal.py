@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+import PhonePhotoImporter
+from ImportJournal import ImportJournal
+from PhonePhotoImporter import ImportPhonePhotos
+
+header = {"source": "stage", "dest": "dest"}
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ImportJournal(path)
+    assert not journal.open(header)
+    for key in ("a.jpg", "b.jpg", "c.jpg", "d.jpg"):
+        journal.planFile(key, 100, 1.0)
+    journal.listingComplete()
+    journal.startFile("a.jpg")
+    journal.finishFile("a.jpg", "copied")
+    journal.startFile("b.jpg")
+    journal.finishFile("b.jpg", "error")
+    journal.startFile("c.jpg")
+    journal.close()
+
+    journal = ImportJournal(path)
+    assert journal.open(header, a_resume=True)
+    assert journal.listing_complete
+    assert journal.isDone("a.jpg")
+    assert not journal.isDone("b.jpg")   # errors are retried
+    assert journal.interrupted() == ["c.jpg"]
+    assert [key for key, _ in journal.pending()] == ["b.jpg", "c.jpg", "d.jpg"]
+    assert journal.planned["d.jpg"] == [100, 1.0]
+    journal.close(a_finished=True)
+    assert not os.path.exists(path)
+
+def test_resume_other_run(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ImportJournal(path)
+    journal.open(header)
+    journal.planFile("a.jpg", 100, 1.0)
+    journal.finishFile("a.jpg", "copied")
+    journal.close()
+
+    journal = ImportJournal(path)
+    assert not journal.open(dict(header, dest="other"), a_resume=True)
+    assert not journal.isDone("a.jpg")
+    journal.close()
+
+def test_truncated_record(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ImportJournal(path)
+    journal.open(header)
+    journal.planFile("a.jpg", 100, 1.0)
+    journal.finishFile("a.jpg", "copied")
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('["D", "b.j')
+
+    journal = ImportJournal(path)
+    assert journal.open(header, a_resume=True)
+    journal.finishFile("c.jpg", "copied")
+    journal.close()
+    journal = ImportJournal(path)
+    journal.load()
+    assert journal.done == {"a.jpg": "copied", "c.jpg": "copied"}
+
+class Interrupted(Exception):
+    pass
+
+def test_resume_import(tmp_path, monkeypatch):
+    monkeypatch.setattr(PhonePhotoImporter.log, "quiet", True)
+    stage = tmp_path / "stage"
+    dest = tmp_path / "dest"
+    stage.mkdir()
+    dest.mkdir()
+    for i in range(6):
+        (stage / f"PXL_2024050{i + 1}_00000000{i}.jpg").write_bytes(bytes([i]) * 200_000)
+
+    imported = []
+    def progress(a_src, a_action):
+        imported.append(a_src.name)
+        if len(imported) == 2:
+            raise Interrupted()
+    with pytest.raises(Interrupted):
+        ImportPhonePhotos(str(stage), str(dest), a_progress=progress)
+
+    counts = ImportPhonePhotos(str(stage), str(dest), a_resume=True)
+    assert counts["copied"] == 4
+    assert counts["skipped"] == 0
+    assert sum(len(files) for _, _, files in os.walk(dest)) == 6
+
+def test_import_rejects_small_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(PhonePhotoImporter.log, "quiet", True)
+    stage = tmp_path / "stage"
+    stage.mkdir()
+    (tmp_path / "dest").mkdir()
+    (stage / "PXL_20240501_000000001.jpg").write_bytes(b"x" * 200_000)
+    (stage / "PXL_20240501_000000002.jpg").write_bytes(b"x" * 1000)
+    (stage / "PXL_20240501_000000003.jpg").write_bytes(b"x" * 200_000)
+    counts = ImportPhonePhotos(str(stage), str(tmp_path / "dest"), a_dedup=True)
+    assert (counts["copied"], counts["duplicate"], counts["rejected"]) == (1, 1, 1)
+
+def test_new_import_cleans_interrupted_one(tmp_path, monkeypatch, capsys):
+    from ImportJournal import JournalPath
+    monkeypatch.setattr(PhonePhotoImporter.log, "quiet", True)
+    stage = tmp_path / "stage"
+    dest = tmp_path / "dest"
+    stage.mkdir()
+    for i in range(3):
+        (stage / f"PXL_2024050{i + 1}_00000000{i}.jpg").write_bytes(bytes([i]) * 200_000)
+
+    # An import killed in the middle of a transfer
+    name = "PXL_20240502_000000001.jpg"
+    journal = ImportJournal(JournalPath("import", str(stage), str(dest)))
+    journal.open({"source": os.path.abspath(stage), "dest": os.path.abspath(dest)})
+    journal.planFile(name, 200_000, (stage / name).stat().st_mtime)
+    journal.startFile(name)
+    journal.close()
+    (dest / "2024-05-02").mkdir(parents=True)
+    (dest / "2024-05-02" / (name + ".partial")).write_bytes(b"x" * 10)
+    capsys.readouterr()
+
+    # Started again without --resume
+    counts = ImportPhonePhotos(str(stage), str(dest))
+    assert "did not finish" in capsys.readouterr().out
+    assert counts["copied"] == 3
+    assert sorted(name for _, _, files in os.walk(dest) for name in files) == sorted(os.listdir(stage))
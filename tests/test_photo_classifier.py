@@ -0,0 +1,55 @@
+import pytest
+
+from PhotoClassifier import ClassifyOneFile, ClassifyPhotos, FileClass, IsNameBefore, ParseFileName, isSimplePhoto
+
+@pytest.mark.parametrize("name, scheme, date, file_class", [
+    ("PXL_20230520_123456789.jpg", "PXL", "20230520", FileClass.PHOTO),
+    ("PXL_20230520_123456789~2.NIGHT.jpg", "PXL", "20230520", FileClass.PHOTO),
+    ("PXL_20230520_123456789.LONG_EXPOSURE-02.ORIGINAL.jpg", "PXL", "20230520", FileClass.PHOTO),
+    ("PXL_20230520_123456789.TS.mp4", "PXL", "20230520", FileClass.VIDEO),
+    ("IMG_20230520_123456.jpg", "IMG", "20230520", FileClass.PHOTO),
+    ("VID_20230520_123456.mp4", "VID", "20230520", FileClass.VIDEO),
+    ("IMG-20230520-WA0012.jpg", "WhatsApp", "20230520", FileClass.PHOTO),
+    ("Screenshot_20230520-123456.png", "Screenshot", "20230520", FileClass.SCREENSHOT),
+    ("WhatsApp Image 2023-05-20 at 12.34.56.jpeg", "WhatsAppExport", "20230520", FileClass.PHOTO),
+    # Accepted by the date parsing of the baseline, before the naming schemes
+    ("IMG-20230601-WA0012 (1).jpg", "WhatsApp", "20230601", FileClass.PHOTO),
+    ("IMG-20230601-WA0012-01.jpeg", "WhatsApp", "20230601", FileClass.PHOTO),
+    ("IMG-20230601-abc.jpg", "WhatsApp", "20230601", FileClass.PHOTO),
+    ("PXL_20230520_123456789 (1).jpg", "PXL", "20230520", FileClass.PHOTO),
+])
+def test_parse_file_name(name, scheme, date, file_class):
+    parsed = ParseFileName(name)
+    assert parsed is not None
+    assert (parsed.scheme, parsed.date, parsed.file_class) == (scheme, date, file_class)
+    assert list(ClassifyPhotos(name)) == [(name, file_class)]
+
+@pytest.mark.parametrize("name", ["foo.jpg", "PXL_2023_1.jpg", "PXL_20230520_.jpg", "IMG-2023060-WA0012.jpg", "DSC00012.JPG"])
+def test_parse_unknown_name(name):
+    assert ParseFileName(name) is None
+    assert list(ClassifyPhotos([name])) == [(name, FileClass.UNKNOWN)]
+
+def test_classify_chunks(monkeypatch):
+    import PhotoClassifier
+    monkeypatch.setattr(PhotoClassifier, "classify_chunk", 3)
+    names = ["PXL_20230520_123456789.jpg", "Screenshot_20230520-123456.png", "IMG-20230520-WA0012.JPG",
+             "notes.txt", "", "PXL_20230520_123456789", "VID_20230520_123456.mp4", "a\nb.jpg", "IMG_20230520_123456 (1).png"]
+    classes = ClassifyPhotos(iter(names))
+    assert next(classes) == (names[0], FileClass.PHOTO)
+    assert list(classes) == [(name, ClassifyOneFile(name)[1]) for name in names[1:]]
+
+def test_simple_photo():
+    assert isSimplePhoto("PXL_20230520_123456789~2.NIGHT.jpg")
+    assert not isSimplePhoto("PXL_20230520_123456789 (1).jpg")
+    assert not isSimplePhoto("PXL_20230520_123456789.mp4")
+
+def test_name_before():
+    assert IsNameBefore("IMG-20230601-WA0012 (1).jpg", "20230602")
+    assert not IsNameBefore("IMG-20230601-WA0012 (1).jpg", "20230601")
+    assert not IsNameBefore("DSC00012.JPG", "20230601")
+
+def test_media_extensions_have_a_class():
+    from defaults import default_media_extensions
+    from PhotoClassifier import extension_classes
+    assert [ext for ext in default_media_extensions if ext[1:] not in extension_classes] == []
+    assert ParseFileName("VID_20230520_123456.mpeg").file_class == FileClass.VIDEO
@@ -0,0 +1,33 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+import SimilarPhotos
+from SimilarPhotos import LinkSimilarHashes, UnionFind
+
+def groups(a_hashes, a_max_distance):
+    found = UnionFind(len(a_hashes))
+    LinkSimilarHashes(np.array(a_hashes, dtype=np.uint64), a_max_distance, found)
+    return {frozenset(i for i in range(len(a_hashes)) if found.find(i) == root)
+            for root in {found.find(i) for i in range(len(a_hashes))}}
+
+# Pairs within a_max_distance bits, linked by brute force
+def expected_groups(a_hashes, a_max_distance):
+    found = UnionFind(len(a_hashes))
+    for i in range(len(a_hashes)):
+        for j in range(i + 1, len(a_hashes)):
+            if bin(a_hashes[i] ^ a_hashes[j]).count("1") <= a_max_distance:
+                found.union(i, j)
+    return {frozenset(i for i in range(len(a_hashes)) if found.find(i) == root)
+            for root in {found.find(i) for i in range(len(a_hashes))}}
+
+@pytest.mark.parametrize("block", [3, 512])
+def test_link_similar_hashes(monkeypatch, block):
+    monkeypatch.setattr(SimilarPhotos, "max_bucket_rows", block)
+    rng = np.random.default_rng(1)
+    base = [int(value) for value in rng.integers(0, 2**63, size=20, dtype=np.uint64)]
+    hashes = base + [value ^ (1 << int(bit)) ^ (1 << 60) for value, bit in zip(base, rng.integers(0, 50, size=20))]
+    hashes += base[:5] + [0x1234 | (i << 40) for i in range(30)]
+    for max_distance in (1, 2, 6):
+        assert groups(hashes, max_distance) == expected_groups(hashes, max_distance)
@@ -0,0 +1,97 @@
+import os
+import sys
+import types
+
+import pytest
+
+import ImportJournal
+import PhonePhotoImporter
+from PhonePhotoImporter import CopyPhotosFromPhone, StagedFiles
+
+SIZE = 1000
+
+class FakePhone:
+    """Phone listing a_files, the copies of a_failing fail."""
+    def __init__(self, a_serial, a_files, a_failing=()):
+        self.phone = True
+        self.serial = a_serial
+        self.files = a_files
+        self.failing = set(a_failing)
+
+    def listFileNames(self):
+        return list(self.files)
+
+    def getFileSize(self, a_file_name):
+        return SIZE
+
+    def copyFilesToLocal(self, a_file_names, a_dest_path, *a_args):
+        for file_name in a_file_names:
+            if file_name in self.failing:
+                yield (file_name, False)
+                continue
+            with open(os.path.join(a_dest_path, file_name), "wb") as f:
+                f.write(b"x" * SIZE)
+            yield (file_name, True)
+
+@pytest.fixture
+def phones(tmp_path, monkeypatch):
+    monkeypatch.setattr(ImportJournal, "default_cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(PhonePhotoImporter.log, "quiet", True)
+    devices = {}
+    module = types.ModuleType("PhoneTools")
+    module.AndroidPhone = lambda a_since, a_serial=None: devices[a_serial]
+    monkeypatch.setitem(sys.modules, "PhoneTools", module)
+    return devices
+
+def copy(a_stage, a_staged, a_serial, a_resume=False):
+    dest = os.path.join(a_stage, a_serial)
+    os.makedirs(dest, exist_ok=True)
+    return CopyPhotosFromPhone(dest, 2, a_resume, None, None, a_serial,
+                               lambda name, size: a_staged.claim(a_serial, name, size), "listing",
+                               lambda name, size: a_staged.release(a_serial, name, size))
+
+def test_claim_release(tmp_path):
+    staged = StagedFiles(str(tmp_path))
+    assert staged.claim("a", "IMG_1.jpg", SIZE)
+    assert not staged.claim("b", "IMG_1.jpg", SIZE)
+    staged.release("b", "IMG_1.jpg", SIZE)   # not the owner, no effect
+    assert not staged.claim("b", "IMG_1.jpg", SIZE)
+    staged.release("a", "IMG_1.jpg", SIZE)
+    assert staged.claim("b", "IMG_1.jpg", SIZE)
+
+def test_staged_files_belong_to_their_folder(tmp_path):
+    os.makedirs(tmp_path / "a")
+    (tmp_path / "a" / "IMG_1.jpg").write_bytes(b"x" * SIZE)
+    staged = StagedFiles(str(tmp_path))
+    assert staged.claim("a", "IMG_1.jpg", SIZE)
+    assert not staged.claim("b", "IMG_1.jpg", SIZE)
+    assert staged.claim("b", "IMG_1.jpg", SIZE + 1)
+
+def test_failed_copy_releases_claim(tmp_path, phones):
+    stage = str(tmp_path / "stage")
+    staged = StagedFiles(stage)
+    phones["a"] = FakePhone("a", ["IMG_1.jpg", "IMG_2.jpg"], a_failing=["IMG_1.jpg"])
+    phones["b"] = FakePhone("b", ["IMG_1.jpg", "IMG_2.jpg"])
+
+    counts = copy(stage, staged, "a")
+    assert counts["copied"] == 1 and counts["error"] == 1
+    counts = copy(stage, staged, "b")
+    assert counts["copied"] == 1 and counts["duplicate"] == 1
+    assert os.path.exists(os.path.join(stage, "b", "IMG_1.jpg"))
+
+def test_duplicate_is_retried_by_resume(tmp_path, phones):
+    stage = str(tmp_path / "stage")
+    phones["a"] = FakePhone("a", ["IMG_1.jpg"], a_failing=["IMG_1.jpg"])
+    phones["b"] = FakePhone("b", ["IMG_1.jpg", "IMG_2.jpg"], a_failing=["IMG_2.jpg"])
+
+    # a claims IMG_1 and fails after b has skipped it
+    staged = StagedFiles(stage)
+    assert staged.claim("a", "IMG_1.jpg", SIZE)
+    counts = copy(stage, staged, "b")
+    assert counts["duplicate"] == 1 and counts["error"] == 1
+    copy(stage, staged, "a")
+
+    phones["b"].failing.clear()
+    counts = copy(stage, StagedFiles(stage), "b", a_resume=True)
+    assert counts["copied"] == 2 and counts["resumed"] == 0
+    assert os.path.exists(os.path.join(stage, "b", "IMG_1.jpg"))
@@ -0,0 +1,86 @@
+import os
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+class FakeItem:
+    def __init__(self, a_name, a_chunks, a_pause, a_size=0):
+        self.Name = a_name
+        self.chunks = a_chunks
+        self.pause = a_pause
+        self.size = a_size
+
+    def ExtendedProperty(self, a_name):
+        return self.size
+
+class FakeFolder:
+    """Shell folder writing the chunks of an item with a pause in between."""
+    def __init__(self, a_path):
+        self.path = a_path
+
+    def CopyHere(self, a_item, a_flags):
+        def write():
+            with open(os.path.join(self.path, a_item.Name), "wb") as f:
+                for chunk in a_item.chunks:
+                    f.write(b"x" * chunk)
+                    f.flush()
+                    time.sleep(a_item.pause)
+        threading.Thread(target=write, daemon=True).start()
+
+class FakePhone:
+    def __init__(self, a_items, a_sizes):
+        self.items = a_items
+        self.sizes = a_sizes
+
+    def getFileItem(self, a_file_name):
+        return self.items.get(a_file_name)
+
+    def getFileSize(self, a_file_name):
+        return self.sizes.get(a_file_name, 0)
+
+@pytest.fixture
+def engine_class(monkeypatch):
+    # PhoneTools needs the Shell of pywin32 only to connect, the engine is given its folders
+    win32com = types.ModuleType("win32com")
+    win32com.client = types.ModuleType("win32com.client")
+    monkeypatch.setitem(sys.modules, "win32com", win32com)
+    monkeypatch.setitem(sys.modules, "win32com.client", win32com.client)
+    monkeypatch.delitem(sys.modules, "PhoneTools", raising=False)
+    import PhoneTools
+    monkeypatch.setattr(PhoneTools.log, "quiet", True)
+    engine = PhoneTools.TransferEngine
+    monkeypatch.setattr(engine, "poll_interval", 0.01)
+    monkeypatch.setattr(engine, "settle_time", 0.5)
+    return engine
+
+def run(a_engine_class, a_path, a_items, a_sizes):
+    engine = a_engine_class(FakePhone(a_items, a_sizes), FakeFolder(str(a_path)), str(a_path), 2)
+    return dict(engine.run(list(a_items)))
+
+def test_unknown_size_waits_for_stalls(tmp_path, engine_class):
+    # Stalls of 0.2s between the chunks, much longer than a poll
+    items = {"a.jpg": FakeItem("a.jpg", [1000, 1000, 1000], 0.2)}
+    assert run(engine_class, tmp_path, items, {}) == {"a.jpg": True}
+    assert os.path.getsize(tmp_path / "a.jpg") == 3000
+
+def test_size_asked_to_the_item(tmp_path, engine_class, monkeypatch):
+    monkeypatch.setattr(engine_class, "settle_time", 60)
+    items = {"a.jpg": FakeItem("a.jpg", [1000, 1000], 0.05, a_size=2000)}
+    start = time.time()
+    assert run(engine_class, tmp_path, items, {}) == {"a.jpg": True}
+    assert time.time() - start < 5
+
+def test_growing_at_deadline_fails(tmp_path, engine_class, monkeypatch):
+    monkeypatch.setattr(engine_class, "timeout", 0.3)
+    items = {"a.jpg": FakeItem("a.jpg", [100] * 20, 0.05), "b.jpg": FakeItem("b.jpg", [100], 0)}
+    assert run(engine_class, tmp_path, items, {"a.jpg": 2000, "b.jpg": 100}) == {"a.jpg": False, "b.jpg": True}
+    time.sleep(1.2)
+    # The partial file was removed once the copy let it go, or is left for the next run
+    assert not os.path.exists(tmp_path / "a.jpg") or os.path.getsize(tmp_path / "a.jpg") < 2000
+
+def test_missing_item(tmp_path, engine_class):
+    engine = engine_class(FakePhone({}, {}), FakeFolder(str(tmp_path)), str(tmp_path))
+    assert list(engine.run(["a.jpg"])) == [("a.jpg", False)]
@@ -0,0 +1,33 @@
+import io
+
+import pytest
+
+import utils
+from utils import IsNetworkPath
+
+mounts = """\
+/dev/sda1 / ext4 rw 0 0
+nas:/photos /mnt/nas nfs4 rw 0 0
+/dev/sdb1 /mnt/nas2 ext4 rw 0 0
+"""
+
+@pytest.fixture
+def proc_mounts(monkeypatch):
+    real_open = open
+    def fake_open(a_path, *args, **kwargs):
+        if a_path == "/proc/mounts":
+            return io.StringIO(mounts)
+        return real_open(a_path, *args, **kwargs)
+    monkeypatch.setattr(utils.sys, "platform", "linux")
+    monkeypatch.setattr("builtins.open", fake_open)
+
+@pytest.mark.parametrize("path, network", [
+    ("/mnt/nas", True),
+    ("/mnt/nas/2023-05-20", True),
+    ("/mnt/nas2", False),
+    ("/mnt/nas2/2023-05-20", False),
+    ("/home/photos", False),
+    ("//server/share", True),
+])
+def test_network_path(proc_mounts, path, network):
+    assert IsNetworkPath(path) == network
@@ -1,4 +1,79 @@
 import os
+import sys
+from collections import namedtuple
 
 def GetSourceFiles(a_source_dir):
     return os.listdir(a_source_dir)
+
+# A staged file and the stat data gathered while listing it.
+# rel_path is the path relative to the staging folder.
+SourceFile = namedtuple("SourceFile", ["name", "path", "rel_path", "size", "mtime"])
+
+# Yield the files of a staging folder as SourceFile entries.
+# The folder is listed with os.scandir, so the entry type costs nothing and
+# the size and mtime cost at most one stat per file (none on Windows). If
+# a_recursive is True, the subfolders are walked as well, except for hidden
+# ones such as the temporary folder of an ongoing copy from the phone.
+# If a_name_filter is set, only the files whose name it accepts are
+# returned, the others are not even stat'ed.
+def ScanSourceFiles(a_source_dir, a_recursive=False, a_name_filter=None):
+    folders = [(a_source_dir, "")]
+    while folders:
+        folder, rel_folder = folders.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_folder, entry.name) if rel_folder else entry.name
+                if entry.is_dir():
+                    if a_recursive and not entry.name.startswith("."):
+                        folders.append((entry.path, rel_path))
+                    continue
+                if not entry.is_file():
+                    continue
+                if a_name_filter and not a_name_filter(entry.name):
+                    continue
+                st = entry.stat()
+                yield SourceFile(entry.name, entry.path, rel_path, st.st_size, st.st_mtime)
+
+# Detect whether a path lives on a network share (UNC path, mapped network
+# drive on Windows, or an NFS/SMB mount on Linux).
+def IsNetworkPath(a_path):
+    full_path = os.path.abspath(a_path)
+    if full_path.startswith("\\\\") or full_path.startswith("//"):
+        return True
+
+    if sys.platform == "win32":
+        import ctypes
+        DRIVE_REMOTE = 4
+        drive, _ = os.path.splitdrive(full_path)
+        if not drive:
+            return False
+        return ctypes.windll.kernel32.GetDriveTypeW(drive + "\\") == DRIVE_REMOTE
+
+    # Find the longest mount point containing the path and check its type
+    network_types = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs")
+    best_mount = ""
+    best_type = ""
+    try:
+        with open("/proc/mounts") as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point, fs_type = fields[1], fields[2]
+                # /mnt/nas contains /mnt/nas/photos, not /mnt/nas2
+                contains = full_path == mount_point or full_path.startswith(mount_point.rstrip("/") + "/")
+                if contains and len(mount_point) > len(best_mount):
+                    best_mount = mount_point
+                    best_type = fs_type
+    except OSError:
+        return False
+    return best_type in network_types
+
+# Number of files to keep in flight when importing to a_dest_dir.
+# Network shares are latency bound and benefit from many outstanding requests,
+# local disks saturate quickly and only need a few.
+def DefaultJobCount(a_dest_dir):
+    cpu_count = os.cpu_count() or 1
+    if IsNetworkPath(a_dest_dir):
+        return min(16, cpu_count * 4)
+    return max(2, min(4, cpu_count))